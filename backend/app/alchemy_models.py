@@ -1,8 +1,28 @@
 """Collection of ORM models for the database."""
 from uuid import uuid4
-from sqlalchemy import Column, Float, Integer, String, ForeignKey, TIMESTAMP, TEXT, text
+from sqlalchemy import Column, Computed, Float, Index, Integer, String, ForeignKey, TIMESTAMP, TEXT, UniqueConstraint, func, text
 from sqlalchemy.orm import relationship
-from app.database import Base, engine
+from app.database import Base
+from app.geo import TILES_PER_DEGREE
+
+# Current time in UTC to the millisecond, as stamped on changed rows. Stamps of this format compare as text
+STAMP_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def now():
+    """Returns the SQL expression of the current stamp, evaluated by SQLite as the statement runs."""
+    return func.strftime("%Y-%m-%d %H:%M:%f", "now")
+
+
+class ChangeTracked:
+    """Columns telling when a row last changed and when it was deleted, for clients syncing incrementally.
+
+    Rows are stamped by the statements writing them, while they hold SQLite's write lock, so stamps follow
+    the order in which transactions write.
+    """
+    updated_at = Column(TIMESTAMP, default=now(), onupdate=now(), server_default=text(f"({STAMP_SQL})"), index=True)
+    deleted_at = Column(TIMESTAMP)
+
 
 # ORM models
 
@@ -16,13 +36,16 @@ class Item(Base):
     survivors = relationship("Inventory", back_populates="item")
 
 
-class Survivor(Base):
+class Survivor(ChangeTracked, Base):
     """Model for survivors in the Zombie Apocalypse app."""
     __tablename__ = "survivors"
     id = Column(TEXT, primary_key=True, default=lambda: str(uuid4()))
     name = Column(String, index=True)
     age = Column(Integer)
     gender = Column(String)
+    # Number of infection reports filed against the survivor, maintained alongside the reports
+    infection_count = Column(Integer, nullable=False,
+                             default=0, server_default=text("0"), index=True)
     lastLocation = relationship(
         "LatLong", back_populates="survivor", uselist=False)
     infectionReports = relationship(
@@ -33,30 +56,43 @@ class Survivor(Base):
     )
     inventory = relationship("Inventory", back_populates="survivor")
 
+    # Case-insensitive lookups and prefix searches by name, see app.crud.name_key
+    __table_args__ = (Index("ix_survivors_name_lower", func.lower(name), id),)
+
 
-class LatLong(Base):
+class LatLong(ChangeTracked, Base):
     """Model for the last known location of a survivor."""
     __tablename__ = "latlong"
     id = Column(TEXT, primary_key=True, default=lambda: str(uuid4()))
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
-    survivor_id = Column(TEXT, ForeignKey("survivors.id"))
+    survivor_id = Column(TEXT, ForeignKey("survivors.id"), index=True)
+    # Map tile the location falls into, see app.geo.tile_of
+    tile_lat = Column(Integer, Computed(
+        f"CAST((latitude + 90) * {TILES_PER_DEGREE} AS INTEGER)"))
+    tile_lon = Column(Integer, Computed(
+        f"CAST((longitude + 180) * {TILES_PER_DEGREE} AS INTEGER)"))
     survivor = relationship("Survivor", back_populates="lastLocation")
 
+    __table_args__ = (Index("ix_latlong_tile", "tile_lat", "tile_lon"),)
+
 
-class InfectionReport(Base):
+class InfectionReport(ChangeTracked, Base):
     """Model for reports of infection between survivors."""
     __tablename__ = "infection_reports"
     id = Column(TEXT, primary_key=True, default=lambda: str(uuid4()))
     created_at = Column(TIMESTAMP, server_default=text("CURRENT_TIMESTAMP"))
-    reported_id = Column(TEXT, ForeignKey("survivors.id"))
+    reported_id = Column(TEXT, ForeignKey("survivors.id"), index=True)
     reporter_id = Column(TEXT, ForeignKey("survivors.id"))
     reported = relationship("Survivor", foreign_keys=[
                             reported_id], back_populates="infectionReports")
     reporter = relationship("Survivor", foreign_keys=[reporter_id])
 
+    __table_args__ = (UniqueConstraint(
+        "reporter_id", "reported_id", name="uq_infection_reports_reporter_reported"),)
 
-class Inventory(Base):
+
+class Inventory(ChangeTracked, Base):
     """Model for the inventory of a survivor."""
     __tablename__ = "inventory"
     survivor_id = Column(TEXT, ForeignKey("survivors.id"), primary_key=True)
@@ -66,4 +102,40 @@ class Inventory(Base):
     item = relationship("Item", back_populates="survivors")
 
 
-Base.metadata.create_all(bind=engine)
+class Offer(Base):
+    """Model for a standing offer to give a quantity of an item for a quantity of another item worth as much."""
+    __tablename__ = "offers"
+    id = Column(TEXT, primary_key=True, default=lambda: str(uuid4()))
+    survivor_id = Column(TEXT, ForeignKey("survivors.id"), nullable=False, index=True)
+    give_item_id = Column(TEXT, ForeignKey("items.id"), nullable=False)
+    give_quantity = Column(Integer, nullable=False)
+    want_item_id = Column(TEXT, ForeignKey("items.id"), nullable=False)
+    want_quantity = Column(Integer, nullable=False)
+    # Stamped to the millisecond like changed rows, as offers are matched oldest first
+    created_at = Column(TIMESTAMP, default=now(), server_default=text(f"({STAMP_SQL})"), index=True)
+
+
+class DataVersion(Base):
+    """Model for the number of committed writes to a resource, see app.versions."""
+    __tablename__ = "data_versions"
+    resource = Column(TEXT, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+class NameTrigram(Base):
+    """Model for the trigrams of survivor names, indexing them for fuzzy search."""
+    __tablename__ = "name_trigrams"
+    trigram = Column(TEXT, primary_key=True)
+    survivor_id = Column(TEXT, ForeignKey("survivors.id"), primary_key=True)
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+
+class TrigramCount(Base):
+    """Model for the number of survivor names each trigram appears in."""
+    __tablename__ = "trigram_counts"
+    trigram = Column(TEXT, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
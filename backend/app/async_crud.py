@@ -0,0 +1,46 @@
+"""Asynchronous counterparts of the read operations in app.crud, for routes running on the event loop.
+
+The operations run against the synchronous facade of an AsyncSession, so the queries are shared with
+app.crud while the database I/O is awaited on the event loop instead of blocking a worker thread.
+Only bounded reads belong here: the operations run on the event loop thread, so their Python work holds up
+every other request. Writes and the survivor listings, which rank and format whole populations, stay on the
+synchronous session in the threadpool.
+"""
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.pydantic_models import Item
+import app.crud as crud
+
+
+async def get_possible_items(db: AsyncSession, data_version: Optional[int] = None) -> List[Item]:
+    """Returns all items in the system, as of at least the given data version of the items."""
+    return await db.run_sync(crud.get_possible_items, data_version)
+
+
+async def get_items_version(db: AsyncSession) -> int:
+    """Returns the data version of the items, to be taken before reading them."""
+    return await db.run_sync(crud.get_items_version)
+
+
+async def search_survivors(
+        db: AsyncSession,
+        prefix: str,
+        limit: int,
+        cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Returns a page of the non-infected survivors whose name starts with the prefix, and the next cursor."""
+    return await db.run_sync(crud.search_survivors, prefix, limit, cursor)
+
+
+async def fuzzy_search_survivors(db: AsyncSession, name: str, limit: int, min_similarity: float) -> List[Dict]:
+    """Returns the non-infected survivors whose name is most similar to the given one, most similar first."""
+    return await db.run_sync(crud.fuzzy_search_survivors, name, limit, min_similarity)
+
+
+async def get_survivor_by_name_or_id(db: AsyncSession, name_or_id: str) -> Optional[Dict]:
+    """Returns a survivor by name or ID, raising an error if infected."""
+    return await db.run_sync(crud.get_survivor_by_name_or_id, name_or_id)
+
+
+async def get_offers(db: AsyncSession, limit: int) -> List[Dict]:
+    """Returns the open offers of the listed survivors, oldest first."""
+    return await db.run_sync(crud.get_offers, limit)
@@ -0,0 +1,73 @@
+"""In-process cache of the item catalogue."""
+from threading import Lock
+from typing import Dict, Optional
+from uuid import UUID
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.alchemy_models import Item as ItemModel
+from app.pydantic_models import Item
+from app.versions import ITEMS, data_versions
+
+
+class ItemCatalogue:
+    """Caches the items that can be carried and traded, keyed by ID.
+
+    The catalogue almost never changes, so it is read once and served from memory until invalidated.
+    Every invalidation bumps the version, so a read that raced with a write is never cached. Callers
+    holding the data version of the items, such as the items route, also get the items read again once
+    another process has written them.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._items: Optional[Dict[UUID, Item]] = None
+        self._data_version: Optional[int] = None
+        self.version = 0
+
+    def get(self, db: Session, data_version: Optional[int] = None) -> Dict[UUID, Item]:
+        """Returns the catalogue, reading it from the database if it is not cached or older than a data version."""
+        items = self._items
+        if items is not None and (data_version is None or data_version == self._data_version):
+            return items
+
+        version = self.version
+        items = {UUID(item.id): Item.model_validate(item)
+                 for item in db.query(ItemModel).all()}
+
+        with self._lock:
+            if self.version == version:
+                self._items = items
+                self._data_version = data_version
+        return items
+
+    def invalidate(self):
+        """Drops the cached catalogue, to be called whenever items are written."""
+        with self._lock:
+            self.version += 1
+            self._items = None
+
+
+item_catalogue = ItemCatalogue()
+
+
+# Invalidate the catalogue whenever items are written through the ORM
+
+@event.listens_for(Session, "after_flush")
+def _track_item_writes(session, flush_context):
+    """Flags sessions that have written items, bumping the data version of the items in the same transaction."""
+    if any(isinstance(obj, ItemModel) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["items_written"] = True
+        data_versions.bump(session.connection(), ITEMS)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_item_writes(session):
+    """Invalidates the catalogue once written items are committed."""
+    if session.info.pop("items_written", False):
+        item_catalogue.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_item_writes(session):
+    """Forgets item writes that were rolled back."""
+    session.info.pop("items_written", None)
@@ -0,0 +1,136 @@
+"""In-process fan-out of survivor changes to the clients following them as Server-Sent Events."""
+import asyncio
+import logging
+import os
+from itertools import count
+from threading import Lock
+from typing import AsyncIterator, Dict, Optional, Tuple
+import orjson
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Changes a client can fall behind by before it is disconnected, picked with the ZOMBIE_CHANGE_QUEUE_SIZE
+# environment variable
+CHANGE_QUEUE_SIZE = int(os.environ.get("ZOMBIE_CHANGE_QUEUE_SIZE", "1000"))
+
+# Seconds without changes after which clients are sent a comment, so idle connections are not cut by proxies
+HEARTBEAT_SECONDS = 15.0
+
+# Kinds of change
+CREATED = "survivor.created"
+MOVED = "survivor.moved"
+DELETED = "survivor.deleted"
+INFECTED = "survivor.infected"
+INVENTORY = "survivor.inventory"
+
+# Last event of a client that fell too far behind, telling it to fetch the survivors again
+RESYNC = b"event: resync\ndata: {}\n\n"
+HEARTBEAT = b": heartbeat\n\n"
+
+# Put in a queue to end its stream
+_END = b""
+
+
+class Subscription:
+    """A client following the changes, with the queue of events waiting to be sent to it."""
+    __slots__ = ("loop", "queue", "evicted")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, size: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size + 1)  # Room for the last event
+        self.evicted = False
+
+    def deliver(self, event: bytes):
+        """Queues an event, evicting the client instead when it has fallen too far behind. Runs in its loop."""
+        if self.evicted:
+            return
+
+        if event is not _END and self.queue.qsize() >= self.queue.maxsize - 1:
+            self.evicted = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            metrics.increment("change_feed_evictions_total", ())
+            logger.info("Disconnected a client of the change feed that fell %d changes behind", self.queue.maxsize - 1)
+            event = _END
+        self.queue.put_nowait(event)
+
+    async def events(self) -> AsyncIterator[bytes]:
+        """Yields the events to send to the client as they come, with heartbeats in between."""
+        while True:
+            try:
+                event = await asyncio.wait_for(self.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+                continue
+            if event is _END:
+                return
+            yield event
+
+
+class ChangeBroker:
+    """Hands every change to each client following them.
+
+    Changes are published by the write paths once committed, from whichever thread runs them. Each one is
+    encoded once and handed to every client in the loop serving it, where it waits in a bounded queue until
+    sent. A client falling further behind than its queue holds is sent a last event telling it to fetch the
+    survivors again and disconnected, so a slow client never holds up the others or grows without bound.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._subscriptions: Tuple[Subscription, ...] = ()
+        self._ids = count(1)
+
+    def subscribe(self, size: Optional[int] = None) -> Subscription:
+        """Starts following the changes, from the loop that will serve them."""
+        subscription = Subscription(asyncio.get_running_loop(), size or CHANGE_QUEUE_SIZE)
+        with self._lock:
+            self._subscriptions = (*self._subscriptions, subscription)
+        metrics.increment("change_feed_subscribers", ())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Stops following the changes."""
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        metrics.increment("change_feed_subscribers", (), -1)
+
+    async def follow(self) -> AsyncIterator[bytes]:
+        """Yields the events of a new client until it disconnects, is evicted or the feed is closed."""
+        subscription = self.subscribe()
+        try:
+            async for event in subscription.events():
+                yield event
+        finally:
+            self.unsubscribe(subscription)
+
+    def publish(self, kind: str, change: Dict):
+        """Hands a committed change to every client, encoded as a Server-Sent Event."""
+        if not self._subscriptions:
+            return
+
+        data = orjson.dumps(change)
+        with self._lock:  # Hands the events over in the order of their IDs
+            event = b"id: %d\nevent: %s\ndata: %s\n\n" % (next(self._ids), kind.encode(), data)
+            for subscription in self._subscriptions:
+                self._call_in_loop(subscription, event)
+
+    def close(self):
+        """Ends the stream of every client, such as when the API shuts down."""
+        for subscription in self._subscriptions:
+            self._call_in_loop(subscription, _END)
+
+    @staticmethod
+    def _call_in_loop(subscription: Subscription, event: bytes):
+        """Delivers an event in the loop of a client, which may be gone by then."""
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+        except RuntimeError:  # The loop is closed, the client with it
+            pass
+
+
+survivor_changes = ChangeBroker()
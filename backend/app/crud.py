@@ -1,57 +1,70 @@
 """CRUD operations for the Survivors API."""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from uuid import uuid4, UUID
-from math import cos, radians, sqrt
-from typing import List, Dict, Optional
-from sqlalchemy import func, or_
-from sqlalchemy.orm import Session
-from app.pydantic_models import LatLongCreate, SurvivorTradePayload
-from app.alchemy_models import InfectionReport, Inventory, Item, LatLong, Survivor
+from math import isinf
+from string import ascii_lowercase, ascii_uppercase
+from typing import Iterator, List, Dict, Optional, Tuple, Union
+import numpy as np
+from sqlalchemy import String, and_, delete, func, or_, select, type_coerce
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from app.pydantic_models import Item as ItemSchema, LatLongCreate, SurvivorCreate, SurvivorTradePayload
+from app.alchemy_models import InfectionReport, Inventory, LatLong, Offer, Survivor, now
+from app.catalogue import item_catalogue
+from app.change_feed import CREATED, DELETED, INFECTED, INVENTORY, MOVED, survivor_changes
+from app.database import retry_on_busy
+from app.geo import EQUIRECTANGULAR, bounding_box, distances, nearest, tile_of
+from app.location_buffer import location_buffer
+from app.order_book import OpenOffer, order_book
+from app.name_search import find_candidates, index_names, similarity, trigrams, unindex_names
+from app.spatial_index import survivor_index
+from app.versions import ITEMS, SURVIVORS, data_versions
+
+# Number of infection reports after which a survivor is considered infected
+INFECTION_THRESHOLD = 3
+
+# Criteria of the survivors listed to others: not deleted and not infected
+LISTED = (Survivor.deleted_at.is_(None), Survivor.infection_count < INFECTION_THRESHOLD)
+
+# Relationships read by format_survivor_response, fetched in one batched query each
+# rather than lazily per survivor
+SURVIVOR_RESPONSE_OPTIONS = (
+    selectinload(Survivor.lastLocation),
+    selectinload(Survivor.infectionReports),
+    selectinload(Survivor.inventory),
+)
+
+# IDs, latitudes and longitudes of no survivors at all
+NO_POSITIONS = (np.array([], dtype=str), np.array([], dtype=np.float64), np.array([], dtype=np.float64))
+
+# Number of survivors fetched from the database cursor at a time when streaming
+STREAM_BATCH_SIZE = 500
+
+ASCII_LOWERCASE = str.maketrans(ascii_uppercase, ascii_lowercase)
 
 
 # Helper functions
 
-def exclude_requesting_user(survivors: List[Survivor], user_id: str):
-    """Finds the requesting survivor and removes them from the list."""
-    requesting_survivor = next(
-        (s for s in survivors if str(s.id) == user_id), None)
-    survivors = [s for s in survivors if str(s.id) != user_id]
-    return requesting_survivor, survivors
+def format_survivor_response(survivor: Survivor, distance: Optional[float] = None) -> Dict:
+    """Formats a survivor into a dictionary for API response, adding distance if needed.
 
-
-def calculate_distance(survivor: Survivor, reference: Survivor) -> Optional[float]:
-    """Calculates distance between two survivors using Pythagoras."""
-    if not reference or not reference.lastLocation or not survivor.lastLocation:
-        return None  # No valid location to calculate
-
-    x1, y1 = reference.lastLocation.latitude, reference.lastLocation.longitude
-    x2, y2 = survivor.lastLocation.latitude, survivor.lastLocation.longitude
-
-    # Scaling factors
-    lat_m = 111_000  # Meters per degree latitude
-    # Meters per degree longitude at this latitude
-    lon_m = 111_320 * cos(radians(x1))
-
-    # Convert degrees to meters
-    lat_diff_m = (x2 - x1) * lat_m
-    lon_diff_m = (y2 - y1) * lon_m
-
-    # Rounded for readability
-    return round(sqrt(lat_diff_m ** 2 + lon_diff_m ** 2), 2)
-
-
-def format_survivor_response(survivor: Survivor, reference: Optional[Survivor] = None) -> Dict:
-    """Formats a survivor into a dictionary for API response, adding distance if needed."""
+    The dictionary holds the fields of the Survivor response model in the same order and as JSON-ready values,
+    so listings can serialize it without validating it against the model again.
+    """
+    latitude, longitude = get_position(survivor) or (None, None)
     return {
         "id": survivor.id,
         "name": survivor.name,
         "age": survivor.age,
         "gender": survivor.gender,
+        "inventory": {str(item.item_id): item.quantity for item in survivor.inventory},
         "lastLocation": {
             "id": survivor.lastLocation.id,
-            "latitude": survivor.lastLocation.latitude,
-            "longitude": survivor.lastLocation.longitude,
-            "survivor_id": survivor.lastLocation.survivor_id,
-            "distance": calculate_distance(survivor, reference)
+            "latitude": latitude,
+            "longitude": longitude,
+            "distance": distance,
+            "survivor_id": survivor.lastLocation.survivor_id
         } if survivor.lastLocation else None,
         "infectionReports": [
             {
@@ -60,67 +73,371 @@ def format_survivor_response(survivor: Survivor, reference: Optional[Survivor] =
                 "reported_id": report.reported_id,
                 "created_at": report.created_at
             } for report in survivor.infectionReports
-        ],
-        "inventory": {str(item.item_id): item.quantity for item in survivor.inventory}
+        ]
     }
 
 
-def estimate_trade_value(items: Dict[UUID, int], master_list: List[Item]) -> int:
-    """Estimates the total value of a trade."""
+def encode_cursor(survivor_id: str, distance: Optional[float] = None) -> str:
+    """Encodes the position of a survivor in a listing into an opaque pagination cursor."""
+    return _encode_position({"id": survivor_id, "distance": distance})
+
+
+def decode_cursor(cursor: str) -> Tuple[str, Optional[float]]:
+    """Decodes a pagination cursor into the ID and distance of the survivor it points at."""
+    return _decode_position(cursor, {"id": str, "distance": (int, float, type(None))})
+
+
+def encode_name_cursor(name_key: str, survivor_id: str) -> str:
+    """Encodes the position of a survivor in a listing by name into an opaque pagination cursor."""
+    return _encode_position({"name": name_key, "id": survivor_id})
+
+
+def decode_name_cursor(cursor: str) -> Tuple[str, str]:
+    """Decodes a pagination cursor into the name key and ID of the survivor it points at."""
+    return _decode_position(cursor, {"name": str, "id": str})
+
+
+def _encode_position(position: Dict) -> str:
+    """Encodes the sort key of a row into a pagination cursor."""
+    return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def _decode_position(cursor: str, fields: Dict[str, Union[type, Tuple[type, ...]]]) -> Tuple:
+    """Decodes a pagination cursor into the values of the given fields, checking their types."""
+    try:
+        position = json.loads(urlsafe_b64decode(cursor.encode()))
+        values = tuple(position[field] for field in fields)
+        if not all(isinstance(value, types) for value, types in zip(values, fields.values())):
+            raise ValueError
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid pagination cursor") from e
+
+    return values
+
 
-    item_lookup = {str(item.id): item.worth for item in master_list}
+def encode_sync_token(stamp: str) -> str:
+    """Encodes the stamp of the latest change a client has seen into an opaque sync token."""
+    return _encode_position({"since": stamp})
 
-    return sum(quantity * item_lookup.get(str(item_id), 0) for item_id, quantity in items.items())
+
+def decode_sync_token(token: str) -> str:
+    """Decodes a sync token into the stamp of the latest change the client has seen."""
+    try:
+        return _decode_position(token, {"since": str})[0]
+    except ValueError as e:
+        raise ValueError("Invalid sync token") from e
+
+
+def changed_since(column, since: str):
+    """Returns the SQL criterion of a stamp column being at or after a stamp, compared as text like it is stored."""
+    return type_coerce(column, String) >= since
+
+
+def changed_survivor_ids(since: str):
+    """Returns a query of the IDs of the survivors whose row, location, inventory or reports changed since a stamp.
+
+    Each table is searched through the index on its stamps, so the cost follows how much changed.
+    """
+    return (
+        select(Survivor.id).where(changed_since(Survivor.updated_at, since))
+        .union(select(LatLong.survivor_id).where(changed_since(LatLong.updated_at, since)),
+               select(Inventory.survivor_id).where(changed_since(Inventory.updated_at, since)),
+               select(InfectionReport.reported_id).where(changed_since(InfectionReport.updated_at, since)))
+    )
+
+
+def name_key(name: str) -> str:
+    """Lowercases a name the way SQLite's lower() does, which only folds ASCII letters.
+
+    Must match the lower(name) expression the survivor name index is built on.
+    """
+    return name.translate(ASCII_LOWERCASE)
+
+
+def estimate_trade_value(items: Dict[UUID, int], catalogue: Dict[UUID, ItemSchema]) -> int:
+    """Estimates the total value of a trade."""
+    return sum(quantity * catalogue[item_id].worth
+               for item_id, quantity in items.items() if item_id in catalogue)
 
 # CRUD operations
 
 
-def get_possible_items(db: Session):
-    """Returns all items in the system."""
-    return db.query(Item).all()
+def get_possible_items(db: Session, data_version: Optional[int] = None) -> List[ItemSchema]:
+    """Returns all items in the system, as of at least the given data version of the items."""
+    return list(item_catalogue.get(db, data_version).values())
 
 
-def get_survivors(db: Session, user_id: Optional[str] = None, max_distance: Optional[int] = None):
-    """Handles survivor retrieval based on filters and sorts them by distance if a user ID is provided."""
-    survivors = [s for s in db.query(
-        Survivor).all() if len(s.infectionReports) < 3]
+def get_items_version(db: Session) -> int:
+    """Returns the data version of the items, to be taken before reading them."""
+    return data_versions.get(db, ITEMS)
 
-    if not user_id:
-        # Early exit
-        return [format_survivor_response(s) for s in survivors]
 
-    # Exclude the requesting user
-    requesting_survivor, survivors = exclude_requesting_user(
-        survivors, user_id)
+def get_survivors_version(db: Session) -> str:
+    """Returns the data version of the survivors as this process lists them, to be taken before reading them.
+
+    Positions waiting in the location buffer are listed before they are committed, so while there are any,
+    the committed version is qualified by the version of the buffer.
+    """
+    version = str(data_versions.get(db, SURVIVORS))
+    buffered = location_buffer.version()
+    return f"{version}.{buffered}" if buffered else version
+
+
+def get_live_survivor(db: Session, survivor_id: str) -> Optional[Survivor]:
+    """Returns a survivor by ID, or None if there is no such survivor or they were deleted."""
+    survivor = db.query(Survivor).get(survivor_id)
+    return survivor if survivor is not None and survivor.deleted_at is None else None
+
+
+def get_change_stamp(db: Session) -> str:
+    """Returns the latest stamp of any committed change to the survivors, to be taken before reading them.
+
+    Transactions stamp their rows while holding the write lock, so any change committed later is stamped at
+    or after it and shows up when reading the changes since.
+    """
+    stamps = [
+        db.query(func.max(model.updated_at, type_=String)).scalar()
+        for model in (Survivor, LatLong, Inventory, InfectionReport)
+    ]
+    return max((stamp for stamp in stamps if stamp), default="")
+
+
+def get_sync_token(db: Session) -> str:
+    """Returns a sync token for the survivors as they are now, to be taken before reading them."""
+    return encode_sync_token(get_change_stamp(db))
+
+
+def get_removed_survivors(db: Session, sync_token: str) -> List[str]:
+    """Returns the IDs of the survivors deleted or infected since a sync token, who are no longer listed."""
+    return removed_survivor_ids(db, decode_sync_token(sync_token))
+
+
+def removed_survivor_ids(db: Session, since: str) -> List[str]:
+    """Returns the IDs of the survivors deleted or infected since a stamp, in the order they last changed.
+
+    Ordered by the stamp the survivors are searched by, so the cost follows how many changed.
+    """
+    return [survivor_id for survivor_id, in (
+        db.query(Survivor.id)
+        .filter(changed_since(Survivor.updated_at, since),
+                or_(Survivor.deleted_at.isnot(None), Survivor.infection_count >= INFECTION_THRESHOLD))
+        .order_by(Survivor.updated_at)
+    )]
+
+
+def get_position(survivor: Survivor) -> Optional[Tuple[float, float]]:
+    """Returns a survivor's latest known (latitude, longitude), preferring a position waiting in the location buffer."""
+    if not survivor.lastLocation:
+        return None
+    return location_buffer.get(survivor.id) or (survivor.lastLocation.latitude, survivor.lastLocation.longitude)
 
-    # Format and calculate distances
-    survivor_list = [format_survivor_response(
-        s, requesting_survivor) for s in survivors]
 
-    # Sort by distance (None distances go last)
-    survivor_list.sort(
-        key=lambda s: (s["lastLocation"]["distance"] is None,
-                       s["lastLocation"]["distance"] or 0)
+def get_survivor_positions(
+        db: Session,
+        exclude_id: Optional[str] = None,
+        location: Optional[Tuple[float, float]] = None,
+        max_distance: Optional[float] = None,
+        since: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the IDs, latitudes and longitudes of the listed survivors, ordered by ID.
+
+    Given a (latitude, longitude) and max distance, candidates are picked by map tile and bounding box in SQL,
+    so the cost depends on how crowded the area is rather than on the total population. Exact distances are
+    left to the caller. Unknown positions are NaN, buffered positions take precedence over stored ones.
+    Given a stamp, only the survivors changed since are returned.
+    """
+    buffered = location_buffer.snapshot()
+
+    query = (
+        db.query(Survivor.id, LatLong.latitude, LatLong.longitude)
+        .outerjoin(LatLong, LatLong.survivor_id == Survivor.id)
+        .filter(*LISTED)
+        .order_by(Survivor.id)
     )
+    if since is not None:
+        query = query.filter(Survivor.id.in_(changed_survivor_ids(since)))
+    if exclude_id:
+        query = query.filter(Survivor.id != exclude_id)
+
+    if location and max_distance:
+        min_lat, max_lat, lon_ranges = bounding_box(
+            *location, max_distance)
+
+        # One range of tiles per range of longitudes, so a box crossing the antimeridian seeks both sides
+        boxes = []
+        for min_lon, max_lon in lon_ranges:
+            min_tile_lat, min_tile_lon = tile_of(min_lat, min_lon)
+            max_tile_lat, max_tile_lon = tile_of(max_lat, max_lon)
+            boxes.append(and_(
+                LatLong.tile_lat.in_(range(min_tile_lat, max_tile_lat + 1)),
+                LatLong.tile_lon.between(min_tile_lon, max_tile_lon),
+                LatLong.latitude.between(min_lat, max_lat),
+                LatLong.longitude.between(min_lon, max_lon)
+            ))
+        in_range = or_(*boxes)
+        # Survivors with a buffered position may have moved into range since it was stored. Their IDs are
+        # bound as a single JSON array, as there can be more of them than SQLite takes parameters
+        if buffered:
+            buffered_ids = func.json_each(json.dumps(list(buffered))).table_valued("value")
+            in_range = or_(in_range, Survivor.id.in_(select(buffered_ids.c.value)))
+        query = query.filter(in_range)
+
+    rows = query.all()
+    if buffered:
+        rows = [(survivor_id, *buffered.get(survivor_id, (latitude, longitude)))
+                for survivor_id, latitude, longitude in rows]
+    ids, latitudes, longitudes = zip(*rows) if rows else ((), (), ())
+    return (np.array(ids, dtype=str),
+            np.array(latitudes, dtype=np.float64),
+            np.array(longitudes, dtype=np.float64))
+
+
+def iter_survivors_by_id(db: Session, survivor_ids: List[str], distances_m: List[float]) -> Iterator[Dict]:
+    """Loads and formats survivors in the given order, a batch at a time."""
+    for start in range(0, len(survivor_ids), STREAM_BATCH_SIZE):
+        batch = survivor_ids[start:start + STREAM_BATCH_SIZE]
+        survivors = {
+            s.id: s for s in
+            db.query(Survivor)
+            .options(*SURVIVOR_RESPONSE_OPTIONS)
+            .filter(Survivor.id.in_(batch), Survivor.deleted_at.is_(None))
+        }
+
+        for survivor_id, distance in zip(batch, distances_m[start:start + STREAM_BATCH_SIZE]):
+            if survivor_id in survivors:  # Skip survivors deleted in the meantime
+                yield format_survivor_response(survivors[survivor_id], None if isinf(distance) else distance)
+
+
+def get_survivors(
+        db: Session,
+        user_id: Optional[str] = None,
+        max_distance: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        method: str = EQUIRECTANGULAR,
+        sync_token: Optional[str] = None) -> Tuple[Iterator[Dict], Optional[str]]:
+    """Handles survivor retrieval based on filters and sorts them by distance if a user ID is provided.
+
+    With a limit, survivors are paged by keyset: by ID, or by distance and then ID when a user ID is provided.
+    Returns an iterator over the page, read lazily from the database cursor where possible, and the cursor
+    of the next page if there may be one. Distances are measured with the given method from app.geo.
+    Given a sync token, only the survivors changed since it was taken are returned.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    since = decode_sync_token(sync_token) if sync_token is not None else None
+
+    if not user_id:
+        query = db.query(Survivor).filter(*LISTED)
+        if since is not None:
+            query = query.filter(Survivor.id.in_(changed_survivor_ids(since)))
+        if after:
+            query = query.filter(Survivor.id > after[0])
+
+        next_cursor = None
+        if limit:
+            # Peek at the last survivor of the page, so the next cursor is known before any rows are read
+            last_id = (
+                query.with_entities(Survivor.id)
+                .order_by(Survivor.id)
+                .offset(limit - 1)
+                .limit(1)
+                .scalar()
+            )
+            if last_id:
+                next_cursor = encode_cursor(last_id)
+
+        page = (
+            query.options(*SURVIVOR_RESPONSE_OPTIONS)
+            .order_by(Survivor.id)
+            .limit(limit)
+            .yield_per(STREAM_BATCH_SIZE)
+        )
+        return (format_survivor_response(s) for s in page), next_cursor
 
+    requesting_survivor = get_live_survivor(db, user_id)
+    reference = get_position(requesting_survivor) if requesting_survivor else None
+
+    if max_distance and not reference:
+        return iter([]), None  # Nobody can be within range of an unknown location
+
+    # Exclude the requesting user
+    survivor_ids, latitudes, longitudes = get_survivor_positions(
+        db, user_id, reference, max_distance, since)
+
+    # Calculate all distances in one go, unknown distances go last
+    if reference:
+        survivor_distances = distances(
+            *reference, latitudes, longitudes, method)
+    else:
+        survivor_distances = np.full(len(survivor_ids), np.inf)
+
+    selected = np.ones(len(survivor_ids), dtype=bool)
     if max_distance:
-        survivor_list = [
-            s for s in survivor_list
-            if s["lastLocation"]["distance"] is not None and s["lastLocation"]["distance"] <= max_distance
-        ]
+        selected &= survivor_distances <= max_distance
+    if after:
+        after_id, after_distance = after
+        after_distance = np.inf if after_distance is None else after_distance
+        selected &= (survivor_distances > after_distance) | (
+            (survivor_distances == after_distance) & (survivor_ids > after_id))
+    survivor_ids, survivor_distances = survivor_ids[selected], survivor_distances[selected]
+
+    # Sort by distance, only as far as the page reaches. The IDs are in order, so ties are broken by ID
+    order = nearest(survivor_distances, limit)
+    page_ids = survivor_ids[order].tolist()
+    page_distances = survivor_distances[order].tolist()
+
+    next_cursor = None
+    if limit and len(page_ids) == limit:
+        last_distance = None if isinf(page_distances[-1]) else page_distances[-1]
+        next_cursor = encode_cursor(page_ids[-1], last_distance)
+
+    return iter_survivors_by_id(db, page_ids, page_distances), next_cursor
+
 
-    return survivor_list
+def get_nearest_survivors(db: Session, user_id: str, k: int) -> List[Dict]:
+    """Returns the k non-infected survivors nearest to a survivor, closest first, from the spatial index."""
+    requesting_survivor = get_live_survivor(db, user_id)
+    if not requesting_survivor:
+        raise ValueError(f"Survivor with id {user_id} not found")
+
+    position = get_position(requesting_survivor)
+    if not position:
+        raise ValueError("Your location is unknown")
+
+    found = survivor_index.nearest(
+        *position, k, user_id, lambda since: read_position_changes(db, since))
+    survivor_ids, distances_m = zip(*found) if found else ((), ())
+    return list(iter_survivors_by_id(db, list(survivor_ids), list(distances_m)))
+
+
+def read_position_changes(db: Session, since: Optional[Tuple[int, str]]):
+    """Returns what the spatial index needs to catch up with the survivors changed since a token, or to be built.
+
+    That is the token to catch up from next time, the positions of the listed survivors changed since the
+    given token, or of all of them, and the IDs of the survivors removed since. Tokens hold the data version
+    of the survivors along with the stamp of the latest change, so nothing but the version is read until
+    another write is committed. Both are taken before reading the changes.
+    """
+    version = data_versions.get(db, SURVIVORS)
+    if since is not None and since[0] == version:
+        return since, NO_POSITIONS, []
+
+    stamp = get_change_stamp(db)
+    positions = get_survivor_positions(db, since=since[1] if since is not None else None)
+    removed = removed_survivor_ids(db, since[1]) if since is not None else []
+    return (version, stamp), positions, removed
 
 
 def get_survivor_by_name_or_id(db: Session, name_or_id: str):
     """Returns a survivor by name or ID, raising an error if infected."""
     survivor = (
         db.query(Survivor)
+        .options(*SURVIVOR_RESPONSE_OPTIONS)
         .filter(
             or_(
-                func.lower(Survivor.name) == name_or_id.lower(),
+                func.lower(Survivor.name) == name_key(name_or_id),
                 Survivor.id == name_or_id
-            )
+            ),
+            Survivor.deleted_at.is_(None)
         )
         .first()
     )
@@ -128,62 +445,190 @@ def get_survivor_by_name_or_id(db: Session, name_or_id: str):
     if not survivor:
         return None  # Not found in the system
 
-    if len(survivor.infectionReports) >= 3:
+    if survivor.infection_count >= INFECTION_THRESHOLD:
         raise ValueError("Survivor is infected!")
 
     return format_survivor_response(survivor)
 
 
+def search_survivors(
+        db: Session,
+        prefix: str,
+        limit: int,
+        cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Returns the non-infected survivors whose name starts with the prefix, ignoring case, ordered by name.
+
+    The prefix is matched as a range of the lowercased name index and paged by keyset on the lowercased name
+    and ID, so every page is a range scan however deep it is. Returns the page and the cursor of the next.
+    """
+    lowered_name = func.lower(Survivor.name)
+    lower_bound = name_key(prefix)
+    upper_bound = prefix_upper_bound(lower_bound)
+
+    query = db.query(Survivor).filter(lowered_name >= lower_bound, *LISTED)
+    if upper_bound:
+        query = query.filter(lowered_name < upper_bound)
+    if cursor:
+        after_name, after_id = decode_name_cursor(cursor)
+        query = query.filter(
+            lowered_name >= after_name,
+            or_(lowered_name > after_name, Survivor.id > after_id))
+
+    page = (
+        query.options(*SURVIVOR_RESPONSE_OPTIONS)
+        .order_by(lowered_name, Survivor.id)
+        .limit(limit)
+        .all()
+    )
+
+    next_cursor = None
+    if len(page) == limit:
+        next_cursor = encode_name_cursor(name_key(page[-1].name), page[-1].id)
+
+    return [format_survivor_response(s) for s in page], next_cursor
+
+
+def fuzzy_search_survivors(db: Session, name: str, limit: int, min_similarity: float) -> List[Dict]:
+    """Returns the non-infected survivors whose name is most similar to the given one, most similar first.
+
+    Similarity is the share of trigrams two names have in common, and candidates are found through the
+    trigram index rather than by comparing every name.
+    """
+    wanted, candidates = find_candidates(
+        db, name, min_similarity, *LISTED)
+
+    matches = []
+    for survivor_id, survivor_name in candidates:
+        score = similarity(wanted, trigrams(survivor_name))
+        if score >= min_similarity:
+            matches.append({"id": survivor_id, "name": survivor_name,
+                           "similarity": round(score, 3)})
+
+    matches.sort(key=lambda match: (-match["similarity"], match["name"], match["id"]))
+    return matches[:limit]
+
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """Returns the smallest string greater than every string starting with the prefix, or None if there is none."""
+    while prefix:
+        if ord(prefix[-1]) < 0x10FFFF:
+            return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        prefix = prefix[:-1]
+    return None
+
+
+def check_items_exist(items: Dict[UUID, int], catalogue: Dict[UUID, ItemSchema]):
+    """Raises an error if any of the items is not in the catalogue."""
+    for item_id in items:
+        if UUID(str(item_id)) not in catalogue:
+            raise ValueError(f"Item with id {item_id} not found")
+
+
+@retry_on_busy
 def create_survivor(db: Session, name: str, age: int, gender: str, location: LatLongCreate, items: dict):
-    """Creates a new survivor with their inventory and location."""
-    survivor = Survivor(id=str(uuid4()), name=name, age=age, gender=gender)
+    """Creates a new survivor with their inventory and location in a single transaction."""
+    check_items_exist(items, item_catalogue.get(db))
+
+    survivor = Survivor(
+        id=str(uuid4()), name=name, age=age, gender=gender,
+        lastLocation=LatLong(id=str(uuid4()), latitude=location.latitude,
+                             longitude=location.longitude),
+        inventory=[Inventory(item_id=str(item_id), quantity=quantity)
+                   for item_id, quantity in items.items() if quantity > 0])
     db.add(survivor)
+    index_names(db, [(survivor.id, name)])
+    data_versions.bump(db, SURVIVORS)
     db.commit()
-    db.refresh(survivor)
+    survivor_index.move(survivor.id, location.latitude, location.longitude)
+    survivor_changes.publish(CREATED, {"survivor_id": survivor.id, "name": name, "age": age, "gender": gender,
+                                       "latitude": location.latitude, "longitude": location.longitude})
 
-    latlong = LatLong(id=str(uuid4()), latitude=location.latitude,
-                      longitude=location.longitude, survivor_id=survivor.id)
-    db.add(latlong)
+    return format_survivor_response(survivor)
 
-    for item_id, quantity in items.items():
-        # Let's check that the desired item exists
-        item = db.query(Item).get(str(item_id))
-        if not item:
-            raise ValueError(f"Item with id {item_id} not found")
 
-        inventory = Inventory(survivor_id=survivor.id,
-                              item_id=str(item_id), quantity=quantity)
-        db.add(inventory)
+@retry_on_busy
+def create_survivors(db: Session, survivors: List[SurvivorCreate]) -> List[str]:
+    """Registers many survivors at once, returning their IDs in order.
+
+    All item IDs are checked against the catalogue before anything is written. Survivors, locations and
+    inventories are then inserted with one executemany each, in a single transaction.
+    """
+    catalogue = item_catalogue.get(db)
+
+    survivor_rows, location_rows, inventory_rows = [], [], []
+    for survivor in survivors:
+        check_items_exist(survivor.inventory, catalogue)
+
+        survivor_id = str(uuid4())
+        survivor_rows.append({"id": survivor_id, "name": survivor.name,
+                              "age": survivor.age, "gender": survivor.gender, "infection_count": 0})
+        location_rows.append({"id": str(uuid4()), "survivor_id": survivor_id,
+                              "latitude": survivor.lastLocation.latitude,
+                              "longitude": survivor.lastLocation.longitude})
+        inventory_rows.extend({"survivor_id": survivor_id, "item_id": str(item_id), "quantity": quantity}
+                              for item_id, quantity in survivor.inventory.items() if quantity > 0)
+
+    for table, rows in ((Survivor.__table__, survivor_rows),
+                        (LatLong.__table__, location_rows),
+                        (Inventory.__table__, inventory_rows)):
+        if rows:
+            db.execute(table.insert(), rows)
+    index_names(db, ((row["id"], row["name"]) for row in survivor_rows))
+    data_versions.bump(db, SURVIVORS)
 
     db.commit()
-    return format_survivor_response(survivor)
+    for survivor, row in zip(survivor_rows, location_rows):
+        survivor_index.move(row["survivor_id"], row["latitude"], row["longitude"])
+        survivor_changes.publish(CREATED, {"survivor_id": survivor["id"], "name": survivor["name"],
+                                           "age": survivor["age"], "gender": survivor["gender"],
+                                           "latitude": row["latitude"], "longitude": row["longitude"]})
+
+    return [row["id"] for row in survivor_rows]
 
 
+@retry_on_busy
 def report_infection(db: Session, reporter_id: str, reported_id: str):
     """Creates a new infection report."""
     if reporter_id == reported_id:
         raise ValueError("A survivor cannot report themselves")
 
-    reporter = db.query(Survivor).get(reporter_id)
+    reporter = get_live_survivor(db, reporter_id)
     if not reporter:
         raise ValueError(f"Survivor with id {reporter_id} not found")
 
-    reported = db.query(Survivor).get(reported_id)
+    reported = get_live_survivor(db, reported_id)
     if not reported:
         raise ValueError(f"Survivor with id {reported_id} not found")
 
     report = InfectionReport(
         id=str(uuid4()), reporter_id=reporter_id, reported_id=reported_id)
-
     db.add(report)
-    db.commit()
+
+    # Keep the infection counter in step with the reports, in the same transaction
+    db.query(Survivor).filter(Survivor.id == reported_id).update(
+        {Survivor.infection_count: Survivor.infection_count + 1})
+    data_versions.bump(db, SURVIVORS)
+
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise ValueError(
+            f"Survivor {reporter_id} has already reported survivor {reported_id}") from e
     db.refresh(report)
+
+    if reported.infection_count >= INFECTION_THRESHOLD:
+        survivor_index.remove(reported_id)
+    # Only the report taking the count to the threshold is news, later ones change nothing for the others
+    if reported.infection_count == INFECTION_THRESHOLD:
+        survivor_changes.publish(INFECTED, {"survivor_id": reported_id})
     return report
 
 
+@retry_on_busy
 def update_location(db: Session, survivor_id: str, latitude: str, longitude: str):
     """Updates a survivor's location."""
-    survivor = db.query(Survivor).get(survivor_id)
+    survivor = get_live_survivor(db, survivor_id)
     if not survivor:
         raise ValueError(f"Survivor with id {survivor_id} not found")
 
@@ -197,62 +642,139 @@ def update_location(db: Session, survivor_id: str, latitude: str, longitude: str
         latlong.latitude = latitude
         latlong.longitude = longitude
 
+    data_versions.bump(db, SURVIVORS)
     db.commit()
+    location_buffer.discard(survivor_id)
     db.refresh(survivor)
+    if survivor.infection_count < INFECTION_THRESHOLD:
+        survivor_index.move(survivor_id, latitude, longitude)
+    survivor_changes.publish(MOVED, {"survivor_id": survivor_id, "latitude": latitude, "longitude": longitude})
     return format_survivor_response(survivor)
 
 
+def buffer_location(db: Session, survivor_id: str, latitude: float, longitude: float) -> Dict:
+    """Accepts a survivor's location into the location buffer, to be stored with the next flush.
+
+    Survivors without a stored location yet have it written straight away.
+    """
+    survivor = (
+        db.query(Survivor.infection_count, LatLong.id)
+        .outerjoin(LatLong, LatLong.survivor_id == Survivor.id)
+        .filter(Survivor.id == survivor_id, Survivor.deleted_at.is_(None))
+        .first()
+    )
+    if not survivor:
+        raise ValueError(f"Survivor with id {survivor_id} not found")
+
+    if survivor.infection_count >= INFECTION_THRESHOLD:
+        raise ValueError("Survivor is infected!")
+
+    if survivor.id is None:
+        update_location(db, survivor_id, latitude, longitude)
+    else:
+        location_buffer.put(survivor_id, latitude, longitude)
+        survivor_index.move(survivor_id, latitude, longitude)
+        survivor_changes.publish(MOVED, {"survivor_id": survivor_id, "latitude": latitude, "longitude": longitude})
+
+    return {"survivor_id": survivor_id, "latitude": latitude, "longitude": longitude}
+
+
+@retry_on_busy
 def delete_survivor(db: Session, survivor_id: str):
-    """Deletes a survivor from the system."""
-    survivor = db.query(Survivor).get(survivor_id)
+    """Deletes a survivor from the system.
+
+    The survivor and their rows are only marked deleted, so clients syncing incrementally learn of the deletion.
+    """
+    survivor = get_live_survivor(db, survivor_id)
     if not survivor:
         raise ValueError(f"Survivor with id {survivor_id} not found")
 
-    db.delete(survivor)
+    unindex_names(db, [(survivor.id, survivor.name)])
+    for model, owner in ((LatLong, LatLong.survivor_id), (Inventory, Inventory.survivor_id),
+                         (InfectionReport, InfectionReport.reported_id)):
+        db.query(model).filter(owner == survivor_id).update(
+            {model.deleted_at: now()}, synchronize_session=False)
+    survivor.deleted_at = now()
+    offer_ids = [offer_id for offer_id, in db.query(Offer.id).filter(Offer.survivor_id == survivor_id)]
+    db.query(Offer).filter(Offer.survivor_id == survivor_id).delete(synchronize_session=False)
+    data_versions.bump(db, SURVIVORS)
     db.commit()
+    for offer_id in offer_ids:
+        order_book.remove(offer_id)
+    location_buffer.discard(survivor_id)
+    survivor_index.remove(survivor_id)
+    survivor_changes.publish(DELETED, {"survivor_id": survivor_id})
     return format_survivor_response(survivor)
 
 
 def update_inventory(db: Session, survivor: Survivor, updated_inventory: Dict[str, int]):
-    """Updates a survivor's inventory based on a dictionary of item quantities."""
+    """Updates a survivor's inventory based on a dictionary of item quantities.
 
-    # Clear current inventory
-    db.query(Inventory).filter(
-        Inventory.survivor_id == survivor.id).delete()
+    Only the rows that change are written: items the survivor runs out of are deleted,
+    changed quantities are updated and new items are inserted.
+    """
+    current_inventory = {str(item.item_id): item for item in survivor.inventory}
 
-    # Re-add updated inventory
-    new_items = [
-        Inventory(survivor_id=survivor.id,
-                  item_id=item_id, quantity=quantity)
-        for item_id, quantity in updated_inventory.items() if quantity >= 0
-    ]
+    for item_id, quantity in updated_inventory.items():
+        item_id = str(item_id)
+        item = current_inventory.get(item_id)
+
+        if quantity <= 0:
+            if item is not None:
+                db.delete(item)
+                survivor.updated_at = now()  # The row is gone, so the survivor carries the change
+        elif item is None:
+            db.add(Inventory(survivor_id=survivor.id,
+                   item_id=item_id, quantity=quantity))
+        elif item.quantity != quantity:
+            item.quantity = quantity
 
-    db.add_all(new_items)
 
+def publish_inventories(inventories: Dict[str, Dict[str, int]]):
+    """Publishes the inventories of survivors who traded, leaving out the items they ran out of."""
+    for survivor_id, inventory in inventories.items():
+        survivor_changes.publish(INVENTORY, {
+            "survivor_id": survivor_id,
+            "inventory": {item_id: quantity for item_id, quantity in inventory.items() if quantity > 0}})
+
+
+def validate_trade(
+        db: Session,
+        survivor_a_items: SurvivorTradePayload,
+        survivor_b_items: SurvivorTradePayload,
+        inventories: Optional[Dict[str, Dict[str, int]]] = None):
+    """Validates a trade between two survivors.
+
+    Inventories are checked against the given snapshot, keyed by survivor ID, when there is one. Survivors
+    missing from it are read from the database and added, so trades sharing a snapshot see each other's results.
+    """
+    if inventories is None:
+        inventories = {}
 
-def validate_trade(db: Session, survivor_a_items: SurvivorTradePayload, survivor_b_items: SurvivorTradePayload):
-    """Validates a trade between two survivors."""
     # Validate that users exist
-    survivor_a = db.query(Survivor).get(str(survivor_a_items.survivor_id))
+    survivor_a = get_live_survivor(db, str(survivor_a_items.survivor_id))
     if not survivor_a:
         raise ValueError(
             f"Survivor with id {survivor_a_items.survivor_id} not found")
 
-    if survivor_a.infectionReports and len(survivor_a.infectionReports) >= 3:
+    if survivor_a.infection_count >= INFECTION_THRESHOLD:
         raise ValueError("Survivor A is infected!")
 
-    survivor_b = db.query(Survivor).get(str(survivor_b_items.survivor_id))
+    survivor_b = get_live_survivor(db, str(survivor_b_items.survivor_id))
     if not survivor_b:
         raise ValueError(
             f"Survivor with id {survivor_b_items.survivor_id} not found")
 
-    if survivor_b.infectionReports and len(survivor_b.infectionReports) >= 3:
+    if survivor_b.infection_count >= INFECTION_THRESHOLD:
         raise ValueError("Survivor B is infected!")
 
-    survivor_a_inventory = {
-        str(item.item_id): item.quantity for item in survivor_a.inventory}
-    survivor_b_inventory = {
-        str(item.item_id): item.quantity for item in survivor_b.inventory}
+    for survivor in (survivor_a, survivor_b):
+        if survivor.id not in inventories:
+            inventories[survivor.id] = {
+                str(item.item_id): item.quantity for item in survivor.inventory}
+
+    survivor_a_inventory = inventories[survivor_a.id]
+    survivor_b_inventory = inventories[survivor_b.id]
 
     # Validate that the users have the resources in their inventories
     # that they seek to trade
@@ -273,12 +795,12 @@ def validate_trade(db: Session, survivor_a_items: SurvivorTradePayload, survivor
                        survivor_b_items.items)
 
     # Validate that the trade is balanced
-    item_catalogue = get_possible_items(db)
+    catalogue = item_catalogue.get(db)
 
     estimated_worth_a = estimate_trade_value(
-        survivor_a_items.items, item_catalogue)
+        survivor_a_items.items, catalogue)
     estimated_worth_b = estimate_trade_value(
-        survivor_b_items.items, item_catalogue)
+        survivor_b_items.items, catalogue)
 
     if estimated_worth_a != estimated_worth_b:
         raise ValueError(
@@ -292,6 +814,22 @@ def validate_trade(db: Session, survivor_a_items: SurvivorTradePayload, survivor
     }
 
 
+def perform_trade(from_inventory: Dict[str, int], to_inventory: Dict[str, int], items_to_trade: Dict[UUID, int]):
+    """Performs the trade of items between two inventories."""
+    for item_id, quantity in items_to_trade.items():
+        item_id_str = str(item_id)
+
+        from_inventory[item_id_str] = from_inventory.get(
+            item_id_str, 0) - quantity
+
+        if from_inventory[item_id_str] <= 0:
+            from_inventory[item_id_str] = 0  # Prevent negative values
+
+        to_inventory[item_id_str] = to_inventory.get(
+            item_id_str, 0) + quantity
+
+
+@retry_on_busy
 def trade_items(
         db: Session,
         survivor_a_items: SurvivorTradePayload,
@@ -309,27 +847,13 @@ def trade_items(
             "survivor_b_offer_value": validation_result["estimated_worth_b"]
         }
 
-    survivor_a = db.query(Survivor).get(str(survivor_a_items.survivor_id))
-    survivor_b = db.query(Survivor).get(str(survivor_b_items.survivor_id))
+    survivor_a = get_live_survivor(db, str(survivor_a_items.survivor_id))
+    survivor_b = get_live_survivor(db, str(survivor_b_items.survivor_id))
 
     survivor_a_inventory = validation_result["survivor_a_inventory"]
     survivor_b_inventory = validation_result["survivor_b_inventory"]
 
     # Perform the trade
-    def perform_trade(from_inventory: Dict[str, int], to_inventory: Dict[str, int], items_to_trade: Dict[UUID, int]):
-        """Performs the trade of items between two inventories."""
-        for item_id, quantity in items_to_trade.items():
-            item_id_str = str(item_id)
-
-            from_inventory[item_id_str] = from_inventory.get(
-                item_id_str, 0) - quantity
-
-            if from_inventory[item_id_str] <= 0:
-                from_inventory[item_id_str] = 0  # Prevent negative values
-
-            to_inventory[item_id_str] = to_inventory.get(
-                item_id_str, 0) + quantity
-
     perform_trade(survivor_a_inventory, survivor_b_inventory,
                   survivor_a_items.items)
     perform_trade(survivor_b_inventory, survivor_a_inventory,
@@ -337,7 +861,241 @@ def trade_items(
 
     update_inventory(db, survivor_a, survivor_a_inventory)
     update_inventory(db, survivor_b, survivor_b_inventory)
+    data_versions.bump(db, SURVIVORS)
 
     db.commit()
+    publish_inventories({survivor_a.id: survivor_a_inventory, survivor_b.id: survivor_b_inventory})
 
     return {"message": "Trade successful"}
+
+
+@retry_on_busy
+def trade_items_batch(
+        db: Session,
+        user_id: str,
+        trades: List[Tuple[SurvivorTradePayload, SurvivorTradePayload]],
+        all_or_nothing: bool = True,
+        dry_run: Optional[bool] = False) -> Dict:
+    """Handles many trades between survivors in a single transaction, on behalf of the survivor giving in each.
+
+    Trades are validated in order against a shared snapshot of the inventories involved, so each trade sees
+    the results of the ones before it. Like single trades, a trade fails unless its survivor A is the user.
+    All-or-nothing batches are only written when every trade is valid, best-effort batches write the valid
+    trades and skip the others. Nothing is written on a dry run.
+    """
+    inventories: Dict[str, Dict[str, int]] = {}
+    traders = set()
+    results = []
+
+    for index, (survivor_a_items, survivor_b_items) in enumerate(trades):
+        try:
+            if str(survivor_a_items.survivor_id) != user_id:
+                raise ValueError("You can only trade items from your own inventory.")
+            if survivor_a_items.survivor_id == survivor_b_items.survivor_id:
+                raise ValueError("You can't trade items with yourself.")
+
+            validation_result = validate_trade(
+                db, survivor_a_items, survivor_b_items, inventories)
+        except ValueError as e:
+            results.append({"index": index, "success": False, "detail": str(e)})
+            continue
+
+        perform_trade(validation_result["survivor_a_inventory"], validation_result["survivor_b_inventory"],
+                      survivor_a_items.items)
+        perform_trade(validation_result["survivor_b_inventory"], validation_result["survivor_a_inventory"],
+                      survivor_b_items.items)
+        traders.update((str(survivor_a_items.survivor_id),
+                       str(survivor_b_items.survivor_id)))
+        results.append({"index": index, "success": True,
+                       "detail": "Trade is valid" if dry_run else "Trade successful"})
+
+    failed = any(not result["success"] for result in results)
+    if dry_run or (all_or_nothing and failed):
+        if not dry_run:
+            for result in results:
+                if result["success"]:
+                    result.update(
+                        success=False, detail="Trade not executed, another trade in the batch failed")
+        db.rollback()
+        return {"committed": False, "results": results}
+
+    for survivor_id in traders:
+        update_inventory(db, get_live_survivor(db, survivor_id), inventories[survivor_id])
+    if traders:
+        data_versions.bump(db, SURVIVORS)
+
+    db.commit()
+    if traders:
+        publish_inventories({survivor_id: inventories[survivor_id] for survivor_id in traders})
+
+    return {"committed": bool(traders), "results": results}
+
+
+def format_offer_response(offer: Offer) -> Dict:
+    """Formats an offer into a dictionary for API response."""
+    return {
+        "id": offer.id,
+        "survivor_id": offer.survivor_id,
+        "give_item_id": offer.give_item_id,
+        "give_quantity": offer.give_quantity,
+        "want_item_id": offer.want_item_id,
+        "want_quantity": offer.want_quantity,
+        "created_at": offer.created_at,
+    }
+
+
+def get_offers(db: Session, limit: int) -> List[Dict]:
+    """Returns the open offers of the listed survivors, oldest first."""
+    return [format_offer_response(offer) for offer in (
+        db.query(Offer)
+        .join(Survivor, Survivor.id == Offer.survivor_id)
+        .filter(*LISTED)
+        .order_by(Offer.created_at, Offer.id)
+        .limit(limit)
+    )]
+
+
+def read_open_offers(
+        db: Session,
+        catalogue: Dict[UUID, ItemSchema],
+        since: Optional[str] = None) -> Tuple[str, Iterator[OpenOffer]]:
+    """Reads the open offers placed since a stamp, or all of them, for the order book, oldest first.
+
+    Offers are worth as much as the catalogue says. Returns them along with the stamp to read from next time,
+    taken first. Offers are stamped as they are inserted, while holding the write lock, so any offer committed
+    later is stamped at or after it.
+    """
+    stamp = db.query(func.max(Offer.created_at, type_=String)).scalar() or ""
+    query = db.query(Offer).order_by(Offer.created_at, Offer.id)
+    if since is not None:
+        query = query.filter(changed_since(Offer.created_at, since))
+
+    def offers():
+        for offer in query:
+            give_item = catalogue.get(UUID(offer.give_item_id))
+            if give_item is not None:
+                yield OpenOffer(offer.id, offer.survivor_id, offer.give_item_id, offer.give_quantity,
+                                offer.want_item_id, offer.give_quantity * give_item.worth)
+
+    return stamp, offers()
+
+
+def place_offer(db: Session, survivor_id: str, give_item_id: UUID, give_quantity: int, want_item_id: UUID) -> Dict:
+    """Places an offer to give a quantity of an item for as much worth of another, trading it straight away if it can.
+
+    The order book is searched for the oldest offer of someone else giving the wanted item for the offered
+    one, worth exactly as much. The two are traded like any other trade, and offers that can no longer be
+    honoured are closed along the way. Offers finding no match are left open in the order book.
+    """
+    version = item_catalogue.version
+    catalogue = item_catalogue.get(db)
+    check_items_exist({give_item_id: give_quantity, want_item_id: 0}, catalogue)
+    give_item_id, want_item_id = UUID(str(give_item_id)), UUID(str(want_item_id))
+    if give_item_id == want_item_id:
+        raise ValueError("An offer has to want another item than it gives")
+
+    survivor = get_live_survivor(db, survivor_id)
+    if not survivor:
+        raise ValueError(f"Survivor with id {survivor_id} not found")
+    if survivor.infection_count >= INFECTION_THRESHOLD:
+        raise ValueError("Survivor is infected!")
+
+    available_quantity = next(
+        (item.quantity for item in survivor.inventory if item.item_id == str(give_item_id)), 0)
+    if give_quantity > available_quantity:
+        raise ValueError(
+            f"Insufficient items: Survivor {survivor_id} has {available_quantity}, but offered {give_quantity}")
+
+    worth = give_quantity * catalogue[give_item_id].worth
+    if worth % catalogue[want_item_id].worth:
+        raise ValueError(f"Offer cannot be balanced: no quantity of item {want_item_id} is worth {worth}")
+
+    placed = OpenOffer(str(uuid4()), survivor_id, str(give_item_id), give_quantity, str(want_item_id), worth)
+    while True:
+        match = order_book.claim(placed.counter_key, survivor_id, version,
+                                 lambda since: read_open_offers(db, catalogue, since))
+        if match is None:
+            break
+
+        try:
+            matched_offer = fill_offer(db, match, placed)
+        except Exception:
+            db.rollback()  # Restores the open offer before anyone else can claim it
+            order_book.put_back(match)
+            raise
+        order_book.release(match.id)
+        if matched_offer is not None:
+            return {"matched_offer": matched_offer, "offer": None}
+
+    offer = open_offer(db, placed, worth // catalogue[want_item_id].worth)
+    order_book.add(placed)
+    return {"matched_offer": None, "offer": offer}
+
+
+@retry_on_busy
+def open_offer(db: Session, placed: OpenOffer, want_quantity: int) -> Dict:
+    """Stores an offer that found no match."""
+    offer = Offer(id=placed.id, survivor_id=placed.survivor_id, give_item_id=placed.give_item_id,
+                  give_quantity=placed.give_quantity, want_item_id=placed.want_item_id, want_quantity=want_quantity)
+    db.add(offer)
+    db.commit()
+    return format_offer_response(offer)
+
+
+@retry_on_busy
+def fill_offer(db: Session, offer: OpenOffer, placed: OpenOffer) -> Optional[Dict]:
+    """Trades a placed offer against an open one, closing the open offer in the same transaction.
+
+    The open offer is deleted before anything else, under the write lock, so whichever process or thread
+    deletes it is the only one to trade against it. Returns the open offer, or None if it was already
+    gone or could no longer be honoured, in which case it is closed instead.
+    """
+    stored = db.execute(
+        delete(Offer.__table__).where(Offer.id == offer.id).returning(*Offer.__table__.c)).first()
+    if stored is None:  # Filled or cancelled elsewhere
+        db.rollback()
+        return None
+
+    counterparty = get_live_survivor(db, offer.survivor_id)
+    available_quantity = next((item.quantity for item in counterparty.inventory
+                               if item.item_id == offer.give_item_id), 0) if counterparty else 0
+    if counterparty is None or counterparty.infection_count >= INFECTION_THRESHOLD \
+            or available_quantity < offer.give_quantity:
+        db.commit()
+        return None
+
+    placer_items = SurvivorTradePayload(
+        survivor_id=placed.survivor_id, items={placed.give_item_id: placed.give_quantity})
+    counterparty_items = SurvivorTradePayload(
+        survivor_id=offer.survivor_id, items={offer.give_item_id: offer.give_quantity})
+    validation_result = validate_trade(db, placer_items, counterparty_items)
+
+    perform_trade(validation_result["survivor_a_inventory"], validation_result["survivor_b_inventory"],
+                  placer_items.items)
+    perform_trade(validation_result["survivor_b_inventory"], validation_result["survivor_a_inventory"],
+                  counterparty_items.items)
+    inventories = {placed.survivor_id: validation_result["survivor_a_inventory"],
+                   offer.survivor_id: validation_result["survivor_b_inventory"]}
+    for survivor_id, inventory in inventories.items():
+        update_inventory(db, get_live_survivor(db, survivor_id), inventory)
+
+    data_versions.bump(db, SURVIVORS)
+    db.commit()
+    publish_inventories(inventories)
+    return format_offer_response(stored)
+
+
+@retry_on_busy
+def cancel_offer(db: Session, survivor_id: str, offer_id: str) -> Dict:
+    """Withdraws one of a survivor's open offers."""
+    offer = db.query(Offer).get(offer_id)
+    if not offer:
+        raise ValueError(f"Offer with id {offer_id} not found")
+    if offer.survivor_id != survivor_id:
+        raise ValueError("You can only cancel your own offers.")
+
+    cancelled = format_offer_response(offer)
+    db.delete(offer)
+    db.commit()
+    order_book.remove(offer_id)
+    return cancelled
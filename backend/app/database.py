@@ -1,13 +1,126 @@
 """Contains database connection and initialization logic."""
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+import os
+import random
+import time
+from functools import wraps
+from sqlalchemy import Connection, Engine, create_engine, event, inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
 DATABASE_URL = "sqlite:///./zombie-apocalypse.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./zombie-apocalypse.db"
+
+# SQLite settings applied to every new connection, picked with the ZOMBIE_DB_PROFILE environment variable
+ENGINE_PROFILES = {
+    # Readers no longer wait for writers, at the risk of losing the last commits on power loss
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64_000,  # In KiB, so 64 MB
+        "mmap_size": 268_435_456,  # 256 MB
+        "busy_timeout": 5_000,  # In milliseconds
+        "temp_store": "MEMORY",
+    },
+    # As above, but every commit is flushed to disk
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -64_000,
+        "busy_timeout": 5_000,
+    },
+    # SQLite's own defaults, with a rollback journal
+    "legacy": {},
+}
+ENGINE_PROFILE = os.environ.get("ZOMBIE_DB_PROFILE", "default")
+
+# Version of the schema init_db creates, stamped in the database. Bump it whenever the models change
+SCHEMA_VERSION = 6
+
+# How long a starting process waits for another one to initialize the database, in milliseconds
+INIT_LOCK_TIMEOUT_MS = 60_000
+
+# How often, and how patiently, write transactions are retried while another writer holds the database
+BUSY_RETRIES = 5
+BUSY_BACKOFF_SECONDS = 0.05
+
+
+def configure_sqlite(target: Engine, profile: str = ENGINE_PROFILE):
+    """Applies the pragmas of an engine profile to every new connection of an engine."""
+    pragmas = ENGINE_PROFILES[profile]
+
+    @event.listens_for(target, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def begin_immediate(db: Session) -> bool:
+    """Takes SQLite's write lock for the transaction of a session, returning whether it had to.
+
+    SQLite only starts a transaction at the first write, so reads made before it see a snapshot another
+    writer may change before this one writes. Taking the lock first makes every read of the transaction
+    current, and the objects the session loaded before are expired so they are read again.
+    """
+    connection = db.connection()
+    if connection.connection.dbapi_connection.in_transaction:
+        return False  # Already writing, so holding the lock
+
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+    db.expire_all()
+    return True
+
+
+def retry_on_busy(func):
+    """Runs a write transaction under SQLite's write lock, retrying it with exponential backoff while locked.
+
+    The lock is taken before the wrapped function reads anything, see begin_immediate, and released by
+    rolling back if the function fails. The busy timeout already makes SQLite wait for the lock, so a
+    transaction is only retried once it waited that long in vain. The wrapped function must run a whole
+    transaction on the session it is given as its first argument.
+    """
+    @wraps(func)
+    def wrapper(db, *args, **kwargs):
+        for attempt in range(BUSY_RETRIES):
+            began = False
+            try:
+                began = begin_immediate(db)
+                return func(db, *args, **kwargs)
+            except OperationalError as e:
+                if "locked" not in str(e.orig) or attempt == BUSY_RETRIES - 1:
+                    if began:
+                        db.rollback()
+                    raise
+
+                db.rollback()
+                time.sleep(BUSY_BACKOFF_SECONDS *
+                           2 ** attempt * random.uniform(1, 2))
+            except Exception:
+                if began:
+                    db.rollback()
+                raise
+
+    return wrapper
+
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+configure_sqlite(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Asynchronous access to the same database, for routes running on the event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+configure_sqlite(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(
+    autoflush=False, bind=async_engine, expire_on_commit=False)
+
+
+def get_session_factory() -> sessionmaker:
+    """Returns the factory of the sessions used outside of requests, by the startup and background work."""
+    return SessionLocal
+
 
 def get_db():
     """Returns a database session."""
@@ -18,6 +131,12 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Returns an asynchronous database session."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 # Pre-seed the database
 
 
@@ -31,403 +150,128 @@ def seed_items(db_session):
         Item(label="ammunition", worth=1),
     ]
     db_session.bulk_save_objects(items)
+    from app.versions import ITEMS, data_versions
+    data_versions.bump(db_session, ITEMS)
     db_session.commit()
 
+    # Bulk saves bypass the session events that keep the catalogue cache fresh
+    from app.catalogue import item_catalogue
+    item_catalogue.invalidate()
 
-def seed_survivors(db_session):
-    """Seeds the database with survivors, their locations, inventories, and infection reports."""
-    from app.alchemy_models import Item
-    items = db_session.query(Item).all()
-
-    from app.alchemy_models import Survivor
-    survivors = [
-        Survivor(name="Jack", age=30, gender="m"),
-        Survivor(name="Emma", age=5, gender="f"),
-        Survivor(name="Liam", age=10, gender="m"),
-        Survivor(name="Olivia", age=15, gender="f"),
-        Survivor(name="Noah", age=20, gender="m"),
-        Survivor(name="Ava", age=25, gender="f"),
-        Survivor(name="William", age=30, gender="m"),
-        Survivor(name="Sophia", age=35, gender="f"),
-        Survivor(name="James", age=40, gender="m"),
-        Survivor(name="Isabella", age=45, gender="f"),
-        Survivor(name="Benjamin", age=50, gender="m"),
-        Survivor(name="Mia", age=55, gender="f"),
-        Survivor(name="Lucas", age=59, gender="m"),
-        Survivor(name="Ella", age=6, gender="f"),
-        Survivor(name="Henry", age=11, gender="m"),
-        Survivor(name="Amelia", age=16, gender="f"),
-        Survivor(name="Alexander", age=21, gender="m"),
-        Survivor(name="Charlotte", age=26, gender="f"),
-        Survivor(name="Sebastian", age=31, gender="m"),
-        Survivor(name="Harper", age=36, gender="f"),
-        Survivor(name="Daniel", age=41, gender="m"),
-        Survivor(name="Evelyn", age=46, gender="f"),
-        Survivor(name="Matthew", age=51, gender="m"),
-        Survivor(name="Abigail", age=56, gender="f"),
-        Survivor(name="Oliver", age=7, gender="m"),
-        Survivor(name="Emily", age=12, gender="f"),
-        Survivor(name="Jacob", age=17, gender="m"),
-        Survivor(name="Katrine", age=22, gender="f"),
-        Survivor(name="Michael", age=27, gender="m"),
-        Survivor(name="Aarav", age=32, gender="m")
-    ]
 
-    db_session.add_all(survivors)
-    db_session.commit()
+# Create the database tables
+
+
+def schema_version(connection: Connection) -> int:
+    """Returns the version of the schema stamped in a database, 0 if it was never initialized."""
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
 
+
+def upgrade_unversioned(connection: Connection):
+    """Upgrades a database created before the schema was versioned, by the original models, to version 1.
+
+    The infection counters are counted from the reports, keeping the first of any duplicate reports as the
+    unique constraint on them now requires, and the map tiles of the locations are computed by SQLite. Each
+    step is skipped when its columns are already there, so databases from in between upgrade too.
+    """
+    from sqlalchemy.schema import CreateColumn
     from app.alchemy_models import LatLong
-    locations = [
-        LatLong(latitude=55.675419558911905,
-                longitude=12.564300846013314, survivor_id=survivors[0].id),
-        LatLong(latitude=55.65516537453284,
-                longitude=12.447689887187982, survivor_id=survivors[1].id),
-        LatLong(latitude=55.674548626919204,
-                longitude=12.554647620944992, survivor_id=survivors[2].id),
-        LatLong(latitude=55.61353519221935,
-                longitude=12.551944717925862, survivor_id=survivors[3].id),
-        LatLong(latitude=55.68804589409217,
-                longitude=12.571637297065239, survivor_id=survivors[4].id),
-        LatLong(latitude=55.6113543828474, longitude=12.553875362939529,
-                survivor_id=survivors[5].id),
-        LatLong(latitude=56.04120566224172,
-                longitude=12.60157274306721, survivor_id=survivors[6].id),
-        LatLong(latitude=56.036939174605, longitude=12.5939352953613,
-                survivor_id=survivors[7].id),
-        LatLong(latitude=56.025737400136315,
-                longitude=12.716134458655825, survivor_id=survivors[8].id),
-        LatLong(latitude=56.06679468356646,
-                longitude=12.69513147746458, survivor_id=survivors[9].id),
-        LatLong(latitude=55.99585010661434,
-                longitude=12.548110609125855, survivor_id=survivors[10].id),
-        LatLong(latitude=56.038539162746765,
-                longitude=12.570068271280338, survivor_id=survivors[11].id),
-        LatLong(latitude=56.11738958390208, longitude=12.29989355868385,
-                survivor_id=survivors[12].id),
-        LatLong(latitude=55.648865447783365,
-                longitude=12.266479724255223, survivor_id=survivors[13].id),
-        LatLong(latitude=55.62353877452857,
-                longitude=12.304666962784761, survivor_id=survivors[14].id),
-        LatLong(latitude=55.63270137578691, longitude=12.06599671776299,
-                survivor_id=survivors[15].id),
-        LatLong(latitude=55.62946776100481,
-                longitude=12.067906079689468, survivor_id=survivors[16].id),
-        LatLong(latitude=55.461710056635916,
-                longitude=12.18063081616833, survivor_id=survivors[17].id),
-        LatLong(latitude=55.48770059386816, longitude=12.18181678064842,
-                survivor_id=survivors[18].id),
-        LatLong(latitude=55.49979379170528,
-                longitude=12.154539597606359, survivor_id=survivors[19].id),
-        LatLong(latitude=55.57828321762898,
-                longitude=12.950559084829285, survivor_id=survivors[20].id),
-        LatLong(latitude=55.513342213105346,
-                longitude=12.97081580490585, survivor_id=survivors[21].id),
-        LatLong(latitude=55.4099799810679, longitude=12.84477399109611,
-                survivor_id=survivors[22].id),
-        LatLong(latitude=55.804100403174765,
-                longitude=13.002326260569257, survivor_id=survivors[23].id),
-        LatLong(latitude=55.86729774435275,
-                longitude=12.536421698808256, survivor_id=survivors[24].id),
-        LatLong(latitude=55.83444794497708, longitude=12.16729924407973,
-                survivor_id=survivors[25].id),
-        LatLong(latitude=55.907690159508185,
-                longitude=12.302344044590166, survivor_id=survivors[26].id),
-        LatLong(latitude=55.96568063289631,
-                longitude=12.414881378348863, survivor_id=survivors[27].id),
-        LatLong(latitude=56.08532250579572,
-                longitude=12.447954221746777, survivor_id=survivors[28].id),
-        LatLong(latitude=55.955212995694275,
-                longitude=12.521777153411756, survivor_id=survivors[29].id)
-    ]
-    db_session.add_all(locations)
-    db_session.commit()
 
-    from app.alchemy_models import Inventory
-    inventories = [
-        Inventory(survivor_id=survivors[0].id,
-                  item_id=items[0].id, quantity=3),
-        Inventory(survivor_id=survivors[0].id,
-                  item_id=items[1].id, quantity=5),
-        Inventory(survivor_id=survivors[0].id,
-                  item_id=items[2].id, quantity=7),
-        Inventory(survivor_id=survivors[0].id,
-                  item_id=items[3].id, quantity=2),
-        Inventory(survivor_id=survivors[1].id,
-                  item_id=items[0].id, quantity=1),
-        Inventory(survivor_id=survivors[1].id,
-                  item_id=items[1].id, quantity=4),
-        Inventory(survivor_id=survivors[1].id,
-                  item_id=items[2].id, quantity=6),
-        Inventory(survivor_id=survivors[1].id,
-                  item_id=items[3].id, quantity=8),
-        Inventory(survivor_id=survivors[2].id,
-                  item_id=items[0].id, quantity=2),
-        Inventory(survivor_id=survivors[2].id,
-                  item_id=items[1].id, quantity=3),
-        Inventory(survivor_id=survivors[2].id,
-                  item_id=items[2].id, quantity=5),
-        Inventory(survivor_id=survivors[2].id,
-                  item_id=items[3].id, quantity=7),
-        Inventory(survivor_id=survivors[3].id,
-                  item_id=items[0].id, quantity=4),
-        Inventory(survivor_id=survivors[3].id,
-                  item_id=items[1].id, quantity=6),
-        Inventory(survivor_id=survivors[3].id,
-                  item_id=items[2].id, quantity=8),
-        Inventory(survivor_id=survivors[3].id,
-                  item_id=items[3].id, quantity=1),
-        Inventory(survivor_id=survivors[4].id,
-                  item_id=items[0].id, quantity=5),
-        Inventory(survivor_id=survivors[4].id,
-                  item_id=items[1].id, quantity=7),
-        Inventory(survivor_id=survivors[4].id,
-                  item_id=items[2].id, quantity=2),
-        Inventory(survivor_id=survivors[4].id,
-                  item_id=items[3].id, quantity=3),
-        Inventory(survivor_id=survivors[5].id,
-                  item_id=items[0].id, quantity=6),
-        Inventory(survivor_id=survivors[5].id,
-                  item_id=items[1].id, quantity=8),
-        Inventory(survivor_id=survivors[5].id,
-                  item_id=items[2].id, quantity=1),
-        Inventory(survivor_id=survivors[5].id,
-                  item_id=items[3].id, quantity=4),
-        Inventory(survivor_id=survivors[6].id,
-                  item_id=items[0].id, quantity=7),
-        Inventory(survivor_id=survivors[6].id,
-                  item_id=items[1].id, quantity=2),
-        Inventory(survivor_id=survivors[6].id,
-                  item_id=items[2].id, quantity=3),
-        Inventory(survivor_id=survivors[6].id,
-                  item_id=items[3].id, quantity=5),
-        Inventory(survivor_id=survivors[7].id,
-                  item_id=items[0].id, quantity=8),
-        Inventory(survivor_id=survivors[7].id,
-                  item_id=items[1].id, quantity=1),
-        Inventory(survivor_id=survivors[7].id,
-                  item_id=items[2].id, quantity=4),
-        Inventory(survivor_id=survivors[7].id,
-                  item_id=items[3].id, quantity=6),
-        Inventory(survivor_id=survivors[8].id,
-                  item_id=items[0].id, quantity=2),
-        Inventory(survivor_id=survivors[8].id,
-                  item_id=items[1].id, quantity=3),
-        Inventory(survivor_id=survivors[8].id,
-                  item_id=items[2].id, quantity=5),
-        Inventory(survivor_id=survivors[8].id,
-                  item_id=items[3].id, quantity=7),
-        Inventory(survivor_id=survivors[9].id,
-                  item_id=items[0].id, quantity=4),
-        Inventory(survivor_id=survivors[9].id,
-                  item_id=items[1].id, quantity=6),
-        Inventory(survivor_id=survivors[9].id,
-                  item_id=items[2].id, quantity=8),
-        Inventory(survivor_id=survivors[9].id,
-                  item_id=items[3].id, quantity=1),
-        Inventory(survivor_id=survivors[10].id,
-                  item_id=items[0].id, quantity=5),
-        Inventory(survivor_id=survivors[10].id,
-                  item_id=items[1].id, quantity=7),
-        Inventory(survivor_id=survivors[10].id,
-                  item_id=items[2].id, quantity=2),
-        Inventory(survivor_id=survivors[10].id,
-                  item_id=items[3].id, quantity=3),
-        Inventory(survivor_id=survivors[11].id,
-                  item_id=items[0].id, quantity=6),
-        Inventory(survivor_id=survivors[11].id,
-                  item_id=items[1].id, quantity=8),
-        Inventory(survivor_id=survivors[11].id,
-                  item_id=items[2].id, quantity=1),
-        Inventory(survivor_id=survivors[11].id,
-                  item_id=items[3].id, quantity=4),
-        Inventory(survivor_id=survivors[12].id,
-                  item_id=items[0].id, quantity=7),
-        Inventory(survivor_id=survivors[12].id,
-                  item_id=items[1].id, quantity=2),
-        Inventory(survivor_id=survivors[12].id,
-                  item_id=items[2].id, quantity=3),
-        Inventory(survivor_id=survivors[12].id,
-                  item_id=items[3].id, quantity=5),
-        Inventory(survivor_id=survivors[13].id,
-                  item_id=items[0].id, quantity=8),
-        Inventory(survivor_id=survivors[13].id,
-                  item_id=items[1].id, quantity=1),
-        Inventory(survivor_id=survivors[13].id,
-                  item_id=items[2].id, quantity=4),
-        Inventory(survivor_id=survivors[13].id,
-                  item_id=items[3].id, quantity=6),
-        Inventory(survivor_id=survivors[14].id,
-                  item_id=items[0].id, quantity=2),
-        Inventory(survivor_id=survivors[14].id,
-                  item_id=items[1].id, quantity=3),
-        Inventory(survivor_id=survivors[14].id,
-                  item_id=items[2].id, quantity=5),
-        Inventory(survivor_id=survivors[14].id,
-                  item_id=items[3].id, quantity=7),
-        Inventory(survivor_id=survivors[15].id,
-                  item_id=items[0].id, quantity=4),
-        Inventory(survivor_id=survivors[15].id,
-                  item_id=items[1].id, quantity=6),
-        Inventory(survivor_id=survivors[15].id,
-                  item_id=items[2].id, quantity=8),
-        Inventory(survivor_id=survivors[15].id,
-                  item_id=items[3].id, quantity=1),
-        Inventory(survivor_id=survivors[16].id,
-                  item_id=items[0].id, quantity=5),
-        Inventory(survivor_id=survivors[16].id,
-                  item_id=items[1].id, quantity=7),
-        Inventory(survivor_id=survivors[16].id,
-                  item_id=items[2].id, quantity=2),
-        Inventory(survivor_id=survivors[16].id,
-                  item_id=items[3].id, quantity=3),
-        Inventory(survivor_id=survivors[17].id,
-                  item_id=items[0].id, quantity=6),
-        Inventory(survivor_id=survivors[17].id,
-                  item_id=items[1].id, quantity=8),
-        Inventory(survivor_id=survivors[17].id,
-                  item_id=items[2].id, quantity=1),
-        Inventory(survivor_id=survivors[17].id,
-                  item_id=items[3].id, quantity=4),
-        Inventory(survivor_id=survivors[18].id,
-                  item_id=items[0].id, quantity=7),
-        Inventory(survivor_id=survivors[18].id,
-                  item_id=items[1].id, quantity=2),
-        Inventory(survivor_id=survivors[18].id,
-                  item_id=items[2].id, quantity=3),
-        Inventory(survivor_id=survivors[18].id,
-                  item_id=items[3].id, quantity=5),
-        Inventory(survivor_id=survivors[19].id,
-                  item_id=items[0].id, quantity=8),
-        Inventory(survivor_id=survivors[19].id,
-                  item_id=items[1].id, quantity=1),
-        Inventory(survivor_id=survivors[19].id,
-                  item_id=items[2].id, quantity=4),
-        Inventory(survivor_id=survivors[19].id,
-                  item_id=items[3].id, quantity=6),
-        Inventory(survivor_id=survivors[20].id,
-                  item_id=items[0].id, quantity=2),
-        Inventory(survivor_id=survivors[20].id,
-                  item_id=items[1].id, quantity=3),
-        Inventory(survivor_id=survivors[20].id,
-                  item_id=items[2].id, quantity=5),
-        Inventory(survivor_id=survivors[20].id,
-                  item_id=items[3].id, quantity=7),
-        Inventory(survivor_id=survivors[21].id,
-                  item_id=items[0].id, quantity=4),
-        Inventory(survivor_id=survivors[21].id,
-                  item_id=items[1].id, quantity=6),
-        Inventory(survivor_id=survivors[21].id,
-                  item_id=items[2].id, quantity=8),
-        Inventory(survivor_id=survivors[21].id,
-                  item_id=items[3].id, quantity=1),
-        Inventory(survivor_id=survivors[22].id,
-                  item_id=items[0].id, quantity=5),
-        Inventory(survivor_id=survivors[22].id,
-                  item_id=items[1].id, quantity=7),
-        Inventory(survivor_id=survivors[22].id,
-                  item_id=items[2].id, quantity=2),
-        Inventory(survivor_id=survivors[22].id,
-                  item_id=items[3].id, quantity=3),
-        Inventory(survivor_id=survivors[23].id,
-                  item_id=items[0].id, quantity=6),
-        Inventory(survivor_id=survivors[23].id,
-                  item_id=items[1].id, quantity=8),
-        Inventory(survivor_id=survivors[23].id,
-                  item_id=items[2].id, quantity=1),
-        Inventory(survivor_id=survivors[23].id,
-                  item_id=items[3].id, quantity=4),
-        Inventory(survivor_id=survivors[24].id,
-                  item_id=items[0].id, quantity=7),
-        Inventory(survivor_id=survivors[24].id,
-                  item_id=items[1].id, quantity=2),
-        Inventory(survivor_id=survivors[24].id,
-                  item_id=items[2].id, quantity=3),
-        Inventory(survivor_id=survivors[24].id,
-                  item_id=items[3].id, quantity=5),
-        Inventory(survivor_id=survivors[25].id,
-                  item_id=items[0].id, quantity=8),
-        Inventory(survivor_id=survivors[25].id,
-                  item_id=items[1].id, quantity=1),
-        Inventory(survivor_id=survivors[25].id,
-                  item_id=items[2].id, quantity=4),
-        Inventory(survivor_id=survivors[25].id,
-                  item_id=items[3].id, quantity=6),
-        Inventory(survivor_id=survivors[26].id,
-                  item_id=items[0].id, quantity=2),
-        Inventory(survivor_id=survivors[26].id,
-                  item_id=items[1].id, quantity=3),
-        Inventory(survivor_id=survivors[26].id,
-                  item_id=items[2].id, quantity=5),
-        Inventory(survivor_id=survivors[26].id,
-                  item_id=items[3].id, quantity=7),
-        Inventory(survivor_id=survivors[27].id,
-                  item_id=items[0].id, quantity=4),
-        Inventory(survivor_id=survivors[27].id,
-                  item_id=items[1].id, quantity=6),
-        Inventory(survivor_id=survivors[27].id,
-                  item_id=items[2].id, quantity=8),
-        Inventory(survivor_id=survivors[27].id,
-                  item_id=items[3].id, quantity=1),
-        Inventory(survivor_id=survivors[28].id,
-                  item_id=items[0].id, quantity=5),
-        Inventory(survivor_id=survivors[28].id,
-                  item_id=items[1].id, quantity=7),
-        Inventory(survivor_id=survivors[28].id,
-                  item_id=items[2].id, quantity=2),
-        Inventory(survivor_id=survivors[28].id,
-                  item_id=items[3].id, quantity=3),
-        Inventory(survivor_id=survivors[29].id,
-                  item_id=items[0].id, quantity=6),
-        Inventory(survivor_id=survivors[29].id,
-                  item_id=items[1].id, quantity=8),
-        Inventory(survivor_id=survivors[29].id,
-                  item_id=items[2].id, quantity=1),
-        Inventory(survivor_id=survivors[29].id,
-                  item_id=items[3].id, quantity=4)
-    ]
-    db_session.add_all(inventories)
-    db_session.commit()
+    columns = {table: {column["name"] for column in inspect(connection).get_columns(table)}
+               for table in ("survivors", "latlong")}
 
-    from app.alchemy_models import InfectionReport
-    infectionReports = [
-        InfectionReport(
-            reporter_id=survivors[0].id, reported_id=survivors[26].id),
-        InfectionReport(
-            reporter_id=survivors[18].id, reported_id=survivors[26].id),
-        InfectionReport(
-            reporter_id=survivors[21].id, reported_id=survivors[0].id),
-        InfectionReport(
-            reporter_id=survivors[3].id, reported_id=survivors[13].id),
-        InfectionReport(
-            reporter_id=survivors[7].id, reported_id=survivors[13].id),
-        InfectionReport(
-            reporter_id=survivors[9].id, reported_id=survivors[13].id),
-        InfectionReport(
-            reporter_id=survivors[9].id, reported_id=survivors[14].id),
-        InfectionReport(
-            reporter_id=survivors[0].id, reported_id=survivors[22].id)
-    ]
-    db_session.add_all(infectionReports)
-    db_session.commit()
+    if "infection_count" not in columns["survivors"]:
+        connection.exec_driver_sql(
+            "DELETE FROM infection_reports WHERE rowid NOT IN "
+            "(SELECT MIN(rowid) FROM infection_reports GROUP BY reporter_id, reported_id)")
+        connection.exec_driver_sql("ALTER TABLE survivors ADD COLUMN infection_count INTEGER NOT NULL DEFAULT 0")
+        connection.exec_driver_sql(
+            "UPDATE survivors SET infection_count = "
+            "(SELECT COUNT(*) FROM infection_reports WHERE reported_id = survivors.id)")
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_infection_reports_reporter_reported "
+        "ON infection_reports (reporter_id, reported_id)")
 
+    for column in (LatLong.__table__.c.tile_lat, LatLong.__table__.c.tile_lon):
+        if column.name not in columns["latlong"]:
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE latlong ADD COLUMN {ddl}")
 
-# Create the database tables
 
+def add_change_tracking(connection: Connection):
+    """Upgrades a version 1 database with the columns tracking when rows changed, stamping every row as changed now.
 
-def init_db():
-    """Initializes the database."""
-    import app.alchemy_models
-    Base.metadata.create_all(bind=engine)
+    SQLite cannot add columns whose default is an expression, so the upgraded tables rely on the stamps
+    SQLAlchemy and the bulk loader write explicitly.
+    """
+    from app.alchemy_models import STAMP_SQL
 
-    db = SessionLocal()
-    try:
-        from app.alchemy_models import Item, Survivor
-        if not db.query(Item).first():  # Prevent duplicate seeding
-            seed_items(db)
-        if not db.query(Survivor).first():  # Prevent duplicate seeding
-            seed_survivors(db)
-    finally:
-        db.close()
+    tracked = [table for table in Base.metadata.sorted_tables if "updated_at" in table.c]
+    for table in tracked:
+        if "updated_at" in {column["name"] for column in inspect(connection).get_columns(table.name)}:
+            continue
+
+        connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN updated_at TIMESTAMP")
+        connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN deleted_at TIMESTAMP")
+        connection.exec_driver_sql(f"UPDATE {table.name} SET updated_at = {STAMP_SQL}")
+        for index in table.indexes:
+            if table.c.updated_at in index.columns.values():
+                index.create(connection)
+
+
+def create_missing_indexes(connection: Connection):
+    """Creates the indexes of the models missing from an upgraded database, which create_all leaves alone."""
+    existing = set(connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars())
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+
+
+def init_db(bind: Engine = engine) -> bool:
+    """Creates and seeds an empty database or upgrades an older one, returning whether it had to be initialized.
+
+    Runs once at startup rather than on import. Processes starting together take turns through SQLite's write
+    lock, so only the first one creates and seeds, and the version it stamps lets the others, and every later
+    start, skip the work after reading a single pragma.
+    """
+    import app.alchemy_models  # Registers the tables
+    from app.alchemy_models import Item, Survivor
+
+    with bind.connect() as connection:
+        if schema_version(connection) == SCHEMA_VERSION:
+            return False
+
+        busy_timeout = connection.exec_driver_sql("PRAGMA busy_timeout").scalar()
+        connection.exec_driver_sql(f"PRAGMA busy_timeout = {INIT_LOCK_TIMEOUT_MS}")
+        try:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            # Another process may have initialized the database while this one waited for the lock
+            if schema_version(connection) == SCHEMA_VERSION:
+                connection.rollback()
+                return False
 
+            # Databases holding survivors already are upgraded in place, step by step
+            version = schema_version(connection)
+            tables = set(inspect(connection).get_table_names())
+            if version == 0 and "survivors" in tables:
+                upgrade_unversioned(connection)
+            if version < 2 and "survivors" in tables:
+                add_change_tracking(connection)
+            Base.metadata.create_all(bind=connection)
+            create_missing_indexes(connection)
+            with Session(bind=connection) as db:
+                if "survivors" in tables and "name_trigrams" not in tables:
+                    from app.name_search import reindex_names
+                    reindex_names(db)
+                if not db.query(Item).first():  # Prevent duplicate seeding
+                    seed_items(db)
+                if not db.query(Survivor).first():  # Prevent duplicate seeding
+                    from app.seeding import seed_survivors
+                    seed_survivors(db)
+            connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.commit()
+        finally:
+            connection.exec_driver_sql(f"PRAGMA busy_timeout = {busy_timeout}")
 
-init_db()  # Run on import
+    return True
@@ -0,0 +1,119 @@
+"""Geographic helpers for locating survivors on the map."""
+from math import asin, cos, degrees, pi, radians, sin
+from typing import List, Optional, Tuple
+import numpy as np
+
+# Scaling factors used by the equirectangular approximation
+METERS_PER_DEGREE_LAT = 111_000
+METERS_PER_DEGREE_LON = 111_320  # At the equator
+
+# Mean radius of the Earth, used by the haversine formula
+EARTH_RADIUS_M = 6_371_000
+
+# Ways of measuring the distance between two positions
+EQUIRECTANGULAR = "equirectangular"  # Fast, accurate over short distances
+HAVERSINE = "haversine"  # Great-circle distance, accurate at any range
+
+# Locations are bucketed into fixed-size tiles of 1 / TILES_PER_DEGREE degrees
+# (roughly 11 km north-south), which lets proximity queries seek an index
+# instead of scanning every location in the system.
+TILES_PER_DEGREE = 10
+
+
+def tile_of(latitude: float, longitude: float) -> Tuple[int, int]:
+    """Returns the (lat, lon) tile a position falls into.
+
+    Must stay in sync with the computed tile columns on `LatLong`.
+    """
+    return (int((latitude + 90) * TILES_PER_DEGREE),
+            int((longitude + 180) * TILES_PER_DEGREE))
+
+
+def to_unit_sphere(latitude: float, longitude: float) -> Tuple[float, float, float]:
+    """Returns the (x, y, z) position on the unit sphere, where straight-line distance ranks like great-circle distance."""
+    lat, lon = radians(latitude), radians(longitude)
+    return (cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat))
+
+
+def chord_to_meters(chord: float) -> float:
+    """Converts a straight-line distance between unit sphere positions to a great-circle distance in meters."""
+    return round(2 * EARTH_RADIUS_M * asin(min(chord / 2, 1)), 2)
+
+
+def bounding_box(
+        latitude: float,
+        longitude: float,
+        distance: float) -> Tuple[float, float, List[Tuple[float, float]]]:
+    """Returns (min_lat, max_lat, lon_ranges) enclosing every position within `distance` meters.
+
+    The box is wide enough for both distance methods. Its longitudes are given as (min_lon, max_lon) ranges,
+    two of them when the box crosses the antimeridian, and a single one of every longitude around a pole.
+    """
+    lat_delta = distance / METERS_PER_DEGREE_LAT
+
+    lon_m = METERS_PER_DEGREE_LON * cos(radians(latitude))
+    # The haversine span is bounded by asin(sin(d / R) / cos(lat))
+    haversine_ratio = sin(min(distance / EARTH_RADIUS_M, pi / 2)) / \
+        max(cos(radians(latitude)), 1e-12)
+    if lon_m < 1 or haversine_ratio >= 1 or latitude + lat_delta >= 90 or latitude - lat_delta <= -90:
+        lon_delta = 180  # Reaches a pole, every longitude qualifies
+    else:
+        lon_delta = max(distance / lon_m, degrees(asin(haversine_ratio)))
+
+    min_lon, max_lon = longitude - lon_delta, longitude + lon_delta
+    if lon_delta >= 180:
+        lon_ranges = [(-180, 180)]
+    elif min_lon < -180:
+        lon_ranges = [(min_lon + 360, 180), (-180, max_lon)]
+    elif max_lon > 180:
+        lon_ranges = [(min_lon, 180), (-180, max_lon - 360)]
+    else:
+        lon_ranges = [(min_lon, max_lon)]
+
+    return max(latitude - lat_delta, -90), min(latitude + lat_delta, 90), lon_ranges
+
+
+def distances(
+        latitude: float,
+        longitude: float,
+        latitudes: np.ndarray,
+        longitudes: np.ndarray,
+        method: str = EQUIRECTANGULAR) -> np.ndarray:
+    """Computes the distances in meters from a reference position to arrays of positions in one pass.
+
+    Positions with unknown coordinates (NaN) end up infinitely far away.
+    """
+    if method == EQUIRECTANGULAR:
+        lat_diff_m = (latitudes - latitude) * METERS_PER_DEGREE_LAT
+        # The short way round, across the antimeridian if need be
+        lon_diff_m = ((longitudes - longitude + 180) % 360 - 180) * \
+            (METERS_PER_DEGREE_LON * cos(radians(latitude)))
+        result = np.hypot(lat_diff_m, lon_diff_m)
+    elif method == HAVERSINE:
+        lat1, lat2 = radians(latitude), np.radians(latitudes)
+        half_dlat = (lat2 - lat1) / 2
+        half_dlon = np.radians(longitudes - longitude) / 2
+        a = np.sin(half_dlat) ** 2 + cos(lat1) * \
+            np.cos(lat2) * np.sin(half_dlon) ** 2
+        result = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    else:
+        raise ValueError(f"Unknown distance method {method}")
+
+    # Rounded for readability
+    result = np.round(result, 2)
+    result[np.isnan(result)] = np.inf
+    return result
+
+
+def nearest(distances_m: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """Returns the indices of the `k` smallest distances (all when k is None), closest first.
+
+    Equal distances keep their original order, so callers can break ties by presorting the input.
+    """
+    if k is None or k >= len(distances_m):
+        return np.argsort(distances_m, kind="stable")
+
+    # Partition out the k closest, widened to every tie at the cut-off so ties are decided by order
+    cutoff = distances_m[np.argpartition(distances_m, k - 1)[k - 1]]
+    candidates = np.flatnonzero(distances_m <= cutoff)
+    return candidates[np.argsort(distances_m[candidates], kind="stable")][:k]
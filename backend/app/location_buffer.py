@@ -0,0 +1,145 @@
+"""In-memory buffer coalescing high-frequency location updates before they are written to the database."""
+import logging
+import os
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Optional, Tuple
+from uuid import uuid4
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+from app.alchemy_models import LatLong
+from app.database import retry_on_busy
+from app.versions import SURVIVORS, data_versions
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes of the buffered locations, picked with the ZOMBIE_LOCATION_FLUSH_SECONDS environment variable
+LOCATION_FLUSH_SECONDS = float(
+    os.environ.get("ZOMBIE_LOCATION_FLUSH_SECONDS", "1.0"))
+
+Position = Tuple[float, float]
+
+
+class LocationBuffer:
+    """Holds the latest reported position of each survivor until it is flushed to the database.
+
+    Devices report their position every few seconds, so only the last one reported before a flush is
+    worth writing: a later update for the same survivor simply replaces the one waiting. Positions stay
+    readable while they are being flushed, so reads can always overlay the freshest position.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending: Dict[str, Position] = {}
+        self._flushing: Dict[str, Position] = {}
+        self._stopped: Optional[Event] = None
+        self._flusher: Optional[Thread] = None
+        self._session_factory: Optional[Callable[[], Session]] = None
+        # Positions are only buffered in the process they were reported to, so their version is unique to it
+        self._epoch = uuid4().hex[:12]
+        self._generation = 0
+
+    def put(self, survivor_id: str, latitude: float, longitude: float):
+        """Buffers a survivor's position, replacing any position waiting to be flushed."""
+        with self._lock:
+            self._pending[survivor_id] = (latitude, longitude)
+            self._generation += 1
+
+    def get(self, survivor_id: str) -> Optional[Position]:
+        """Returns a survivor's buffered position, if there is one."""
+        with self._lock:
+            return self._pending.get(survivor_id) or self._flushing.get(survivor_id)
+
+    def snapshot(self) -> Dict[str, Position]:
+        """Returns every buffered position, keyed by survivor ID."""
+        with self._lock:
+            return {**self._flushing, **self._pending}
+
+    def discard(self, survivor_id: str):
+        """Forgets a survivor's buffered position, such as when it is written directly."""
+        with self._lock:
+            self._pending.pop(survivor_id, None)
+            self._flushing.pop(survivor_id, None)
+            self._generation += 1
+
+    def version(self) -> Optional[str]:
+        """Returns a version of the buffered positions, or None when there are none and the database has them all."""
+        with self._lock:
+            if not self._pending and not self._flushing:
+                return None
+            return f"{self._epoch}.{self._generation}"
+
+    def clear(self):
+        """Forgets every buffered position."""
+        with self._lock:
+            self._pending = {}
+            self._generation += 1
+
+    def flush(self, db: Session) -> int:
+        """Writes the buffered positions to the database, returning how many were written.
+
+        Positions that fail to be written are put back, unless a newer one has arrived in the meantime.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+
+            try:
+                if batch:
+                    write_positions(db, batch)
+            except Exception:
+                db.rollback()
+                with self._lock:
+                    self._pending = {**batch, **self._pending}
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+        return len(batch)
+
+    def start(self, session_factory: Callable[[], Session], interval: float = LOCATION_FLUSH_SECONDS):
+        """Starts flushing the buffer in the background every `interval` seconds."""
+        self._session_factory = session_factory
+        self._stopped = Event()
+        self._flusher = Thread(
+            target=self._flush_periodically, args=(interval,), name="location-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """Stops flushing in the background, writing whatever is left in the buffer."""
+        if self._flusher is None:
+            return
+
+        self._stopped.set()
+        self._flusher.join()
+        self._flusher = None
+        with self._session_factory() as db:
+            self.flush(db)
+
+    def _flush_periodically(self, interval: float):
+        """Flushes the buffer until stopped."""
+        while not self._stopped.wait(interval):
+            try:
+                with self._session_factory() as db:
+                    self.flush(db)
+            except Exception:
+                logger.exception("Flushing buffered locations failed")
+
+
+@retry_on_busy
+def write_positions(db: Session, positions: Dict[str, Position]):
+    """Updates the locations of many survivors with a single executemany."""
+    db.execute(
+        update(LatLong.__table__)
+        .where(LatLong.survivor_id == bindparam("b_survivor_id"))
+        .values(latitude=bindparam("b_latitude"), longitude=bindparam("b_longitude")),
+        [{"b_survivor_id": survivor_id, "b_latitude": latitude, "b_longitude": longitude}
+         for survivor_id, (latitude, longitude) in positions.items()]
+    )
+    data_versions.bump(db, SURVIVORS)
+    db.commit()
+
+
+location_buffer = LocationBuffer()
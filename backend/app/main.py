@@ -1,17 +1,50 @@
 """Main module for the API, contains all the routes and the FastAPI app"""
-from typing import List, Optional
-from fastapi import Depends, FastAPI, Header, HTTPException
+from contextlib import asynccontextmanager
+from hashlib import sha256
+from typing import Dict, List, Literal, Optional, Union
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
-from app.pydantic_models import InfectionReport, Item, LatLongUpdate, Survivor, SurvivorCreate, SurvivorTradePayload
+import orjson
+from app.change_feed import survivor_changes
+from app.database import get_async_db, get_db, get_session_factory, init_db
+from app.location_buffer import location_buffer
+from app.metrics import PROMETHEUS_MEDIA_TYPE, MetricsMiddleware, metrics
+from app.query_tracking import QueryTrackingMiddleware
+from app.pydantic_models import (
+    BatchTradePayload, BatchTradeResult, BulkSurvivorCreate, BulkSurvivorCreated, InfectionReport, Item, LatLongUpdate,
+    LocationAck, Offer, OfferCreate, OfferPlaced, Survivor, SurvivorChanges, SurvivorCreate, SurvivorMatch,
+    SurvivorTradePayload)
+from app.versions import ITEMS, SURVIVORS
+import app.async_crud as async_crud
 import app.crud as crud
 
+# Largest page of survivors a client can ask for
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Initializes the database if needed, then flushes buffered locations in the background while the API is up"""
+    # Resolved like the dependencies of the routes, so tests can point it at their own database
+    session_factory = _app.dependency_overrides.get(get_session_factory, get_session_factory)()
+    init_db(session_factory.kw["bind"])
+    location_buffer.start(session_factory)
+    yield
+    survivor_changes.close()
+    location_buffer.stop()
+
+
 # Create the API
 app = FastAPI(
     title="Zombie Apocalypse API",
     description="API to interact with the Zombie Apocalypse app",
     version="0.1",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -20,7 +53,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-DB-Query-Count", "X-DB-Time-Ms", "X-Next-Cursor", "X-Sync-Token"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryTrackingMiddleware)
+
+
+def resource_etag(resource: str, version: Union[int, str], *representation) -> str:
+    """Returns a strong ETag for a data version of a resource, as represented for the given request parameters"""
+    variant = sha256(repr(representation).encode()).hexdigest()[:16]
+    return f'"{resource}-{version}-{variant}"'
+
+
+def is_not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """Tells whether an If-None-Match header holds the ETag"""
+    if not if_none_match:
+        return False
+
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    """Returns the headers telling clients to revalidate what they have against the ETag"""
+    return {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, X-User-Id"}
+
+
+def not_modified(etag: str) -> Response:
+    """Returns a 304 response telling the client that what it has is current"""
+    return Response(status_code=304, headers=cache_headers(etag))
 
 
 # Routes
@@ -30,28 +91,150 @@ async def root():
     return {"message": "Hello, World!"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Latency, database time and status counts of the requests handled, in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+
 @app.get("/items/", response_model=List[Item])
-def get_items(db: Session = Depends(get_db)):
-    """Get all possible items"""
-    items = crud.get_possible_items(db)
+async def get_items(
+        response: Response,
+        if_none_match: Optional[str] = Header(None),
+        db: AsyncSession = Depends(get_async_db)):
+    """Get all possible items, answering 304 when the If-None-Match header holds the current ETag"""
+    version = await async_crud.get_items_version(db)
+    etag = resource_etag(ITEMS, version)
+    if is_not_modified(if_none_match, etag):
+        return not_modified(etag)
+
+    response.headers.update(cache_headers(etag))
+    items = await async_crud.get_possible_items(db, version)
     return items
 
 
-@app.get("/survivors/", response_model=List[Survivor])
+# Unpaged listings rank and format every survivor, so the route runs in the threadpool instead of on the event loop
+@app.get("/survivors/", response_model=Union[List[Survivor], SurvivorChanges])
 def get_survivors(
         user_id: Optional[str] = Header(None, alias="X-User-Id"),
         max_distance: Optional[int] = None,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        distance_method: Literal["equirectangular", "haversine"] = "equirectangular",
+        since: Optional[str] = None,
+        accept: Optional[str] = Header(None),
+        if_none_match: Optional[str] = Header(None),
         db: Session = Depends(get_db)):
-    """Get all survivors, optionally filtering by max distance from the user"""
-    survivors = crud.get_survivors(db, user_id, max_distance)
-    return survivors
+    """
+    Get all survivors, optionally filtering by max distance from the user.
+    Distances are approximated unless distance_method=haversine asks for great-circle distances.
+    Use limit to page through them, passing the X-Next-Cursor header of a page as the cursor of the next,
+    and send Accept: application/x-ndjson to stream them as newline-delimited JSON.
+    Every listing comes with an X-Sync-Token header. Passing the token of a listing's first page as since
+    later returns only the survivors changed since, along with the IDs of those deleted or infected in the meantime.
+    Answers 304 when the If-None-Match header holds the current ETag
+    """
+    ndjson = bool(accept and NDJSON_MEDIA_TYPE in accept) and since is None
+    etag = resource_etag(SURVIVORS, crud.get_survivors_version(db), user_id, max_distance,
+                         limit, cursor, distance_method, since, ndjson)
+    if is_not_modified(if_none_match, etag):
+        return not_modified(etag)
+
+    try:
+        # Taken first, so whatever changes while the listing is read is synced again next time
+        sync_token = crud.get_sync_token(db)
+        survivors, next_cursor = crud.get_survivors(
+            db, user_id, max_distance, limit, cursor, distance_method, since)
+        removed = crud.get_removed_survivors(db, since) if since is not None and not cursor else []
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    # Listings are serialized straight from the rows, which crud builds to match the Survivor model,
+    # instead of validating every row against the response model first
+    headers = {**cache_headers(etag), "X-Sync-Token": sync_token}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+
+    if since is not None:
+        return ORJSONResponse({"survivors": list(survivors), "removed": removed}, headers=headers)
+
+    if ndjson:
+        rows = (orjson.dumps(s, option=orjson.OPT_APPEND_NEWLINE) for s in survivors)
+        return StreamingResponse(rows, media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+    return ORJSONResponse(list(survivors), headers=headers)
+
+
+@app.get("/survivors/search", response_model=List[Survivor])
+async def search_survivors(
+        prefix: str = Query(min_length=1),
+        limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        db: AsyncSession = Depends(get_async_db)):
+    """
+    Search survivors whose name starts with a prefix, ignoring case, ordered by name.
+    Pass the X-Next-Cursor header of a page as the cursor of the next
+    """
+    try:
+        survivors, next_cursor = await async_crud.search_survivors(db, prefix, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return ORJSONResponse(survivors, headers=headers)
+
+
+@app.get("/survivors/fuzzy", response_model=List[SurvivorMatch])
+async def fuzzy_search_survivors(
+        name: str = Query(min_length=1),
+        limit: int = Query(10, ge=1, le=100),
+        min_similarity: float = Query(0.3, gt=0, le=1),
+        db: AsyncSession = Depends(get_async_db)):
+    """
+    Find survivors by a possibly misspelled name, most similar first, scoring how similar each name is from 0 to 1
+    """
+    return await async_crud.fuzzy_search_survivors(db, name, limit, min_similarity)
+
+
+@app.get("/survivors/changes", response_class=StreamingResponse)
+async def follow_survivor_changes():
+    """
+    Follow the changes to the survivors as Server-Sent Events, instead of fetching them all again to spot one.
+    Events tell of survivors created, moved, deleted, becoming infected or trading their inventory. A client
+    falling too far behind is sent a resync event and disconnected, after which it should fetch the survivors again
+    """
+    return StreamingResponse(survivor_changes.follow(), media_type=EVENT_STREAM_MEDIA_TYPE,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/survivors/nearest", response_model=List[Survivor])
+def get_nearest_survivors(
+        k: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+        user_id: str = Header(None, alias="X-User-Id"),
+        db: Session = Depends(get_db)):
+    """
+    Get the k survivors nearest to the logged in survivor, closest first
+    """
+
+    if not user_id:
+        raise HTTPException(
+            status_code=401, detail="You need to be logged in.")
+
+    try:
+        return ORJSONResponse(crud.get_nearest_survivors(db, user_id, k))
+    except ValueError as e:
+        error_message = str(e)
+
+        if "not found" in error_message:
+            raise HTTPException(status_code=404, detail=error_message) from e
+        raise HTTPException(status_code=400, detail=error_message) from e
 
 
 @app.get("/survivors/{name_or_id}", response_model=Optional[Survivor])
-def get_survivor_by_name_or_id(name_or_id: str, db: Session = Depends(get_db)):
+async def get_survivor_by_name_or_id(name_or_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get a survivor by name or ID"""
     try:
-        survivor = crud.get_survivor_by_name_or_id(db, name_or_id)
+        survivor = await async_crud.get_survivor_by_name_or_id(db, name_or_id)
         if not survivor:
             raise HTTPException(
                 status_code=404, detail="Survivor not found in the system")
@@ -63,11 +246,26 @@ def get_survivor_by_name_or_id(name_or_id: str, db: Session = Depends(get_db)):
 @app.post("/survivors/", response_model=Survivor, status_code=201)
 def create_survivor(survivor: SurvivorCreate, db: Session = Depends(get_db)):
     """"Create a survivor"""
-    survivor = crud.create_survivor(
-        db, survivor.name, survivor.age, survivor.gender, survivor.lastLocation, survivor.inventory)
+    try:
+        survivor = crud.create_survivor(
+            db, survivor.name, survivor.age, survivor.gender, survivor.lastLocation, survivor.inventory)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
     return survivor
 
 
+@app.post("/survivors/bulk/", response_model=BulkSurvivorCreated, status_code=201)
+def create_survivors(payload: BulkSurvivorCreate, db: Session = Depends(get_db)):
+    """
+    Register many survivors at once, such as a whole camp. Either every survivor is registered or none are
+    """
+    try:
+        ids = crud.create_survivors(db, payload.survivors)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    return {"ids": ids}
+
+
 @app.post("/survivors/{reported_id}/report/", response_model=InfectionReport, status_code=201)
 def report_infection(
         reported_id: str,
@@ -79,7 +277,16 @@ def report_infection(
         raise HTTPException(
             status_code=401, detail="You need to be logged in to report an infection.")
 
-    report = crud.report_infection(db, user_id, reported_id)
+    try:
+        report = crud.report_infection(db, user_id, reported_id)
+    except ValueError as e:
+        error_message = str(e)
+
+        if "not found" in error_message:
+            raise HTTPException(status_code=404, detail=error_message) from e
+        else:
+            raise HTTPException(status_code=400, detail=error_message) from e
+
     return report
 
 
@@ -104,6 +311,32 @@ def update_location(
     return survivor
 
 
+@app.put("/survivors/{survivor_id}/location/ping", response_model=LocationAck, status_code=202)
+def ping_location(
+        survivor_id: str,
+        latlong: LatLongUpdate,
+        user_id: str = Header(None, alias="X-User-Id"),
+        db: Session = Depends(get_db)):
+    """
+    Report a survivor's location from a device pinging it every few seconds. The location is visible straight
+    away and stored shortly after, only the latest one reported in between is kept
+    """
+
+    if not user_id:
+        raise HTTPException(
+            status_code=401, detail="You need to be logged in.")
+
+    if user_id != survivor_id:
+        raise HTTPException(
+            status_code=401, detail="You can only update your own location.")
+
+    try:
+        return crud.buffer_location(
+            db, survivor_id, latlong.latitude, latlong.longitude)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+
+
 @app.delete("/survivors/{survivor_id}/", response_model=Survivor)
 def delete_survivor(survivor_id: str, db: Session = Depends(get_db)):
     """"Delete a survivor by ID"""
@@ -153,3 +386,85 @@ def trade_items(
             raise HTTPException(status_code=500, detail=str(e)) from e
 
     return None
+
+
+@app.post("/survivors/trades/batch", response_model=BatchTradeResult)
+def trade_items_batch(
+        payload: BatchTradePayload,
+        dry_run: Optional[bool] = False,
+        user_id: str = Header(None, alias="X-User-Id"),
+        db: Session = Depends(get_db)):
+    """
+    Settle many trades in one go, such as a trading post clearing its queue. Trades run in order, each seeing
+    the inventories left by the ones before it. As with single trades, survivor A has to be the logged in
+    survivor, other trades fail. In all_or_nothing mode nothing is traded unless every trade succeeds, in
+    best_effort mode the failing trades are skipped. Use dry_run=True to only check the trades
+    """
+
+    if not user_id:
+        raise HTTPException(
+            status_code=401, detail="You need to be logged in to trade items.")
+
+    return crud.trade_items_batch(
+        db,
+        user_id,
+        [(trade.survivor_a_items, trade.survivor_b_items)
+         for trade in payload.trades],
+        payload.mode == "all_or_nothing",
+        dry_run)
+
+
+@app.get("/offers/", response_model=List[Offer])
+async def get_offers(
+        limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+        db: AsyncSession = Depends(get_async_db)):
+    """Get the open offers, oldest first"""
+    return await async_crud.get_offers(db, limit)
+
+
+@app.post("/offers/", response_model=OfferPlaced, status_code=201)
+def place_offer(
+        offer: OfferCreate,
+        user_id: str = Header(None, alias="X-User-Id"),
+        db: Session = Depends(get_db)):
+    """
+    Offer to give a quantity of an item for as much worth of another item. The offer is traded straight away
+    against the oldest open offer balancing it, if there is one, and is otherwise left open until one comes in
+    """
+
+    if not user_id:
+        raise HTTPException(
+            status_code=401, detail="You need to be logged in to place offers.")
+
+    try:
+        return crud.place_offer(
+            db, user_id, offer.give_item_id, offer.give_quantity, offer.want_item_id)
+    except ValueError as e:
+        error_message = str(e)
+
+        if "not found" in error_message:
+            raise HTTPException(status_code=404, detail=error_message) from e
+        elif "Insufficient items" in error_message:
+            raise HTTPException(status_code=422, detail=error_message) from e
+        raise HTTPException(status_code=400, detail=error_message) from e
+
+
+@app.delete("/offers/{offer_id}/", response_model=Offer)
+def cancel_offer(
+        offer_id: str,
+        user_id: str = Header(None, alias="X-User-Id"),
+        db: Session = Depends(get_db)):
+    """Withdraw one of your open offers"""
+
+    if not user_id:
+        raise HTTPException(
+            status_code=401, detail="You need to be logged in to cancel offers.")
+
+    try:
+        return crud.cancel_offer(db, user_id, offer_id)
+    except ValueError as e:
+        error_message = str(e)
+
+        if "not found" in error_message:
+            raise HTTPException(status_code=404, detail=error_message) from e
+        raise HTTPException(status_code=401, detail=error_message) from e
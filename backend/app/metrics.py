@@ -0,0 +1,173 @@
+"""Request metrics for the API, exposed in the Prometheus text format.
+
+Every request is timed by route template, along with the time it spends in the database, and counted by
+status.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Tuple
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.query_tracking import current_queries
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Route label of requests matching no route, so unknown paths do not each get their own series
+UNMATCHED_ROUTE = "unmatched"
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Metric names, with their type and help text
+METRICS = {
+    "http_requests_total": ("counter", "Requests handled, by route and status"),
+    "http_request_errors_total": ("counter", "Requests answered with an error status, by route and status"),
+    "http_requests_in_progress": ("gauge", "Requests being handled, by route"),
+    "http_request_duration_seconds": ("histogram", "Time taken to handle requests, by route"),
+    "http_request_db_seconds": ("histogram", "Time requests spent running database statements, by route"),
+    "change_feed_subscribers": ("gauge", "Clients following the survivor changes"),
+    "change_feed_evictions_total": ("counter", "Clients of the change feed disconnected for falling behind"),
+}
+
+
+class MetricsRegistry:
+    """Holds the values of the metrics, each thread writing to a shard of its own.
+
+    Recording takes no lock: a thread only ever adds to its own shard, and the shards are summed up when
+    the metrics are rendered. The lock is only taken when a thread records its first value.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards: List[Dict[tuple, float]] = []
+
+    def _shard(self) -> Dict[tuple, float]:
+        """Returns the shard of the current thread."""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = defaultdict(float)
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def increment(self, name: str, labels: Labels, amount: float = 1):
+        """Adds to a counter, or to a gauge when the amount is negative."""
+        self._shard()[(name, labels)] += amount
+
+    def observe(self, name: str, labels: Labels, value: float):
+        """Records a value in a histogram."""
+        shard = self._shard()
+        shard[(name, labels, bisect_left(LATENCY_BUCKETS, value))] += 1
+        shard[(name, labels, "sum")] += value
+
+    def values(self) -> Dict[tuple, float]:
+        """Returns the values of every metric, summed over the shards."""
+        with self._lock:
+            shards = list(self._shards)
+
+        totals: Dict[tuple, float] = defaultdict(float)
+        for shard in shards:
+            for key, value in list(shard.items()):
+                totals[key] += value
+        return totals
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text format."""
+        series: Dict[str, Dict[Labels, Dict]] = defaultdict(lambda: defaultdict(dict))
+        for (name, labels, *part), value in self.values().items():
+            series[name][labels][part[0] if part else "value"] = value
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, parts in sorted(series[name].items()):
+                if kind != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {parts['value']:g}")
+                    continue
+
+                count = 0
+                for bucket, bound in enumerate((*LATENCY_BUCKETS, float("inf"))):
+                    count += parts.get(bucket, 0)
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{name}_bucket{format_labels((*labels, ('le', le)))} {count:g}")
+                lines.append(f"{name}_sum{format_labels(labels)} {parts.get('sum', 0):.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {count:g}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """Forgets every value recorded."""
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+metrics = MetricsRegistry()
+
+
+def format_labels(labels: Labels) -> str:
+    """Formats labels for the Prometheus text format, escaping their values."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+def escape_label(value: str) -> str:
+    """Escapes a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def route_template(scope: Scope) -> str:
+    """Returns the path template of the route a request goes to, such as /survivors/{name_or_id}."""
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Records the latency, database time and status of every request, by route template.
+
+    The database time is the one QueryTrackingMiddleware attributes to the request, so it has to run inside it.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = (("method", scope["method"]), ("route", route_template(scope)))
+        status = 500  # Unless a response is started
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.increment("http_requests_in_progress", labels)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.observe("http_request_duration_seconds", labels, time.perf_counter() - start)
+            queries = current_queries.get()
+            metrics.observe("http_request_db_seconds", labels, queries.seconds if queries else 0.0)
+            metrics.increment("http_requests_in_progress", labels, -1)
+            status_labels = (*labels, ("status", str(status)))
+            metrics.increment("http_requests_total", status_labels)
+            if status >= 400:
+                metrics.increment("http_request_errors_total", status_labels)
+
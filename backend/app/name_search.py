@@ -0,0 +1,141 @@
+"""Fuzzy matching of survivor names through an index of their trigrams."""
+import re
+from collections import Counter
+from math import ceil
+from functools import lru_cache
+from typing import FrozenSet, Iterable, List, Tuple
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from app.alchemy_models import NameTrigram, Survivor, TrigramCount
+
+# Most trigram postings read per search. The search is exact down to the similarity threshold while the
+# postings of the rarest trigrams fit, beyond that it only sees the first postings
+MAX_POSTINGS = 3_000
+
+# Most candidates scored per search, those sharing the most trigrams with the searched name
+MAX_CANDIDATES = 300
+
+# Number of names whose trigrams are kept at hand, common names come up in search after search
+TRIGRAM_CACHE_SIZE = 100_000
+
+# Number of survivors indexed at a time when rebuilding the index
+REINDEX_BATCH_SIZE = 5_000
+
+WORD = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=TRIGRAM_CACHE_SIZE)
+def trigrams(name: str) -> FrozenSet[str]:
+    """Returns the trigrams of a name, each lowercased word padded with two spaces in front and one behind."""
+    result = set()
+    for word in WORD.findall(name.casefold()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(result)
+
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Returns the share of the trigrams of two names that they have in common, from 0 to 1."""
+    common = len(a & b)
+    return common / (len(a) + len(b) - common) if common else 0.0
+
+
+def index_names(db: Session, survivors: Iterable[Tuple[str, str]]):
+    """Adds survivors, given as (ID, name) pairs, to the trigram index.
+
+    There are about a dozen postings per name, so they go straight to the driver instead of having
+    SQLAlchemy build parameters for each, and in order, so every trigram's postings are filled in together.
+    """
+    postings = sorted((trigram, survivor_id) for survivor_id, name in survivors for trigram in trigrams(name))
+    if not postings:
+        return
+
+    db.connection().exec_driver_sql(
+        f"INSERT INTO {NameTrigram.__tablename__} (trigram, survivor_id) VALUES (?, ?)", postings)
+
+    counts = insert(TrigramCount.__table__)
+    db.execute(
+        counts.on_conflict_do_update(
+            index_elements=["trigram"], set_={"count": TrigramCount.count + counts.excluded.count}),
+        [{"trigram": trigram, "count": count}
+         for trigram, count in Counter(trigram for trigram, _ in postings).items()]
+    )
+
+
+def unindex_names(db: Session, survivors: Iterable[Tuple[str, str]]):
+    """Removes survivors, given as (ID, name) pairs, from the trigram index."""
+    survivors = list(survivors)
+    counts = Counter(trigram for _, name in survivors for trigram in trigrams(name))
+    if not counts:
+        return
+
+    db.execute(delete(NameTrigram).where(
+        NameTrigram.survivor_id.in_([survivor_id for survivor_id, _ in survivors])))
+    db.execute(
+        update(TrigramCount.__table__)
+        .where(TrigramCount.trigram == bindparam("b_trigram"))
+        .values(count=TrigramCount.count - bindparam("b_count")),
+        [{"b_trigram": trigram, "b_count": count} for trigram, count in counts.items()]
+    )
+
+
+def reindex_names(db: Session) -> int:
+    """Rebuilds the trigram index from every survivor, returning how many were indexed."""
+    db.execute(delete(NameTrigram))
+    db.execute(delete(TrigramCount))
+
+    indexed = 0
+    for batch in db.execute(select(Survivor.id, Survivor.name)).partitions(REINDEX_BATCH_SIZE):
+        index_names(db, batch)
+        indexed += len(batch)
+    return indexed
+
+
+def find_candidates(db: Session, name: str, min_similarity: float, *criteria) -> Tuple[FrozenSet[str], List[Tuple[str, str]]]:
+    """Returns the trigrams of a name and the (ID, name) of the survivors that may be similar enough to it.
+
+    A name at least `min_similarity` similar to one with n trigrams shares at least ceil(min_similarity * n)
+    of them, so it has one of any n - ceil(min_similarity * n) + 1 of them. Only the postings of that many
+    of the rarest are read, and the survivors turning up in most of them are the candidates. Survivors can
+    be filtered further with SQL criteria.
+    """
+    wanted = trigrams(name)
+    if not wanted:
+        return wanted, []
+
+    counts = dict(db.execute(
+        select(TrigramCount.trigram, TrigramCount.count)
+        .where(TrigramCount.trigram.in_(wanted))).all())
+    needed = len(wanted) - ceil(min_similarity * len(wanted) - 1e-9) + 1
+    rarest = sorted(wanted, key=lambda trigram: counts.get(trigram, 0))[:needed]
+
+    lookups, postings = [], 0
+    for trigram in rarest:
+        if counts.get(trigram, 0) <= 0:
+            continue  # Nobody has it
+        if lookups and postings + counts[trigram] > MAX_POSTINGS:
+            break
+        lookups.append(trigram)
+        postings += counts[trigram]
+
+    if not lookups:
+        return wanted, []
+
+    hits = (
+        select(NameTrigram.survivor_id)
+        .where(NameTrigram.trigram.in_(lookups))
+        .limit(MAX_POSTINGS)
+        .subquery()
+    )
+    most_hits = (
+        select(hits.c.survivor_id)
+        .group_by(hits.c.survivor_id)
+        .order_by(func.count().desc())
+        .limit(MAX_CANDIDATES)
+    )
+    candidates = db.execute(
+        select(Survivor.id, Survivor.name)
+        .where(Survivor.id.in_(most_hits), *criteria)
+    ).all()
+    return wanted, [tuple(candidate) for candidate in candidates]
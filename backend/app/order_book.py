@@ -0,0 +1,146 @@
+"""In-memory order book of the standing trade offers, for matching offers without reading the database."""
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+# Offers are matched by what they give, what they want and how much what they give is worth
+BookKey = Tuple[str, str, int]
+
+# Reads the offers placed since a stamp, or all of them given None, returning a stamp to read from next time
+ReadOffers = Callable[[Optional[str]], Tuple[str, Iterable["OpenOffer"]]]
+
+
+class OpenOffer(NamedTuple):
+    """A standing offer to give a quantity of an item for any quantity of another item worth as much."""
+    id: str
+    survivor_id: str
+    give_item_id: str
+    give_quantity: int
+    want_item_id: str
+    worth: int
+
+    @property
+    def key(self) -> BookKey:
+        """Returns the key the offer is filed under."""
+        return self.give_item_id, self.want_item_id, self.worth
+
+    @property
+    def counter_key(self) -> BookKey:
+        """Returns the key of the offers balancing this one: giving what it wants for what it gives, worth as much."""
+        return self.want_item_id, self.give_item_id, self.worth
+
+
+class OrderBook:
+    """Files the open offers by item given, item wanted and worth, oldest first within each key.
+
+    Finding the offers balancing a new one is then a lookup of a single key, however many offers are open.
+    The book is read from the database on first use, and again whenever the worths of the items change.
+    The write operations of this process keep it up to date once their changes are committed, and every
+    claim first files the offers placed since the previous one, so offers placed by other processes are
+    matched too. Offers filled or cancelled elsewhere stay in the book until claimed, and filling them finds
+    them gone.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._offers: Optional[Dict[str, OpenOffer]] = None
+        self._queues: Dict[BookKey, "OrderedDict[str, OpenOffer]"] = {}
+        self._claimed: Set[str] = set()
+        self._catalogue_version: Optional[int] = None
+        self._stamp: Optional[str] = None
+
+    def claim(
+            self,
+            key: BookKey,
+            exclude_survivor_id: str,
+            catalogue_version: int,
+            read_offers: ReadOffers) -> Optional[OpenOffer]:
+        """Takes the oldest offer filed under a key out of the book, leaving out a survivor's own offers.
+
+        The claimed offer is no longer matched with others until it is released, or put back because filling
+        it failed. `read_offers` returns the open offers placed since the stamp it is given, or all of them
+        given None, worth as much as the catalogue of the given version says, along with the stamp to read
+        from next time.
+        """
+        with self._lock:
+            if self._offers is None or self._catalogue_version != catalogue_version:
+                stamp, offers = read_offers(None)
+                self._load(offers, catalogue_version)
+            else:
+                stamp, offers = read_offers(self._stamp)
+                for offer in offers:
+                    if offer.id not in self._offers and offer.id not in self._claimed:
+                        self._file(offer)
+            self._stamp = stamp
+
+            queue = self._queues.get(key)
+            if not queue:
+                return None
+
+            for offer in queue.values():
+                if offer.survivor_id != exclude_survivor_id:
+                    self._remove(offer.id)
+                    self._claimed.add(offer.id)
+                    return offer
+            return None
+
+    def release(self, offer_id: str):
+        """Forgets a claimed offer once it is filled or closed."""
+        with self._lock:
+            self._claimed.discard(offer_id)
+
+    def add(self, offer: OpenOffer):
+        """Files a newly placed offer, after the others under its key."""
+        with self._lock:
+            if self._offers is not None:
+                self._file(offer)
+
+    def put_back(self, offer: OpenOffer):
+        """Files a claimed offer again, ahead of the others under its key, as it is older than them."""
+        with self._lock:
+            self._claimed.discard(offer.id)
+            if self._offers is not None:
+                self._file(offer)
+                self._queues[offer.key].move_to_end(offer.id, last=False)
+
+    def remove(self, offer_id: str):
+        """Takes an offer out of the book, such as when it is cancelled."""
+        with self._lock:
+            if self._offers is not None:
+                self._remove(offer_id)
+
+    def invalidate(self):
+        """Drops the book, to be read again on next use."""
+        with self._lock:
+            self._offers = None
+            self._queues = {}
+            self._claimed = set()
+            self._stamp = None
+
+    def _load(self, offers: Iterable[OpenOffer], catalogue_version: int):
+        """Files every open offer not being filled, in the order given."""
+        self._offers = {}
+        self._queues = {}
+        self._catalogue_version = catalogue_version
+        for offer in offers:
+            if offer.id not in self._claimed:
+                self._file(offer)
+
+    def _file(self, offer: OpenOffer):
+        """Files an offer last under its key, the book must be loaded."""
+        self._offers[offer.id] = offer
+        self._queues.setdefault(offer.key, OrderedDict())[offer.id] = offer
+
+    def _remove(self, offer_id: str):
+        """Takes an offer out of the book, the book must be loaded."""
+        offer = self._offers.pop(offer_id, None)
+        if offer is None:
+            return
+
+        queue = self._queues[offer.key]
+        del queue[offer_id]
+        if not queue:
+            del self._queues[offer.key]
+
+
+order_book = OrderBook()
@@ -1,8 +1,8 @@
 """Contains Pydantic models for the API."""
-from typing import Dict, List, Optional
+from typing import Dict, List, Literal, Optional
 from uuid import UUID
 from datetime import datetime
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 # I/O Schemas
 
@@ -33,6 +33,13 @@ class LatLongUpdate(BaseModel):
     longitude: float
 
 
+class LocationAck(BaseModel):
+    """Model for acknowledging a location update"""
+    survivor_id: UUID
+    latitude: float
+    longitude: float
+
+
 class InfectionReport(BaseModel):
     """Model for an infection report"""
     id: UUID
@@ -59,12 +66,25 @@ class Survivor(BaseModel):
     age: int
     gender: str
     inventory: Dict[UUID, int]
-    lastLocation: LatLong
+    lastLocation: Optional[LatLong]  # None until the survivor's location is known
     infectionReports: List[InfectionReport] = []
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class SurvivorChanges(BaseModel):
+    """Model for the survivors changed since a sync token"""
+    survivors: List[Survivor]
+    removed: List[UUID]
+
+
+class SurvivorMatch(BaseModel):
+    """Model for a survivor found by a fuzzy name search"""
+    id: UUID
+    name: str
+    similarity: float
+
+
 class LatLongCreate(BaseModel):
     """Model for creating a latitude and longitude pair for a survivor's location"""
     latitude: float
@@ -82,7 +102,66 @@ class SurvivorCreate(BaseModel):
     infectionReports: List[InfectionReport] = []
 
 
+class BulkSurvivorCreate(BaseModel):
+    """Model for registering many survivors at once"""
+    survivors: List[SurvivorCreate] = Field(min_length=1, max_length=10_000)
+
+
+class BulkSurvivorCreated(BaseModel):
+    """Model for the IDs of survivors registered at once, in the order they were given"""
+    ids: List[UUID]
+
+
 class SurvivorTradePayload(BaseModel):
     """Model for a survivor trade payload"""
     survivor_id: UUID
     items: Dict[UUID, int]
+
+
+class SurvivorTrade(BaseModel):
+    """Model for a trade between two survivors"""
+    survivor_a_items: SurvivorTradePayload
+    survivor_b_items: SurvivorTradePayload
+
+
+class BatchTradePayload(BaseModel):
+    """Model for a batch of trades settled together"""
+    trades: List[SurvivorTrade] = Field(min_length=1, max_length=500)
+    mode: Literal["all_or_nothing", "best_effort"] = "all_or_nothing"
+
+
+class TradeResult(BaseModel):
+    """Model for the outcome of a single trade in a batch"""
+    index: int
+    success: bool
+    detail: str
+
+
+class BatchTradeResult(BaseModel):
+    """Model for the outcome of a batch of trades"""
+    committed: bool
+    results: List[TradeResult]
+
+
+class OfferCreate(BaseModel):
+    """Model for placing an offer to give a quantity of an item for as much worth of another"""
+    give_item_id: UUID
+    give_quantity: int = Field(gt=0)
+    want_item_id: UUID
+
+
+class Offer(BaseModel):
+    """Model for a standing offer"""
+    id: UUID
+    survivor_id: UUID
+    give_item_id: UUID
+    give_quantity: int
+    want_item_id: UUID
+    want_quantity: int
+    created_at: datetime
+
+
+class OfferPlaced(BaseModel):
+    """Model for the outcome of placing an offer: the offer it was traded against, or the offer left open"""
+    matched_offer: Optional[Offer] = None
+    offer: Optional[Offer] = None
@@ -0,0 +1,133 @@
+"""Attribution of SQL statements to the request running them, to find slow queries and query storms.
+
+Every request counts its statements and the time they take. With ZOMBIE_SQL_INSTRUMENTATION=1, statements
+slower than ZOMBIE_SLOW_QUERY_MS are logged with their query plan, and requests running the same statement
+more than ZOMBIE_REPEATED_QUERY_LIMIT times, typically lazy relationships loaded one row at a time, are
+flagged. With ZOMBIE_SQL_DEBUG_HEADERS=1, responses tell how many statements the request ran and for how long.
+"""
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import Engine, event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+SQL_INSTRUMENTATION = os.environ.get("ZOMBIE_SQL_INSTRUMENTATION") == "1"
+SQL_DEBUG_HEADERS = os.environ.get("ZOMBIE_SQL_DEBUG_HEADERS") == "1"
+
+# Statements taking longer than this many milliseconds are logged with their query plan
+SLOW_QUERY_MS = float(os.environ.get("ZOMBIE_SLOW_QUERY_MS", "100"))
+
+# Requests running the same statement more than this many times are flagged
+REPEATED_QUERY_LIMIT = int(os.environ.get("ZOMBIE_REPEATED_QUERY_LIMIT", "10"))
+
+
+class RequestQueries:
+    """The statements a request has run so far, shared with the threads it runs in."""
+    __slots__ = ("request", "count", "seconds", "statements", "flagged")
+
+    def __init__(self, request: str):
+        self.request = request
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+        self.flagged = set()
+
+    def record(self, statement: str, seconds: float):
+        """Counts a statement, flagging it the first time the request runs it too often."""
+        self.count += 1
+        self.seconds += seconds
+        if not SQL_INSTRUMENTATION:
+            return
+
+        self.statements[statement] += 1
+        if self.statements[statement] > REPEATED_QUERY_LIMIT and statement not in self.flagged:
+            self.flagged.add(statement)
+            logger.warning("%s ran the same statement more than %d times, is a relationship loaded lazily? %s",
+                           self.request, REPEATED_QUERY_LIMIT, statement)
+
+
+current_queries: ContextVar[Optional[RequestQueries]] = ContextVar("current_queries", default=None)
+
+
+def query_plan(conn, statement: str, parameters) -> str:
+    """Returns the query plan SQLite picks for a statement, one step per line."""
+    if isinstance(parameters, list):  # An executemany, the plan is the same for every row
+        parameters = parameters[0] if parameters else ()
+
+    # A cursor of its own keeps the plan out of the statement events and the results of the statement
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return "\n".join(f"  {row[-1]}" for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+class QueryTrackingMiddleware:
+    """Attributes the statements run while handling a request to it."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries(f"{scope['method']} {scope['path']}")
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start" and SQL_DEBUG_HEADERS:
+                headers = MutableHeaders(scope=message)
+                headers["X-DB-Query-Count"] = str(queries.count)
+                headers["X-DB-Time-Ms"] = f"{queries.seconds * 1000:.3f}"
+            await send(message)
+
+        token = current_queries.set(queries)
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_queries.reset(token)
+
+
+# Time every statement, attributing it to the request running it
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    """Notes when a statement starts."""
+    conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    """Adds a statement to the request running it, and logs it if it was slow."""
+    starts = conn.info.get("statement_start")
+    if not starts:
+        return
+
+    seconds = time.perf_counter() - starts.pop()
+    queries = current_queries.get()
+    if queries is not None:
+        queries.record(statement, seconds)
+
+    if SQL_INSTRUMENTATION and seconds * 1000 > SLOW_QUERY_MS:
+        try:
+            plan = query_plan(conn, statement, parameters)
+        except Exception as e:  # The plan is a courtesy, the statement itself succeeded
+            plan = f"  unavailable: {e}"
+        logger.warning("Slow statement took %.1f ms%s: %s\n%s", seconds * 1000,
+                       f" in {queries.request}" if queries else "", statement, plan)
+
+
+@event.listens_for(Engine, "handle_error")
+def _drop_statement_timer(exception_context):
+    """Forgets when a failed statement started."""
+    starts = exception_context.connection.info.get("statement_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
@@ -0,0 +1,245 @@
+"""Generator of synthetic survivors, for development databases and for reproducing production-scale behaviour.
+
+Survivors gather in camps around Danish and Swedish cities, with some stragglers in between. They carry a
+mix of the items in the catalogue and report each other for infection within their camp, so some of them
+end up infected. A generator seeded the same way always produces the same survivors, down to their IDs.
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.alchemy_models import STAMP_SQL, Item
+from app.database import Base
+from app.crud import INFECTION_THRESHOLD
+from app.name_search import index_names
+from app.versions import SURVIVORS, data_versions
+
+# Number of survivors in a fresh development database
+DEFAULT_SURVIVORS = 30
+
+# Number of survivors generated and inserted at a time
+SEED_BATCH_SIZE = 50_000
+
+# Smallest load for which the secondary indexes are dropped and rebuilt, rather than updated as rows go in
+REBUILD_INDEXES_FROM = 100_000
+
+KM_PER_DEGREE = 111.32
+
+# Share of all IDs, from and to, as fractions
+Span = Tuple[float, float]
+
+FIRST_NAMES = (
+    "Aarav", "Abigail", "Alexander", "Amelia", "Anna", "Astrid", "Ava", "Benjamin", "Charlotte", "Clara",
+    "Daniel", "Ella", "Emil", "Emily", "Emma", "Evelyn", "Freja", "Harper", "Henry", "Ida", "Isabella",
+    "Jack", "Jacob", "James", "Johan", "Karl", "Katrine", "Liam", "Lucas", "Magnus", "Matthew", "Mia",
+    "Michael", "Noah", "Oliver", "Olivia", "Oscar", "Sebastian", "Sofie", "Sophia", "William", "Viktor",
+)
+LAST_NAMES = (
+    "Andersen", "Berg", "Christensen", "Dahl", "Eriksson", "Frederiksen", "Hansen", "Holm", "Jensen",
+    "Johansson", "Jørgensen", "Karlsson", "Larsen", "Lindberg", "Madsen", "Mortensen", "Nielsen", "Nilsson",
+    "Olsen", "Pedersen", "Persson", "Petersen", "Rasmussen", "Schmidt", "Sørensen", "Thomsen", "Vestergaard",
+)
+
+
+@dataclass(frozen=True)
+class Camp:
+    """A place survivors gather around, spreading out from its center."""
+    latitude: float
+    longitude: float
+    spread_km: float
+    weight: float
+
+
+CAMPS = (
+    Camp(55.676, 12.568, 4.0, 0.30),   # Copenhagen
+    Camp(55.605, 13.003, 3.0, 0.12),   # Malmö
+    Camp(56.036, 12.612, 2.0, 0.06),   # Helsingør
+    Camp(55.641, 12.080, 2.0, 0.06),   # Roskilde
+    Camp(55.458, 12.182, 1.5, 0.04),   # Køge
+    Camp(55.927, 12.300, 2.0, 0.05),   # Hillerød
+    Camp(56.157, 10.211, 3.5, 0.17),   # Aarhus
+    Camp(55.403, 10.402, 3.0, 0.12),   # Odense
+    Camp(57.048, 9.919, 2.5, 0.08),    # Aalborg
+)
+
+# Share of survivors roaming the countryside instead of staying at a camp, and where they roam
+STRAGGLER_SHARE = 0.05
+STRAGGLER_LATITUDES = (54.6, 57.7)
+STRAGGLER_LONGITUDES = (8.1, 13.4)
+
+# Chance of carrying an item and the average quantity carried, by item label
+ITEM_MIXES = {
+    "water": (0.9, 6),
+    "food": (0.8, 5),
+    "medication": (0.35, 2),
+    "ammunition": (0.5, 12),
+}
+DEFAULT_ITEM_MIX = (0.5, 3)
+
+# Shares of survivors infected, reported at least INFECTION_THRESHOLD times, and suspected, reported less often
+INFECTED_SHARE = 0.02
+SUSPECTED_SHARE = 0.05
+
+# Positions of the hex digits in the text of a UUID, between the dashes
+UUID_DIGIT_POSITIONS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+# Columns of the rows generated for each table, in the order the values are given
+COLUMNS = {
+    "survivors": ("id", "name", "age", "gender", "infection_count"),
+    "latlong": ("id", "survivor_id", "latitude", "longitude"),
+    "inventory": ("survivor_id", "item_id", "quantity"),
+    "infection_reports": ("id", "reported_id", "reporter_id"),
+}
+
+
+def random_ids(rng: np.random.Generator, count: int, span: Span = (0.0, 1.0)) -> List[str]:
+    """Returns `count` UUID4 strings drawn from the generator, in order.
+
+    The IDs are drawn from the given share of all IDs, so batches drawing from consecutive shares come
+    out in order too, and are appended to the primary key indexes instead of being scattered over them.
+    """
+    data = rng.integers(0, 256, size=(count, 16), dtype=np.uint8)
+    prefixes = np.sort(rng.integers(int(span[0] * 2 ** 32), int(span[1] * 2 ** 32), size=count, dtype=np.uint64))
+    data[:, :4] = prefixes.astype(">u4").view(np.uint8).reshape(count, 4)
+    data[:, 6] = data[:, 6] & 0x0F | 0x40  # Version 4
+    data[:, 8] = data[:, 8] & 0x3F | 0x80  # RFC 4122 variant
+
+    # Spell out every byte as two hex digits, leaving room for the dashes
+    text = np.full((count, 36), ord("-"), dtype=np.uint8)
+    digits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+    nibbles = np.stack((data >> 4, data & 0x0F), axis=2).reshape(count, 32)
+    text[:, UUID_DIGIT_POSITIONS] = digits[nibbles]
+    return text.view("S36").ravel().astype(str).tolist()
+
+
+def positions(rng: np.random.Generator, count: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the camp of each of `count` survivors, -1 for stragglers, and their latitudes and longitudes."""
+    weights = np.array([camp.weight for camp in CAMPS])
+    camps = rng.choice(len(CAMPS), size=count, p=weights / weights.sum())
+    camps[rng.random(count) < STRAGGLER_SHARE] = -1
+
+    centers = np.array([(camp.latitude, camp.longitude, camp.spread_km) for camp in CAMPS])[camps]
+    offsets = rng.normal(size=(count, 2)) * centers[:, 2:] / KM_PER_DEGREE
+    latitudes = centers[:, 0] + offsets[:, 0]
+    longitudes = centers[:, 1] + offsets[:, 1] / np.cos(np.radians(centers[:, 0]))
+
+    stragglers = camps < 0
+    latitudes[stragglers] = rng.uniform(*STRAGGLER_LATITUDES, size=stragglers.sum())
+    longitudes[stragglers] = rng.uniform(*STRAGGLER_LONGITUDES, size=stragglers.sum())
+    return camps, latitudes, longitudes
+
+
+def infection_reports(rng: np.random.Generator, camps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the reported and reporter indices of the infection reports among a group of survivors.
+
+    Infected survivors are reported INFECTION_THRESHOLD times or more and suspected ones less often, by
+    distinct survivors of their own camp, or by anybody when they are stragglers.
+    """
+    count = len(camps)
+    infected = rng.random(count)
+    report_counts = np.where(
+        infected < INFECTED_SHARE, INFECTION_THRESHOLD + rng.integers(0, 3, size=count),
+        np.where(infected < INFECTED_SHARE + SUSPECTED_SHARE, rng.integers(1, INFECTION_THRESHOLD, size=count), 0))
+
+    members = {camp: np.flatnonzero(camps == camp) for camp in np.unique(camps)}
+    reported, reporters = [], []
+    for index in np.flatnonzero(report_counts):
+        neighbours = members[camps[index]] if camps[index] >= 0 else np.arange(count)
+        candidates = rng.choice(neighbours, size=min(report_counts[index] + 1, len(neighbours)), replace=False)
+        candidates = candidates[candidates != index][:report_counts[index]]
+        reported.extend([index] * len(candidates))
+        reporters.extend(candidates.tolist())
+    return np.array(reported, dtype=np.int64), np.array(reporters, dtype=np.int64)
+
+
+def generate(
+        rng: np.random.Generator,
+        count: int,
+        items: Dict[str, str],
+        span: Span = (0.0, 1.0)) -> Dict[str, List[Tuple]]:
+    """Generates `count` survivors carrying the given items, keyed by label, as rows of each table in COLUMNS.
+
+    The IDs of the rows are drawn from the given share of all IDs.
+    """
+    ids = random_ids(rng, count, span)
+    camps, latitudes, longitudes = positions(rng, count)
+    names = [f"{first} {last}" for first, last in zip(
+        rng.choice(FIRST_NAMES, size=count).tolist(), rng.choice(LAST_NAMES, size=count).tolist())]
+    ages = np.clip(rng.normal(35, 18, size=count), 1, 95).astype(int).tolist()
+    genders = rng.choice(["f", "m"], size=count).tolist()
+    reported, reporters = infection_reports(rng, camps)
+    infection_counts = np.bincount(reported, minlength=count).tolist()
+
+    inventories = []
+    for label, item_id in items.items():
+        chance, mean_quantity = ITEM_MIXES.get(label, DEFAULT_ITEM_MIX)
+        carriers = np.flatnonzero(rng.random(count) < chance)
+        quantities = 1 + rng.poisson(mean_quantity - 1, size=len(carriers))
+        inventories.extend((ids[carrier], item_id, quantity)
+                           for carrier, quantity in zip(carriers.tolist(), quantities.tolist()))
+
+    return {
+        "survivors": list(zip(ids, names, ages, genders, infection_counts)),
+        "latlong": list(zip(random_ids(rng, count, span), ids, latitudes.tolist(), longitudes.tolist())),
+        "inventory": inventories,
+        "infection_reports": list(zip(random_ids(rng, len(reported), span),
+                                      [ids[index] for index in reported.tolist()],
+                                      [ids[index] for index in reporters.tolist()])),
+    }
+
+
+def generate_batches(count: int, items: Dict[str, str], seed: Optional[int],
+                     batch_size: int = SEED_BATCH_SIZE) -> Iterator[Dict[str, List[Tuple]]]:
+    """Generates `count` survivors a batch at a time, the same ones for the same seed and batch size."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, batch_size):
+        end = min(start + batch_size, count)
+        yield generate(rng, end - start, items, (start / count, end / count))
+
+
+def bulk_insert(db: Session, table: str, rows: List[Tuple]):
+    """Inserts rows, given as tuples of the table's COLUMNS, with a single executemany, stamped as changed now.
+
+    The rows go straight to the driver, as building SQLAlchemy parameters for every row costs more than
+    SQLite takes to insert it. Rows are sorted first, so the primary key index is filled in order.
+    """
+    if not rows:
+        return
+
+    columns = COLUMNS[table]
+    db.connection().exec_driver_sql(
+        f"INSERT INTO {table} ({', '.join(columns)}, updated_at) "
+        f"VALUES ({', '.join('?' * len(columns))}, {STAMP_SQL})", sorted(rows))
+
+
+def seed_survivors(db: Session, count: int = DEFAULT_SURVIVORS, seed: Optional[int] = 0,
+                   with_name_index: bool = True) -> int:
+    """Bulk loads `count` synthetic survivors carrying the items in the database, returning how many were added.
+
+    Every batch goes in with one executemany per table and the whole load is committed at once. Names are
+    indexed for fuzzy search unless `with_name_index` is off, which leaves the index to be rebuilt later
+    and saves most of the time a large load takes. A seed of None picks a random one.
+    """
+    items = dict(db.execute(select(Item.label, Item.id)).all())
+    if not items:
+        raise ValueError("There are no items for survivors to carry, seed the items first")
+
+    # For large loads, building the secondary indexes once at the end beats updating them row by row
+    connection = db.connection()
+    indexes = [index for table in COLUMNS for index in Base.metadata.tables[table].indexes
+               if count >= REBUILD_INDEXES_FROM]
+    for index in indexes:
+        index.drop(connection)
+
+    for batch in generate_batches(count, items, seed):
+        for table, rows in batch.items():
+            bulk_insert(db, table, rows)
+        if with_name_index:
+            index_names(db, ((survivor_id, name) for survivor_id, name, *_ in batch["survivors"]))
+
+    for index in indexes:
+        index.create(connection)
+    data_versions.bump(db, SURVIVORS)
+    db.commit()
+    return count
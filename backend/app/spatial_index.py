@@ -0,0 +1,211 @@
+"""In-memory spatial index of survivor positions, for finding the survivors nearest to someone."""
+from heapq import heappush, heapreplace
+from math import sqrt
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from app.geo import chord_to_meters, to_unit_sphere
+
+Point = Tuple[float, float, float]
+
+# A token to read the next changes from, the IDs, latitudes and longitudes of survivors changed since the previous
+# token, and the IDs of those removed
+Changes = Tuple[Hashable, Tuple[np.ndarray, np.ndarray, np.ndarray], List[str]]
+
+# Smallest number of changes that makes a tree worth rebuilding, so small trees are not rebuilt constantly
+MIN_CHANGES_BEFORE_REBUILD = 64
+
+
+class _Node:
+    """A survivor's position in the tree, splitting the space below it along one axis."""
+    __slots__ = ("survivor_id", "point", "axis", "left", "right", "deleted")
+
+    def __init__(self, survivor_id: str, point: Point, axis: int):
+        self.survivor_id = survivor_id
+        self.point = point
+        self.axis = axis
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+        self.deleted = False
+
+
+class KDTree:
+    """A 3-d tree of survivor positions on the unit sphere, where straight-line distance ranks like great-circle distance.
+
+    Survivors are inserted as new leaves and removed by marking their node deleted, so a balanced tree
+    takes O(log n) per change and O(log n + k) to find the k nearest. Changes slowly unbalance the tree,
+    which is why needs_rebuild tells when to rebuild it from scratch.
+    """
+
+    def __init__(self, positions: Dict[str, Point]):
+        self._nodes: Dict[str, _Node] = {}
+        self._changes = 0
+
+        survivor_ids = list(positions)
+        points = np.array([positions[survivor_id]
+                          for survivor_id in survivor_ids], dtype=np.float64).reshape(-1, 3)
+        self._size_at_build = len(survivor_ids)
+        self._root = self._build(survivor_ids, points, np.arange(len(survivor_ids)), 0)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def _build(self, survivor_ids: List[str], points: np.ndarray, indices: np.ndarray, axis: int) -> Optional[_Node]:
+        """Builds a balanced subtree over the given positions, splitting at the median."""
+        if not len(indices):
+            return None
+
+        middle = len(indices) // 2
+        indices = indices[np.argpartition(points[indices, axis], middle)]
+        node = _Node(survivor_ids[indices[middle]], tuple(points[indices[middle]].tolist()), axis)
+        self._nodes[node.survivor_id] = node
+
+        next_axis = (axis + 1) % 3
+        node.left = self._build(survivor_ids, points, indices[:middle], next_axis)
+        node.right = self._build(survivor_ids, points, indices[middle + 1:], next_axis)
+        return node
+
+    def insert(self, survivor_id: str, point: Point):
+        """Adds a survivor's position, replacing any position it already has."""
+        node = self._nodes.get(survivor_id)
+        if node is not None and node.point == point:
+            return  # Already there, so the tree is left as balanced as it is
+
+        self.remove(survivor_id)
+
+        node = _Node(survivor_id, point, 0)
+        parent = self._root
+        if parent is None:
+            self._root = node
+        while parent is not None:
+            branch = "left" if point[parent.axis] < parent.point[parent.axis] else "right"
+            child = getattr(parent, branch)
+            if child is None:
+                node.axis = (parent.axis + 1) % 3
+                setattr(parent, branch, node)
+            parent = child
+
+        self._nodes[survivor_id] = node
+        self._changes += 1
+
+    def remove(self, survivor_id: str):
+        """Removes a survivor's position, if it is in the tree."""
+        node = self._nodes.pop(survivor_id, None)
+        if node is not None:
+            node.deleted = True
+            self._changes += 1
+
+    def needs_rebuild(self) -> bool:
+        """Tells whether the tree has changed so much since it was built that it may be badly unbalanced."""
+        return self._changes > max(self._size_at_build, MIN_CHANGES_BEFORE_REBUILD)
+
+    def rebuilt(self) -> "KDTree":
+        """Returns a balanced tree holding the same positions."""
+        return KDTree({survivor_id: node.point for survivor_id, node in self._nodes.items()})
+
+    def nearest(self, point: Point, k: int, exclude_id: Optional[str] = None) -> List[Tuple[float, str]]:
+        """Returns the squared distance and ID of the k survivors nearest to the point, closest first."""
+        x, y, z = point
+        found: List[Tuple[float, str]] = []  # Max-heap of the closest so far, by negated distance
+        stack = [(self._root, 0.0)]
+
+        while stack:
+            node, bound = stack.pop()
+            # Skip subtrees that cannot hold anything closer than what has been found
+            if node is None or (len(found) == k and bound > -found[0][0]):
+                continue
+
+            if not node.deleted and node.survivor_id != exclude_id:
+                node_x, node_y, node_z = node.point
+                distance = (x - node_x) ** 2 + (y - node_y) ** 2 + (z - node_z) ** 2
+                if len(found) < k:
+                    heappush(found, (-distance, node.survivor_id))
+                elif distance < -found[0][0]:
+                    heapreplace(found, (-distance, node.survivor_id))
+
+            difference = point[node.axis] - node.point[node.axis]
+            near, far = (node.left, node.right) if difference < 0 else (node.right, node.left)
+            stack.append((far, max(bound, difference * difference)))
+            stack.append((near, bound))
+
+        return sorted((-distance, survivor_id) for distance, survivor_id in found)
+
+
+class SurvivorIndex:
+    """Keeps the positions of non-infected survivors in a KD-tree, to find the survivors nearest to someone.
+
+    The tree is built from the database on first use. The write operations of this process move and remove
+    survivors once their changes are committed, and every query first catches up with the survivors changed
+    since the last one, so the writes of other processes, such as other workers or the CLI, are seen too.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tree: Optional[KDTree] = None
+        self._token: Optional[Hashable] = None
+
+    def nearest(
+            self,
+            latitude: float,
+            longitude: float,
+            k: int,
+            exclude_id: Optional[str],
+            read_changes: Callable[[Optional[Hashable]], Changes]) -> List[Tuple[str, float]]:
+        """Returns the ID and distance in meters of the k survivors nearest to a position, closest first.
+
+        `read_changes` is given the token the tree is up to date with, or None when the tree has to be built.
+        It returns the token to catch up from next time, the IDs, latitudes and longitudes of the non-infected
+        survivors changed since the given token, or of all of them, and the IDs of the survivors removed since.
+        """
+        with self._lock:
+            token, (survivor_ids, latitudes, longitudes), removed = read_changes(
+                self._token if self._tree is not None else None)
+            known = ~(np.isnan(latitudes) | np.isnan(longitudes))
+            positions = {
+                survivor_id: to_unit_sphere(latitude, longitude)
+                for survivor_id, latitude, longitude in
+                zip(survivor_ids[known].tolist(), latitudes[known].tolist(), longitudes[known].tolist())
+            }
+
+            if self._tree is None:
+                self._tree = KDTree(positions)
+            else:
+                for survivor_id in removed:
+                    self._tree.remove(survivor_id)
+                for survivor_id, point in positions.items():
+                    self._tree.insert(survivor_id, point)
+                self._rebuild_if_needed()
+            self._token = token
+
+            found = self._tree.nearest(
+                to_unit_sphere(latitude, longitude), k, exclude_id)
+
+        return [(survivor_id, chord_to_meters(sqrt(distance))) for distance, survivor_id in found]
+
+    def move(self, survivor_id: str, latitude: float, longitude: float):
+        """Puts a survivor at a new position."""
+        with self._lock:
+            if self._tree is not None:
+                self._tree.insert(survivor_id, to_unit_sphere(latitude, longitude))
+                self._rebuild_if_needed()
+
+    def remove(self, survivor_id: str):
+        """Removes a survivor, such as when deleted or infected."""
+        with self._lock:
+            if self._tree is not None:
+                self._tree.remove(survivor_id)
+                self._rebuild_if_needed()
+
+    def invalidate(self):
+        """Drops the tree, to be built again on the next query."""
+        with self._lock:
+            self._tree = None
+            self._token = None
+
+    def _rebuild_if_needed(self):
+        """Rebalances the tree once it has changed enough."""
+        if self._tree.needs_rebuild():
+            self._tree = self._tree.rebuilt()
+
+
+survivor_index = SurvivorIndex()
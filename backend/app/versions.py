@@ -0,0 +1,38 @@
+"""Versions of the data behind each resource, telling clients whether what they have is still current."""
+from typing import Union
+from sqlalchemy import Connection
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from app.alchemy_models import DataVersion
+
+# Resources with a data version
+ITEMS = "items"
+SURVIVORS = "survivors"
+
+
+class DataVersions:
+    """Counts the committed writes to each resource, in the database.
+
+    Write paths bump the version of a resource in the transaction writing its changes, and readers take the
+    version before they read. As the count is kept alongside the data, every process serving the API, and
+    any tool writing to the database, agrees on it.
+    """
+
+    @staticmethod
+    def get(db: Union[Session, Connection], resource: str) -> int:
+        """Returns the current version of a resource."""
+        version = db.execute(
+            DataVersion.__table__.select().with_only_columns(DataVersion.version)
+            .where(DataVersion.resource == resource)
+        ).scalar()
+        return version or 0
+
+    @staticmethod
+    def bump(db: Union[Session, Connection], resource: str):
+        """Moves a resource on to a new version, to be called in the transaction writing its changes."""
+        statement = insert(DataVersion.__table__).values(resource=resource, version=1)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["resource"], set_={"version": DataVersion.version + 1}))
+
+
+data_versions = DataVersions()
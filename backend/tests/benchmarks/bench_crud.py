@@ -0,0 +1,235 @@
+"""Benchmark of the hot paths in app.crud over synthetic datasets.
+
+Seeds a database per dataset size, then times each operation over a sample of survivors, counting the SQL
+statements every call issues. Results are written as JSON, so runs on different commits can be compared.
+Seeding the largest dataset takes a few minutes. Run from the backend directory with
+
+    python -m tests.benchmarks.bench_crud [--sizes 1000 100000 1000000] [--calls 50] [--output results.json]
+    python -m tests.benchmarks.bench_crud --compare baseline.json [--tolerance 0.25]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from uuid import UUID
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+from app.database import Base, configure_sqlite
+from app.alchemy_models import Inventory, Item, LatLong, Survivor
+from app.catalogue import item_catalogue
+from app.pydantic_models import SurvivorTradePayload
+import app.crud as crud
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+INSERT_BATCH_SIZE = 10_000
+# Items every survivor carries, and how many of each, as (label, worth)
+ITEMS = (("water", 4), ("food", 3), ("medication", 2), ("ammunition", 1))
+QUANTITY = 10
+# Area the survivors are spread over, as (south, north) and (west, east)
+LATITUDES = (54.5, 57.5)
+LONGITUDES = (8.0, 13.0)
+# Page size and range used when listing survivors
+PAGE_SIZE = 100
+MAX_DISTANCE = 10_000
+
+Operation = Callable[[Session, int], object]
+
+
+def random_id(rng: random.Random) -> str:
+    """Returns a UUID4 string drawn from the generator, so datasets are the same on every run."""
+    return str(UUID(int=rng.getrandbits(128), version=4))
+
+
+def seed(db: Session, size: int, rng: random.Random) -> Dict[str, str]:
+    """Fills an empty database with `size` survivors carrying every item, returning the item IDs by label."""
+    items = {label: random_id(rng) for label, _ in ITEMS}
+    db.execute(insert(Item), [{"id": items[label], "label": label, "worth": worth} for label, worth in ITEMS])
+
+    for start in range(0, size, INSERT_BATCH_SIZE):
+        survivors, locations, inventories = [], [], []
+        for number in range(start, min(start + INSERT_BATCH_SIZE, size)):
+            survivor_id = random_id(rng)
+            survivors.append({"id": survivor_id, "name": f"Survivor {number}",
+                              "age": rng.randint(1, 90), "gender": rng.choice("fm")})
+            locations.append({"id": random_id(rng), "survivor_id": survivor_id,
+                              "latitude": rng.uniform(*LATITUDES), "longitude": rng.uniform(*LONGITUDES)})
+            inventories.extend({"survivor_id": survivor_id, "item_id": item_id, "quantity": QUANTITY}
+                               for item_id in items.values())
+        db.execute(insert(Survivor), survivors)
+        db.execute(insert(LatLong), locations)
+        db.execute(insert(Inventory), inventories)
+
+    db.commit()
+    return items
+
+
+def operations(sample: List[Dict], items: Dict[str, str]) -> Dict[str, Operation]:
+    """Returns the operations to time, each called with a fresh session and the number of the call."""
+    def survivor(call: int) -> Dict:
+        return sample[call % len(sample)]
+
+    def trade(call: int):
+        # Pairs are disjoint, so no survivor runs out of what it trades
+        giver, taker = survivor(2 * call), survivor(2 * call + 1)
+        return (SurvivorTradePayload(survivor_id=giver["id"], items={items["water"]: 1}),
+                SurvivorTradePayload(survivor_id=taker["id"], items={items["ammunition"]: 4}))
+
+    def list_page(db: Session, *args) -> List[Dict]:
+        survivors, _ = crud.get_survivors(db, *args)
+        return list(survivors)
+
+    return {
+        "get_survivors": lambda db, call: list_page(db, None, None, PAGE_SIZE),
+        "get_survivors[user_id]": lambda db, call: list_page(db, survivor(call)["id"], None, PAGE_SIZE),
+        "get_survivors[user_id,max_distance]":
+            lambda db, call: list_page(db, survivor(call)["id"], MAX_DISTANCE, PAGE_SIZE),
+        "get_survivor_by_name_or_id[id]": lambda db, call: crud.get_survivor_by_name_or_id(db, survivor(call)["id"]),
+        "get_survivor_by_name_or_id[name]":
+            lambda db, call: crud.get_survivor_by_name_or_id(db, survivor(call)["name"]),
+        "validate_trade": lambda db, call: crud.validate_trade(db, *trade(call)),
+        "trade_items": lambda db, call: crud.trade_items(db, *trade(call)),
+        "report_infection":
+            lambda db, call: crud.report_infection(db, survivor(call)["id"], survivor(call + 1)["id"]),
+        "update_location": lambda db, call: crud.update_location(
+            db, survivor(call)["id"], random.uniform(*LATITUDES), random.uniform(*LONGITUDES)),
+    }
+
+
+def measure(sessions: sessionmaker, operation: Operation, calls: int, statements: List[str]) -> Dict:
+    """Calls an operation `calls` times, returning its timings in milliseconds and SQL statements per call."""
+    timings, counts = [], []
+    for call in range(calls):
+        with sessions() as db:
+            statements.clear()
+            start = time.perf_counter()
+            operation(db, call)
+            timings.append((time.perf_counter() - start) * 1000)
+            counts.append(len(statements))
+
+    timings.sort()
+    return {
+        "calls": calls,
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "max_ms": round(timings[-1], 3),
+        "queries_per_call": round(statistics.fmean(counts), 2),
+        "max_queries": max(counts),
+    }
+
+
+def run(size: int, calls: int, seed_value: int) -> List[Dict]:
+    """Seeds a database of `size` survivors and benchmarks every operation against it."""
+    rng = random.Random(seed_value)
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        configure_sqlite(engine)
+        Base.metadata.create_all(engine)
+        sessions = sessionmaker(bind=engine, autoflush=False)
+
+        start = time.perf_counter()
+        with sessions() as db:
+            items = seed(db, size, rng)
+            # Writes go last, so reads see the dataset as seeded. Trades take two survivors per call
+            sample = [dict(row) for row in db.execute(
+                select(Survivor.id, Survivor.name).order_by(Survivor.name).limit(2 * calls + 1)).mappings()]
+        print(f"Seeded {size} survivors in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+        statements: List[str] = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        item_catalogue.invalidate()
+        results = []
+        for name, operation in operations(sample, items).items():
+            result = {"dataset": size, "operation": name, **measure(sessions, operation, calls, statements)}
+            print(f"{size:>9} {name:<40} {result['median_ms']:9.3f} ms median, "
+                  f"{result['p95_ms']:9.3f} ms p95, {result['queries_per_call']:5.1f} queries/call",
+                  file=sys.stderr)
+            results.append(result)
+
+        item_catalogue.invalidate()
+        engine.dispose()
+    return results
+
+
+def current_commit() -> Optional[str]:
+    """Returns the commit the benchmark runs on, if it runs in a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """Returns the operations that got slower than the tolerance allows, or issue more SQL statements."""
+    previous = {(result["dataset"], result["operation"]): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get((result["dataset"], result["operation"]))
+        if before is None:
+            continue
+
+        label = f"{result['operation']} on {result['dataset']} survivors"
+        if result["median_ms"] > before["median_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: {before['median_ms']} ms -> {result['median_ms']} ms median")
+        if result["queries_per_call"] > before["queries_per_call"]:
+            regressions.append(
+                f"{label}: {before['queries_per_call']} -> {result['queries_per_call']} queries/call")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Numbers of survivors of the datasets to benchmark")
+    parser.add_argument("--calls", type=int, default=50,
+                        help="Number of calls to time per operation and dataset")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the random generator building the datasets")
+    parser.add_argument("--output", default="-",
+                        help="File to write the JSON results to, - for standard output")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="JSON results of an earlier run, to report regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Slowdown of the median tolerated before reporting a regression, as a fraction")
+    args = parser.parse_args()
+
+    report = {
+        "commit": current_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calls": args.calls,
+        "seed": args.seed,
+        "results": [result for size in args.sizes for result in run(size, args.calls, args.seed)],
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(json.load(file), report, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark of the inventory rows written per trade.
+
+Compares the delete-and-reinsert strategy update_inventory used to have with the current one,
+which only writes the rows a trade changes. Run from the backend directory with
+
+    python -m tests.benchmarks.bench_inventory_writes [--items 50] [--trades 200]
+"""
+import argparse
+import time
+from typing import Dict
+from unittest import mock
+from uuid import uuid4
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from app.database import Base
+from app.alchemy_models import Inventory, Item, Survivor
+from app.catalogue import item_catalogue
+from app.pydantic_models import SurvivorTradePayload
+import app.crud as crud
+
+
+def delete_and_reinsert(db: Session, survivor: Survivor, updated_inventory: Dict[str, int]):
+    """The previous update_inventory: clears the whole inventory and writes it back."""
+    db.query(Inventory).filter(
+        Inventory.survivor_id == survivor.id).delete()
+
+    db.add_all([
+        Inventory(survivor_id=survivor.id,
+                  item_id=item_id, quantity=quantity)
+        for item_id, quantity in updated_inventory.items() if quantity >= 0
+    ])
+
+
+def run(update_inventory, item_count: int, trade_count: int):
+    """Trades one item back and forth between two survivors holding `item_count` items each.
+
+    Returns the inventory rows written per trade and the time taken per trade in milliseconds.
+    """
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    rows_written = 0
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def count_rows(conn, cursor, statement, parameters, context, executemany):
+        nonlocal rows_written
+        if statement.startswith(("INSERT INTO inventory", "UPDATE inventory", "DELETE FROM inventory")):
+            rows_written += max(cursor.rowcount, 0)
+
+    with sessionmaker(bind=engine)() as db:
+        items = [Item(id=str(uuid4()), label=f"item {i}", worth=1)
+                 for i in range(item_count)]
+        survivors = [Survivor(id=str(uuid4()), name=name, age=30, gender="f")
+                     for name in ("Alice", "Bob")]
+        db.add_all(items + survivors)
+        db.add_all(Inventory(survivor_id=survivor.id, item_id=item.id, quantity=10)
+                   for survivor in survivors for item in items)
+        db.commit()
+        item_catalogue.invalidate()
+
+        # Alice swaps an item for one of Bob's, then they swap back
+        alice_id, bob_id = (survivor.id for survivor in survivors)
+        there = (SurvivorTradePayload(survivor_id=alice_id, items={items[0].id: 1}),
+                 SurvivorTradePayload(survivor_id=bob_id, items={items[1].id: 1}))
+        back = (SurvivorTradePayload(survivor_id=bob_id, items={items[0].id: 1}),
+                SurvivorTradePayload(survivor_id=alice_id, items={items[1].id: 1}))
+
+        rows_written = 0
+        with mock.patch.object(crud, "update_inventory", update_inventory):
+            start = time.perf_counter()
+            for trade in range(trade_count):
+                crud.trade_items(db, *(back if trade % 2 else there))
+            elapsed = time.perf_counter() - start
+
+    item_catalogue.invalidate()
+    engine.dispose()
+    return rows_written / trade_count, elapsed / trade_count * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=50,
+                        help="Number of different items each survivor holds")
+    parser.add_argument("--trades", type=int, default=200,
+                        help="Number of trades to run per strategy")
+    args = parser.parse_args()
+
+    print(f"{args.trades} trades between survivors holding {args.items} items each")
+    for name, update_inventory in (("delete and reinsert", delete_and_reinsert),
+                                   ("changed rows only", crud.update_inventory)):
+        rows, milliseconds = run(update_inventory, args.items, args.trades)
+        print(f"{name:>20}: {rows:7.1f} rows written/trade, {milliseconds:6.2f} ms/trade")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Benchmark of matching offers against the open ones.
+
+Places random offers against a book of open offers, and compares finding their match in the order book
+with looking it up in the offers table. Run from the backend directory with
+
+    python -m tests.benchmarks.bench_order_book [--open 10000] [--offers 2000]
+"""
+import argparse
+import random
+import time
+from uuid import uuid4
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.database import Base
+from app.alchemy_models import Inventory, Item, Offer, Survivor
+from app.catalogue import item_catalogue
+from app.order_book import OpenOffer, order_book
+import app.crud as crud
+
+LABELS = ("water", "food", "medication", "ammunition")
+WORTHS = (4, 3, 2, 1)
+
+
+def seed(db: Session, survivor_count: int):
+    """Adds the items and survivors holding plenty of each, returning their IDs."""
+    items = [Item(id=str(uuid4()), label=label, worth=worth) for label, worth in zip(LABELS, WORTHS)]
+    survivors = [Survivor(id=str(uuid4()), name=f"Survivor {i}", age=30, gender="f") for i in range(survivor_count)]
+    db.add_all(items + survivors)
+    db.add_all(Inventory(survivor_id=survivor.id, item_id=item.id, quantity=1_000_000)
+               for survivor in survivors for item in items)
+    db.commit()
+    item_catalogue.invalidate()
+    return [item.id for item in items], [survivor.id for survivor in survivors]
+
+
+def random_offer(rng: random.Random, item_ids, survivor_ids):
+    """Returns a survivor, item given, quantity and item wanted of an offer that can be balanced."""
+    give, want = rng.sample(range(len(item_ids)), 2)
+    quantity = WORTHS[want] * rng.randint(1, 50)  # Worth a whole number of the wanted item
+    return rng.choice(survivor_ids), item_ids[give], quantity, item_ids[want]
+
+
+def sql_match(db: Session, placed: OpenOffer, worths):
+    """Looks up the oldest open offer balancing a placed one in the offers table."""
+    return (
+        db.query(Offer)
+        .filter(Offer.give_item_id == placed.want_item_id,
+                Offer.want_item_id == placed.give_item_id,
+                Offer.give_quantity == placed.worth // worths[placed.want_item_id],
+                Offer.survivor_id != placed.survivor_id)
+        .order_by(Offer.created_at, Offer.id)
+        .first()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--open", type=int, default=10_000, help="Number of open offers to start from")
+    parser.add_argument("--offers", type=int, default=2_000, help="Number of offers to place")
+    parser.add_argument("--survivors", type=int, default=1_000, help="Number of survivors placing offers")
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    rng = random.Random(0)
+
+    SessionLocal = sessionmaker(bind=engine)
+    with SessionLocal() as db:
+        item_ids, survivor_ids = seed(db, args.survivors)
+    worths = dict(zip(item_ids, WORTHS))
+
+    # Every offer is placed in a session of its own, like every request gets
+    def place(offer):
+        with SessionLocal() as db:
+            return crud.place_offer(db, *offer)
+
+    for _ in range(args.open):
+        place(random_offer(rng, item_ids, survivor_ids))
+    offers = [random_offer(rng, item_ids, survivor_ids) for _ in range(args.offers)]
+    placed = [OpenOffer("", survivor_id, give, quantity, want, quantity * worths[give])
+              for survivor_id, give, quantity, want in offers]
+
+    with SessionLocal() as db:
+        open_offers = db.query(Offer).count()
+        start = time.perf_counter()
+        for offer in placed:
+            sql_match(db, offer, worths)
+        sql_seconds = time.perf_counter() - start
+
+    # Claimed offers are put back, so every lookup sees the same book
+    start = time.perf_counter()
+    for offer in placed:
+        match = order_book.claim(offer.counter_key, offer.survivor_id, item_catalogue.version,
+                                 lambda since: (since, ()))  # Nothing placed elsewhere in the meantime
+        if match is not None:
+            order_book.put_back(match)
+    book_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matched = sum(place(offer)["matched_offer"] is not None for offer in offers)
+    place_seconds = time.perf_counter() - start
+
+    order_book.invalidate()
+    item_catalogue.invalidate()
+    engine.dispose()
+
+    print(f"{args.offers} offers placed against {open_offers} open ones, {matched} matched")
+    print(f"{'placing offers':>22}: {args.offers / place_seconds:9.0f} offers/s")
+    print(f"{'matches found in book':>22}: {args.offers / book_seconds:9.0f} lookups/s")
+    print(f"{'matches found in SQL':>22}: {args.offers / sql_seconds:9.0f} lookups/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark of serializing survivor listings.
+
+Compares the response path listings used to take, validating every row against the Survivor model before
+rendering it with the standard JSON encoder, with the current one, which renders the rows built by app.crud
+with orjson directly. Run from the backend directory with
+
+    python -m tests.benchmarks.bench_serialization [--survivors 100000] [--repeat 3]
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+from uuid import uuid4
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+from app.pydantic_models import Survivor
+
+SURVIVORS = TypeAdapter(List[Survivor])
+
+
+def survivor_rows(count: int) -> List[Dict]:
+    """Builds rows shaped like the ones crud.format_survivor_response returns."""
+    item_ids = [str(uuid4()) for _ in range(4)]
+    rows = []
+    for i in range(count):
+        survivor_id = str(uuid4())
+        rows.append({
+            "id": survivor_id,
+            "name": f"Survivor {i}",
+            "age": 20 + i % 50,
+            "gender": "f" if i % 2 else "m",
+            "inventory": {item_id: i % 10 for item_id in item_ids},
+            "lastLocation": {
+                "id": str(uuid4()),
+                "latitude": 55.0 + i % 1000 / 1000,
+                "longitude": 12.0 + i % 997 / 1000,
+                "distance": float(i),
+                "survivor_id": survivor_id
+            },
+            "infectionReports": [{
+                "id": str(uuid4()),
+                "reporter_id": str(uuid4()),
+                "reported_id": survivor_id,
+                "created_at": datetime.now()
+            }] if i % 10 == 0 else []
+        })
+    return rows
+
+
+def validated(rows: List[Dict]) -> bytes:
+    """The previous path: validates the rows against the response model, then encodes them."""
+    return JSONResponse(SURVIVORS.dump_python(SURVIVORS.validate_python(rows), mode="json")).body
+
+
+def trusted(rows: List[Dict]) -> bytes:
+    """The current path: encodes the rows as they are."""
+    return ORJSONResponse(rows).body
+
+
+def best_time(serialize: Callable[[List[Dict]], bytes], rows: List[Dict], repeat: int) -> float:
+    """Returns the best time in milliseconds of serializing the rows."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        serialize(rows)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--survivors", type=int, default=100_000,
+                        help="Number of survivors in the listing")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs per path, of which the best is reported")
+    args = parser.parse_args()
+
+    rows = survivor_rows(args.survivors)
+    print(f"Serializing a listing of {args.survivors} survivors")
+    for name, serialize in (("validated", validated), ("trusted", trusted)):
+        milliseconds = best_time(serialize, rows, args.repeat)
+        print(f"{name:>10}: {milliseconds:8.1f} ms, {milliseconds * 1000 / args.survivors:6.2f} µs/survivor")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,44 @@
 """Fixtures for testing the FastAPI application."""
+from tempfile import TemporaryDirectory
 from uuid import uuid4
 import logging
 import pytest
 import sqlalchemy
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
-from app.database import Base, get_db
+from sqlalchemy.pool import NullPool
+from app.database import SCHEMA_VERSION, Base, configure_sqlite, get_async_db, get_db, get_session_factory
 from app.main import app
+from app.catalogue import item_catalogue
+from app.location_buffer import location_buffer
+from app.order_book import order_book
+from app.spatial_index import survivor_index
 from app.alchemy_models import Survivor, Item, LatLong, Inventory
 from fastapi.testclient import TestClient
 
-# In-memory SQLite database for testing
-TEST_DATABASE_URL = "sqlite:///:memory:"
+# Temporary SQLite database for testing, a file so the sync and async engines can share it
+test_database_dir = TemporaryDirectory()
+TEST_DATABASE_URL = f"sqlite:///{test_database_dir.name}/test.db"
+TEST_ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{test_database_dir.name}/test.db"
 engine = create_engine(
     TEST_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool
+    connect_args={"check_same_thread": False}
 )
+configure_sqlite(engine)
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
 
+# Every test client runs its own event loop, so async connections are not pooled across tests
+async_engine = create_async_engine(TEST_ASYNC_DATABASE_URL, poolclass=NullPool)
+configure_sqlite(async_engine.sync_engine)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, bind=async_engine, expire_on_commit=False)
+
 Base.metadata.create_all(bind=engine)
+# Stamped as up to date, so starting the app leaves the tables to the tests
+with engine.begin() as connection:
+    connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -44,6 +61,17 @@ def db():
             test_db.execute(sqlalchemy.text(f"DELETE FROM {table.name}"))
         test_db.commit()
         test_db.close()
+        item_catalogue.invalidate()
+        location_buffer.clear()
+        survivor_index.invalidate()
+        order_book.invalidate()
+
+
+@pytest.fixture(scope="function")
+async def async_db(db):
+    """Creates an async session on the test database."""
+    async with TestingAsyncSessionLocal() as test_async_db:
+        yield test_async_db
 
 
 @pytest.fixture(scope="function")
@@ -115,6 +143,23 @@ def seed_data(db):
     yield
 
 
+@pytest.fixture(scope="function")
+def executed_statements():
+    """Collects every SQL statement executed against the test database."""
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        for target in (engine, async_engine.sync_engine):
+            event.remove(target, "before_cursor_execute", record_statement)
+
+
 @pytest.fixture(scope="function")
 def client(db):
     """Create a test client with DB session override."""
@@ -125,8 +170,14 @@ def client(db):
         finally:
             pass
 
+    async def override_get_async_db():
+        async with TestingAsyncSessionLocal() as async_db:
+            yield async_db
+
     # Override with our test db
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
 
     # Create client
     # noinspection PyShadowingNames
@@ -135,3 +186,9 @@ def client(db):
 
     # Clear the override
     app.dependency_overrides.clear()
+
+
+@pytest.fixture(scope="function")
+def manual_flush(client):
+    """Stops flushing the location buffer in the background, so the test decides when it is flushed."""
+    location_buffer.stop()
@@ -0,0 +1,123 @@
+"""Test the change feed of the survivors."""
+import asyncio
+import json
+import threading
+import time
+from app.alchemy_models import Item, Survivor
+from app.change_feed import CREATED, DELETED, INFECTED, INVENTORY, MOVED, RESYNC, ChangeBroker, survivor_changes
+from app.metrics import metrics
+from app.pydantic_models import LatLongCreate, SurvivorTradePayload
+import app.crud as crud
+
+
+def parse(stream: bytes):
+    """Returns the kind and data of the events in a stream, skipping comments."""
+    events = []
+    for block in stream.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+async def drain(subscription):
+    """Returns the events waiting for a subscription, once the ones handed over from other threads have arrived."""
+    await asyncio.sleep(0.01)
+    events = b""
+    while not subscription.queue.empty():
+        events += subscription.queue.get_nowait()
+    return parse(events)
+
+
+async def test_changes_are_handed_to_every_client():
+    """Test that changes published from other threads reach every client, in order."""
+    broker = ChangeBroker()
+    first, second = broker.subscribe(), broker.subscribe()
+
+    await asyncio.to_thread(lambda: [broker.publish(MOVED, {"survivor_id": str(i)}) for i in range(5)])
+
+    for subscription in (first, second):
+        assert await drain(subscription) == [(MOVED, {"survivor_id": str(i)}) for i in range(5)]
+
+    broker.unsubscribe(second)
+    broker.publish(MOVED, {"survivor_id": "5"})
+    assert len(await drain(first)) == 1
+    assert await drain(second) == []
+
+
+async def test_slow_clients_are_evicted():
+    """Test that a client falling too far behind is told to resync and disconnected, without holding up the others."""
+    broker = ChangeBroker()
+    metrics.clear()
+    slow = broker.subscribe(size=3)
+    fast = broker.subscribe(size=3)
+    received = []
+
+    for i in range(5):
+        broker.publish(MOVED, {"survivor_id": str(i)})
+        await asyncio.sleep(0)
+        received.extend(await drain(fast))
+
+    assert [event async for event in slow.events()] == [RESYNC]
+    assert len(received) == 5
+    assert metrics.values()[("change_feed_evictions_total", ())] == 1
+
+
+async def test_write_paths_publish_their_changes(db, seed_data):
+    """Test that committed writes are published, and that only the report crossing the threshold is."""
+    subscription = survivor_changes.subscribe()
+    try:
+        water = db.query(Item).filter(Item.label == "water").first()
+        food = db.query(Item).filter(Item.label == "food").first()
+        alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+        bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+        carol = crud.create_survivor(db, "Carol", 28, "f", LatLongCreate(latitude=1.0, longitude=2.0), {})
+        assert await drain(subscription) == [(CREATED, {
+            "survivor_id": carol["id"], "name": "Carol", "age": 28, "gender": "f", "latitude": 1.0, "longitude": 2.0})]
+
+        crud.buffer_location(db, alice.id, 3.0, 4.0)
+        assert await drain(subscription) == [(MOVED, {"survivor_id": alice.id, "latitude": 3.0, "longitude": 4.0})]
+
+        crud.trade_items(db, SurvivorTradePayload(survivor_id=alice.id, items={food.id: 4}),
+                         SurvivorTradePayload(survivor_id=bob.id, items={water.id: 3}))
+        inventories = {change["survivor_id"]: change["inventory"] for kind, change in await drain(subscription)
+                       if kind == INVENTORY}
+        assert inventories[alice.id][water.id] == 8
+        assert water.id not in inventories[bob.id]
+
+        reporters = [crud.create_survivor(db, f"Reporter {i}", 40, "m", LatLongCreate(latitude=0, longitude=0), {})
+                     for i in range(crud.INFECTION_THRESHOLD + 1)]
+        await drain(subscription)
+        for reporter in reporters:
+            crud.report_infection(db, reporter["id"], bob.id)
+        assert await drain(subscription) == [(INFECTED, {"survivor_id": bob.id})]
+    finally:
+        survivor_changes.unsubscribe(subscription)
+
+
+def test_changes_endpoint(db, client, seed_data):
+    """Test that clients of the endpoint are sent the changes as Server-Sent Events."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    carol = crud.create_survivor(db, "Carol", 28, "f", LatLongCreate(latitude=1.0, longitude=2.0), {})
+    responses = []
+    follower = threading.Thread(target=lambda: responses.append(client.get("/survivors/changes")))
+    follower.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not survivor_changes._subscriptions and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        client.put(f"/survivors/{alice.id}/location/ping", json={"latitude": 1.5, "longitude": 2.5},
+                   headers={"X-User-Id": alice.id})
+        client.delete(f"/survivors/{carol['id']}/")
+    finally:
+        survivor_changes.close()
+        follower.join(5)
+
+    response, = responses
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert parse(response.content) == [
+        (MOVED, {"survivor_id": alice.id, "latitude": 1.5, "longitude": 2.5}),
+        (DELETED, {"survivor_id": carol["id"]}),
+    ]
@@ -0,0 +1,65 @@
+"""Test the command line tools."""
+import json
+from uuid import uuid4
+import app.cli as cli
+from app.alchemy_models import Item, Survivor
+from tests.conftest import TestingSessionLocal
+
+
+def test_import_survivors(db, seed_data, tmp_path, monkeypatch, capsys):
+    """Test importing survivors from a JSON file."""
+    monkeypatch.setattr(cli, "SessionLocal", TestingSessionLocal)
+    water = db.query(Item).filter(Item.label == "water").first()
+    survivors_file = tmp_path / "camp.json"
+    survivors_file.write_text(json.dumps([{
+        "name": f"Camper {i}", "age": 30, "gender": "m",
+        "inventory": {str(water.id): 2},
+        "lastLocation": {"latitude": 55.6, "longitude": 12.5},
+    } for i in range(3)]))
+
+    assert cli.main(["import-survivors", str(survivors_file)]) == 0
+    assert "Registered 3 survivors" in capsys.readouterr().out
+    assert db.query(Survivor).filter(Survivor.name.like("Camper %")).count() == 3
+
+
+def test_import_survivors_with_unknown_item(db, seed_data, tmp_path, monkeypatch, capsys):
+    """Test that an import with an unknown item registers nobody."""
+    monkeypatch.setattr(cli, "SessionLocal", TestingSessionLocal)
+    survivors_file = tmp_path / "camp.json"
+    survivors_file.write_text(json.dumps([{
+        "name": "Camper", "age": 30, "gender": "m",
+        "inventory": {str(uuid4()): 2},
+        "lastLocation": {"latitude": 55.6, "longitude": 12.5},
+    }]))
+
+    assert cli.main(["import-survivors", str(survivors_file)]) == 1
+    assert "not found" in capsys.readouterr().err
+    assert db.query(Survivor).filter(Survivor.name == "Camper").count() == 0
+
+
+def test_seed_survivors(db, seed_data, monkeypatch, capsys):
+    """Test generating survivors, and that the same seed cannot be loaded twice."""
+    monkeypatch.setattr(cli, "SessionLocal", TestingSessionLocal)
+    survivor_count = db.query(Survivor).count()
+
+    assert cli.main(["seed-survivors", "50", "--seed", "5"]) == 0
+    assert "Generated 50 survivors with seed 5" in capsys.readouterr().out
+    assert db.query(Survivor).count() == survivor_count + 50
+
+    assert cli.main(["seed-survivors", "50", "--seed", "5"]) == 1
+    assert "already in the database" in capsys.readouterr().err
+    assert db.query(Survivor).count() == survivor_count + 50
+
+
+def test_seed_survivors_leaves_large_loads_out_of_the_name_index(db, seed_data, monkeypatch, capsys):
+    """Test that the name index is skipped by default for large loads only, and can be asked for either way."""
+    monkeypatch.setattr(cli, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(cli, "NAME_INDEX_LIMIT", 20)
+    indexed = []
+    monkeypatch.setattr(cli.seeding, "seed_survivors",
+                        lambda db, count, seed, with_name_index: indexed.append(with_name_index))
+
+    for argv in (["10"], ["20"], ["20", "--with-name-index"], ["10", "--without-name-index"]):
+        assert cli.main(["seed-survivors", *argv, "--seed", "1"]) == 0
+    assert indexed == [True, False, True, False]
+    assert "until reindex-names is run" in capsys.readouterr().out
@@ -0,0 +1,194 @@
+"""Test the database connection handling."""
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import sqlalchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from app.database import SCHEMA_VERSION, configure_sqlite, init_db, retry_on_busy, schema_version
+from app.seeding import DEFAULT_SURVIVORS
+from tests.conftest import TEST_DATABASE_URL
+
+
+def test_connections_use_wal(db):
+    """Test that the engine profile is applied to new connections."""
+    assert db.execute(sqlalchemy.text("PRAGMA journal_mode")).scalar() == "wal"
+    assert db.execute(sqlalchemy.text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+def locked_error():
+    """Creates the error SQLAlchemy raises when another writer holds the database."""
+    return OperationalError("COMMIT", {}, sqlite3.OperationalError("database is locked"))
+
+
+def test_retry_on_busy_retries_locked_transactions(db, monkeypatch):
+    """Test that a transaction failing on a locked database is retried until it succeeds."""
+    monkeypatch.setattr("app.database.time.sleep", lambda seconds: None)
+    attempts = []
+
+    @retry_on_busy
+    def write(session):
+        attempts.append(session)
+        if len(attempts) < 3:
+            raise locked_error()
+        return "done"
+
+    assert write(db) == "done"
+    assert len(attempts) == 3
+
+
+def test_retry_on_busy_gives_up(db, monkeypatch):
+    """Test that retries are bounded and other errors are not retried."""
+    monkeypatch.setattr("app.database.time.sleep", lambda seconds: None)
+    attempts = []
+
+    @retry_on_busy
+    def always_locked(session):
+        attempts.append(session)
+        raise locked_error()
+
+    with pytest.raises(OperationalError):
+        always_locked(db)
+    assert len(attempts) == 5
+
+    @retry_on_busy
+    def broken(session):
+        attempts.append(session)
+        raise OperationalError("SELECT", {}, sqlite3.OperationalError("no such table"))
+
+    attempts.clear()
+    with pytest.raises(OperationalError):
+        broken(db)
+    assert len(attempts) == 1
+
+
+def test_retry_on_busy_reads_under_the_write_lock(db):
+    """Test that wrapped transactions hold the write lock from their first read, and give it up when failing."""
+    impatient = create_engine(TEST_DATABASE_URL, connect_args={"timeout": 0})
+    insert = "INSERT INTO items (id, label, worth) VALUES ('x', 'x', 1)"
+
+    @retry_on_busy
+    def validate(session):
+        session.execute(sqlalchemy.text("SELECT COUNT(*) FROM survivors"))
+        with pytest.raises(OperationalError, match="locked"):
+            with impatient.begin() as connection:
+                connection.exec_driver_sql(insert)
+        raise ValueError("Invalid")
+
+    with pytest.raises(ValueError):
+        validate(db)
+    with impatient.begin() as connection:
+        connection.exec_driver_sql(insert)
+    impatient.dispose()
+
+
+@pytest.fixture
+def fresh_engine(tmp_path):
+    """Creates an engine on an empty database file."""
+    fresh = create_engine(f"sqlite:///{tmp_path}/fresh.db")
+    configure_sqlite(fresh)
+    yield fresh
+    fresh.dispose()
+
+
+def count(engine, table):
+    """Counts the rows of a table."""
+    with engine.connect() as connection:
+        return connection.execute(sqlalchemy.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+
+def test_init_db_creates_and_seeds_once(fresh_engine):
+    """Test that the first start creates and seeds the database, and later ones only check its version."""
+    assert init_db(fresh_engine)
+    with fresh_engine.connect() as connection:
+        assert schema_version(connection) == SCHEMA_VERSION
+    assert count(fresh_engine, "items") == 4
+    assert count(fresh_engine, "survivors") == DEFAULT_SURVIVORS
+
+    statements = []
+    event.listen(fresh_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    assert not init_db(fresh_engine)
+    assert statements == ["PRAGMA user_version"]
+    assert count(fresh_engine, "survivors") == DEFAULT_SURVIVORS
+
+
+def test_concurrent_starts_seed_once(fresh_engine):
+    """Test that processes starting together take turns, so only one of them seeds."""
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        initialized = list(pool.map(lambda _: init_db(fresh_engine), range(4)))
+
+    assert initialized.count(True) == 1
+    assert count(fresh_engine, "items") == 4
+    assert count(fresh_engine, "survivors") == DEFAULT_SURVIVORS
+
+
+def test_init_db_keeps_the_busy_timeout(fresh_engine):
+    """Test that the longer wait for the startup lock does not outlive the startup."""
+    init_db(fresh_engine)
+    with fresh_engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5_000
+
+
+def test_init_db_upgrades_version_1(fresh_engine):
+    """Test that a database from before change tracking gains the stamp columns and indexes, rows stamped."""
+    init_db(fresh_engine)
+    with fresh_engine.begin() as connection:
+        for table in ("survivors", "latlong", "inventory", "infection_reports"):
+            connection.exec_driver_sql(f"DROP INDEX ix_{table}_updated_at")
+            connection.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN updated_at")
+            connection.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN deleted_at")
+        connection.exec_driver_sql("PRAGMA user_version = 1")
+
+    assert init_db(fresh_engine)
+    with fresh_engine.connect() as connection:
+        assert schema_version(connection) == SCHEMA_VERSION
+        assert connection.exec_driver_sql("SELECT COUNT(*) FROM survivors WHERE updated_at IS NULL").scalar() == 0
+        indexes = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars().all()
+    assert "ix_latlong_updated_at" in indexes
+    assert count(fresh_engine, "survivors") == DEFAULT_SURVIVORS
+
+
+# Tables as the original models created them, before the schema was versioned
+BASELINE_SCHEMA = (
+    "CREATE TABLE items (id TEXT NOT NULL, label VARCHAR, worth INTEGER, PRIMARY KEY (id))",
+    "CREATE TABLE survivors (id TEXT NOT NULL, name VARCHAR, age INTEGER, gender VARCHAR, PRIMARY KEY (id))",
+    "CREATE INDEX ix_survivors_name ON survivors (name)",
+    "CREATE TABLE latlong (id TEXT NOT NULL, latitude FLOAT NOT NULL, longitude FLOAT NOT NULL, survivor_id TEXT, "
+    "PRIMARY KEY (id), FOREIGN KEY(survivor_id) REFERENCES survivors (id))",
+    "CREATE TABLE infection_reports (id TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+    "reported_id TEXT, reporter_id TEXT, PRIMARY KEY (id), FOREIGN KEY(reported_id) REFERENCES survivors (id), "
+    "FOREIGN KEY(reporter_id) REFERENCES survivors (id))",
+    "CREATE TABLE inventory (survivor_id TEXT NOT NULL, item_id TEXT NOT NULL, quantity INTEGER, "
+    "PRIMARY KEY (survivor_id, item_id), FOREIGN KEY(survivor_id) REFERENCES survivors (id), "
+    "FOREIGN KEY(item_id) REFERENCES items (id))",
+)
+
+
+def test_init_db_upgrades_unversioned_database(fresh_engine):
+    """Test that a database created by the original models is upgraded in place, keeping its survivors."""
+    with fresh_engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql("INSERT INTO items VALUES ('water', 'water', 4)")
+        connection.exec_driver_sql("INSERT INTO survivors VALUES ('a', 'Alice', 30, 'f'), ('b', 'Bob', 35, 'm')")
+        connection.exec_driver_sql("INSERT INTO latlong VALUES ('la', 55.675419, 12.5643, 'a'), ('lb', 56.1, 10.2, 'b')")
+        connection.exec_driver_sql("INSERT INTO inventory VALUES ('a', 'water', 5)")
+        # Bob reported Alice twice, which the original models allowed
+        connection.exec_driver_sql("INSERT INTO infection_reports (id, reported_id, reporter_id) "
+                                   "VALUES ('r1', 'a', 'b'), ('r2', 'a', 'b')")
+
+    assert init_db(fresh_engine)
+    with fresh_engine.connect() as connection:
+        assert schema_version(connection) == SCHEMA_VERSION
+        assert connection.exec_driver_sql(
+            "SELECT survivors.id, infection_count, tile_lat, tile_lon FROM survivors JOIN latlong ON survivor_id = survivors.id "
+            "ORDER BY survivors.id").all() == [("a", 1, 1456, 1925), ("b", 0, 1461, 1902)]
+        assert connection.exec_driver_sql("SELECT COUNT(*) FROM survivors WHERE updated_at IS NULL").scalar() == 0
+        indexes = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars().all()
+    assert {"ix_survivors_name_lower", "ix_latlong_tile", "ix_latlong_survivor_id", "ix_infection_reports_reported_id",
+            "uq_infection_reports_reporter_reported"} <= set(indexes)
+    assert count(fresh_engine, "name_trigrams") > 0
+    assert count(fresh_engine, "items") == 1
+    assert count(fresh_engine, "survivors") == 2
+    assert not init_db(fresh_engine)
@@ -0,0 +1,61 @@
+"""Test the geographic helpers."""
+import numpy as np
+from app.geo import EQUIRECTANGULAR, HAVERSINE, bounding_box, distances, nearest
+
+COPENHAGEN = (55.675419, 12.564300)
+AARHUS = (56.162939, 10.203921)
+
+
+def test_distance_methods_agree_over_short_range():
+    """Test that both methods give nearly the same distance across a city."""
+    latitudes = np.array([55.676123])
+    longitudes = np.array([12.568432])
+
+    fast = distances(*COPENHAGEN, latitudes, longitudes, EQUIRECTANGULAR)
+    accurate = distances(*COPENHAGEN, latitudes, longitudes, HAVERSINE)
+    assert abs(fast[0] - accurate[0]) < 1
+
+
+def test_haversine_distance():
+    """Test the great-circle distance between Copenhagen and Aarhus."""
+    result = distances(*COPENHAGEN, np.array([AARHUS[0]]),
+                       np.array([AARHUS[1]]), HAVERSINE)
+    assert 156_000 < result[0] < 158_000
+
+
+def test_unknown_positions_are_infinitely_far():
+    """Test that missing coordinates sort last."""
+    result = distances(*COPENHAGEN, np.array([np.nan, 55.0]),
+                       np.array([np.nan, 12.0]))
+    assert np.isinf(result[0])
+    assert np.isfinite(result[1])
+
+
+def test_nearest_keeps_order_of_ties():
+    """Test that the k nearest come out closest first, with ties in input order."""
+    distances_m = np.array([5.0, 1.0, 3.0, 1.0, 3.0, np.inf])
+
+    assert nearest(distances_m).tolist() == [1, 3, 2, 4, 0, 5]
+    assert nearest(distances_m, 3).tolist() == [1, 3, 2]
+    assert nearest(distances_m, 4).tolist() == [1, 3, 2, 4]
+
+
+def test_bounding_box_encloses_radius():
+    """Test that positions within range fall inside the bounding box for both methods."""
+    min_lat, max_lat, [(min_lon, max_lon)] = bounding_box(*COPENHAGEN, 160_000)
+
+    assert min_lat <= AARHUS[0] <= max_lat
+    assert min_lon <= AARHUS[1] <= max_lon
+
+
+def test_bounding_box_wraps_around_the_antimeridian():
+    """Test that a box crossing the antimeridian covers both sides, and one reaching a pole every longitude."""
+    fiji, across = (-17.0, 179.99), (-17.0, -179.99)
+    _, _, lon_ranges = bounding_box(*fiji, 10_000)
+
+    assert len(lon_ranges) == 2
+    assert any(min_lon <= across[1] <= max_lon for min_lon, max_lon in lon_ranges)
+    assert distances(*fiji, np.array([across[0]]), np.array([across[1]]), HAVERSINE)[0] < 3_000
+    assert distances(*fiji, np.array([across[0]]), np.array([across[1]]), EQUIRECTANGULAR)[0] < 3_000
+
+    assert bounding_box(89.95, 0.0, 10_000)[2] == [(-180, 180)]
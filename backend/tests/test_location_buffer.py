@@ -0,0 +1,33 @@
+"""Test the location buffer."""
+from unittest import mock
+import pytest
+from sqlalchemy.exc import OperationalError
+from app.location_buffer import LocationBuffer
+import app.location_buffer
+
+
+def test_last_write_wins():
+    """Test that a survivor's latest position replaces the one waiting."""
+    buffer = LocationBuffer()
+    buffer.put("alice", 1.0, 2.0)
+    buffer.put("alice", 3.0, 4.0)
+
+    assert buffer.get("alice") == (3.0, 4.0)
+    assert buffer.snapshot() == {"alice": (3.0, 4.0)}
+
+
+def test_failed_flush_keeps_newer_positions():
+    """Test that positions are put back after a failed flush, without replacing newer ones."""
+    buffer = LocationBuffer()
+    buffer.put("alice", 1.0, 2.0)
+    buffer.put("bob", 1.0, 2.0)
+
+    def fail_after_new_ping(db, positions):
+        buffer.put("bob", 5.0, 6.0)
+        raise OperationalError("UPDATE latlong", {}, Exception("disk I/O error"))
+
+    with mock.patch.object(app.location_buffer, "write_positions", fail_after_new_ping):
+        with pytest.raises(OperationalError):
+            buffer.flush(mock.Mock())
+
+    assert buffer.snapshot() == {"alice": (1.0, 2.0), "bob": (5.0, 6.0)}
@@ -1,9 +1,24 @@
 """Test the FastAPI from app."""
+import asyncio
+import json
 import logging
+import sqlite3
+from threading import Thread
+from typing import List
 from uuid import uuid4
 from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy import text
 from app.main import app
-from app.alchemy_models import Item, Survivor, LatLong, Inventory
+import app.async_crud as async_crud
+import app.crud as crud
+from app.location_buffer import location_buffer
+from app.order_book import order_book
+from app.alchemy_models import Item, Survivor, LatLong, Inventory, Offer
+from app.pydantic_models import Survivor as SurvivorResponse, SurvivorTradePayload
+from app.seeding import seed_survivors
+from app.versions import SURVIVORS, data_versions
+from tests.conftest import TestingSessionLocal
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,6 +40,40 @@ def test_get_items(db, client, seed_data):
     assert any(i["label"] == "water" for i in items)
 
 
+def test_get_items_refreshed_after_write(db, client, seed_data):
+    """Test that the cached catalogue picks up newly written items."""
+    assert len(client.get("/items/").json()) == 4
+
+    db.add(Item(id=str(uuid4()), label="batteries", worth=2))
+    db.commit()
+
+    items = client.get("/items/").json()
+    assert len(items) == 5
+    assert any(i["label"] == "batteries" for i in items)
+
+
+def test_get_items_not_modified(db, client, seed_data, executed_statements):
+    """Test that items are answered with 304 while the client's ETag is current."""
+    response = client.get("/items/")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    executed_statements.clear()
+    response = client.get("/items/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    assert len(executed_statements) == 1 and "data_versions" in executed_statements[0]
+
+    db.add(Item(id=str(uuid4()), label="batteries", worth=2))
+    db.commit()
+
+    response = client.get("/items/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 5
+
+
 # Survivors
 def test_get_survivors(db, client, seed_data):
     """Test fetching all survivors."""
@@ -35,6 +84,341 @@ def test_get_survivors(db, client, seed_data):
     assert len(survivors) > 0
 
 
+def test_get_survivors_within_max_distance(db, client, seed_data):
+    """Test that only survivors within range are returned, closest first."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+
+    # Carol is in Aarhus, far outside of Alice's range
+    carol_id = str(uuid4())
+    db.add(Survivor(id=carol_id, name="Carol", age=40, gender="f"))
+    db.add(LatLong(id=str(uuid4()), latitude=56.162939,
+                   longitude=10.203921, survivor_id=carol_id))
+    db.commit()
+
+    response = client.get("/survivors/?max_distance=1000",
+                          headers={"X-User-Id": alice.id})
+    assert response.status_code == 200
+    survivors = response.json()
+    assert [s["name"] for s in survivors] == ["Bob"]
+    assert 0 < survivors[0]["lastLocation"]["distance"] <= 1000
+
+    response = client.get("/survivors/?max_distance=250000",
+                          headers={"X-User-Id": alice.id})
+    assert [s["name"] for s in response.json()] == ["Bob", "Carol"]
+
+
+def test_get_survivors_haversine_distance(db, client, seed_data):
+    """Test asking for great-circle distances instead of the approximation."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    headers = {"X-User-Id": alice.id}
+
+    approximate = client.get("/survivors/", headers=headers).json()
+    response = client.get(
+        "/survivors/?distance_method=haversine", headers=headers)
+    assert response.status_code == 200
+    accurate = response.json()
+
+    assert [s["id"] for s in accurate] == [s["id"] for s in approximate]
+    assert accurate[0]["lastLocation"]["distance"] != approximate[0]["lastLocation"]["distance"]
+    assert abs(accurate[0]["lastLocation"]["distance"] -
+               approximate[0]["lastLocation"]["distance"]) < 5
+
+
+def test_get_survivors_within_distance_across_the_antimeridian(db, client, seed_data):
+    """Test that survivors a few km away on the other side of the antimeridian are within range."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    db.query(LatLong).filter(LatLong.survivor_id == alice.id).update({LatLong.longitude: 179.99})
+    db.query(LatLong).filter(LatLong.survivor_id == bob.id).update({LatLong.longitude: -179.99})
+    db.commit()
+
+    for method in ("haversine", "equirectangular"):
+        response = client.get(f"/survivors/?max_distance=5000&distance_method={method}",
+                              headers={"X-User-Id": alice.id})
+        assert [s["name"] for s in response.json()] == ["Bob"]
+        assert response.json()[0]["lastLocation"]["distance"] < 2_000
+
+
+def test_survivor_listings_match_response_model(db, client, seed_data):
+    """Test that listings serialized without validation are exactly what the Survivor model would produce."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    client.post(f"/survivors/{bob.id}/report/", headers={"X-User-Id": alice.id})
+    db.add(Survivor(id=str(uuid4()), name="Carol", age=40, gender="f"))  # Whose location is unknown
+    db.commit()
+
+    survivors = TypeAdapter(List[SurvivorResponse])
+    listings = [
+        client.get("/survivors/"),
+        client.get("/survivors/?limit=1", headers={"X-User-Id": alice.id}),
+        client.get("/survivors/search?prefix=b"),
+        client.get("/survivors/nearest", headers={"X-User-Id": alice.id}),
+    ]
+    for response in listings:
+        assert response.status_code == 200
+        assert response.json()
+        assert response.content == survivors.dump_json(survivors.validate_json(response.content))
+    assert any(s["lastLocation"] is None for s in listings[0].json())
+
+    response = client.get("/survivors/", headers={"X-User-Id": alice.id, "Accept": "application/x-ndjson"})
+    for line in response.text.splitlines():
+        assert line == SurvivorResponse.model_validate_json(line).model_dump_json()
+
+
+def test_get_survivors_query_count_is_constant(db, client, seed_data, executed_statements):
+    """Test that listing survivors does not issue queries per survivor."""
+    def count_list_queries(headers=None):
+        executed_statements.clear()
+        response = client.get("/survivors/", headers=headers)
+        assert response.status_code == 200
+        return len(executed_statements)
+
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    items = db.query(Item).all()
+    baseline = count_list_queries()
+    baseline_for_user = count_list_queries({"X-User-Id": alice.id})
+
+    for i in range(10):
+        survivor_id = str(uuid4())
+        db.add(Survivor(id=survivor_id, name=f"Extra {i}", age=20, gender="m"))
+        db.add(LatLong(id=str(uuid4()), latitude=55.67,
+                       longitude=12.56, survivor_id=survivor_id))
+        db.add_all([Inventory(survivor_id=survivor_id, item_id=item.id, quantity=1)
+                    for item in items])
+    db.commit()
+
+    assert count_list_queries() == baseline
+    assert count_list_queries({"X-User-Id": alice.id}) == baseline_for_user
+
+
+def add_survivors_around_alice(db, count):
+    """Adds survivors spread out eastwards of Alice."""
+    for i in range(count):
+        survivor_id = str(uuid4())
+        db.add(Survivor(id=survivor_id, name=f"Extra {i}", age=20, gender="m"))
+        db.add(LatLong(id=str(uuid4()), latitude=55.675419,
+                       longitude=12.6 + i * 0.01, survivor_id=survivor_id))
+    db.commit()
+
+
+def collect_pages(client, limit, headers=None):
+    """Follows the pagination cursors of the survivor list until the last page."""
+    pages = []
+    cursor = None
+    while True:
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/survivors/", params=params, headers=headers)
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_get_survivors_not_modified(db, client, seed_data, executed_statements):
+    """Test that survivors are answered with 304 until a survivor changes."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    response = client.get("/survivors/", headers={"X-User-Id": alice.id})
+    etag = response.headers["ETag"]
+
+    executed_statements.clear()
+    response = client.get("/survivors/", headers={"X-User-Id": alice.id, "If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+    assert len(executed_statements) == 1 and "data_versions" in executed_statements[0]
+
+    # Each representation has a tag of its own
+    assert client.get("/survivors/").headers["ETag"] != etag
+    assert client.get("/survivors/", headers={
+        "X-User-Id": alice.id, "Accept": "application/x-ndjson"}).headers["ETag"] != etag
+
+    client.put(f"/survivors/{alice.id}/location/",
+               json={"latitude": 45.1, "longitude": 75.6}, headers={"X-User-Id": alice.id})
+
+    response = client.get("/survivors/", headers={"X-User-Id": alice.id, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_get_survivors_not_modified_follows_other_writers(db, client, seed_data, manual_flush):
+    """Test that ETags change with writes from other processes and with locations still buffered."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    etag = client.get("/survivors/").headers["ETag"]
+
+    # Loaded the way the CLI does it, from a process of its own
+    seed_survivors(db, 3, seed=7)
+    response = client.get("/survivors/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    client.put(f"/survivors/{alice.id}/location/ping",
+               json={"latitude": 45.1, "longitude": 75.6}, headers={"X-User-Id": alice.id})
+    response = client.get("/survivors/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    location_buffer.flush(db)
+    response = client.get("/survivors/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert client.get("/survivors/", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_get_survivors_paginated_by_id(db, client, seed_data):
+    """Test paging through all survivors in ID order."""
+    add_survivors_around_alice(db, 5)
+    everyone = client.get("/survivors/").json()
+
+    pages = collect_pages(client, limit=3)
+    assert all(len(page) <= 3 for page in pages)
+    paged = [s["id"] for page in pages for s in page]
+    assert paged == sorted(s["id"] for s in everyone)
+
+
+def test_get_survivors_paginated_by_distance(db, client, seed_data):
+    """Test paging through survivors closest first when signed in."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    add_survivors_around_alice(db, 5)
+    headers = {"X-User-Id": alice.id}
+    everyone = client.get("/survivors/", headers=headers).json()
+
+    pages = collect_pages(client, limit=2, headers=headers)
+    paged = [s["id"] for page in pages for s in page]
+    assert paged == [s["id"] for s in everyone]
+    assert paged[0] == db.query(Survivor).filter(
+        Survivor.name == "Bob").first().id
+
+
+def test_get_survivors_invalid_cursor(db, client, seed_data):
+    """Test that a malformed cursor is rejected."""
+    response = client.get("/survivors/?limit=2&cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+def test_get_survivors_streamed(db, client, seed_data):
+    """Test streaming survivors as newline-delimited JSON."""
+    add_survivors_around_alice(db, 5)
+    everyone = client.get("/survivors/").json()
+
+    response = client.get(
+        "/survivors/", headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == everyone
+
+
+def backdate_changes(db):
+    """Stamps every row as changed long ago, so the changes a test makes next stand out."""
+    for table in ("survivors", "latlong", "inventory", "infection_reports"):
+        db.execute(text(f"UPDATE {table} SET updated_at = '2000-01-01 00:00:00.000'"))
+    db.commit()
+
+
+def test_get_survivors_since_sync_token(db, client, seed_data):
+    """Test that only the survivors changed since a sync token are listed, along with those removed since."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    backdate_changes(db)
+    since = crud.encode_sync_token("2000-01-01 00:00:00.001")
+
+    client.put(f"/survivors/{alice.id}/location/",
+               json={"latitude": 45.1, "longitude": 75.6}, headers={"X-User-Id": alice.id})
+    carol_id = register(client, "Carol")
+    dave_id = register(client, "Dave")
+    client.delete(f"/survivors/{dave_id}/")
+    db.query(Survivor).filter(Survivor.id == bob.id).update({Survivor.infection_count: 3})
+    db.commit()
+
+    response = client.get("/survivors/", params={"since": since})
+    assert response.status_code == 200
+    changes = response.json()
+    assert {s["id"] for s in changes["survivors"]} == {alice.id, carol_id}
+    assert changes["removed"] == [dave_id, bob.id]
+    assert next(s for s in changes["survivors"] if s["id"] == alice.id)["lastLocation"]["latitude"] == 45.1
+
+    # Sorted by distance from the signed in survivor, who is left out as usual
+    changes = client.get("/survivors/", params={"since": since}, headers={"X-User-Id": alice.id}).json()
+    assert [s["id"] for s in changes["survivors"]] == [carol_id]
+
+    # The removed survivors are found through the stamps, not by walking every survivor
+    plan = db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM survivors WHERE updated_at >= :since "
+        "AND (deleted_at IS NOT NULL OR infection_count >= 3) ORDER BY updated_at"), {"since": "2000"}).all()
+    assert any("ix_survivors_updated_at" in row[-1] for row in plan)
+    assert not any("TEMP B-TREE" in row[-1] for row in plan)
+    assert changes["survivors"][0]["lastLocation"]["distance"] > 0
+
+
+def test_sync_token_covers_later_changes(db, client, seed_data):
+    """Test that the sync token of a listing is the latest change, so changes made after it are synced."""
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    response = client.get("/survivors/")
+    since = response.headers["X-Sync-Token"]
+    latest = db.execute(text("SELECT MAX(updated_at) FROM inventory")).scalar()
+    assert crud.decode_sync_token(since) == latest
+
+    carol_id = register(client, "Carol")
+    client.put(f"/survivors/{bob.id}/location/ping",
+               json={"latitude": 45.1, "longitude": 75.6}, headers={"X-User-Id": bob.id})
+    location_buffer.flush(db)
+
+    changed = {s["id"] for s in client.get("/survivors/", params={"since": since}).json()["survivors"]}
+    assert {carol_id, bob.id} <= changed
+
+    assert client.get("/survivors/", params={"since": "not-a-token"}).status_code == 400
+
+
+def test_deleted_survivor_kept_as_tombstone(db, client, seed_data):
+    """Test that a deleted survivor is marked deleted along with their rows, and hidden everywhere."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+    response = client.delete(f"/survivors/{alice.id}/")
+    assert response.status_code == 200
+
+    db.expire_all()
+    assert db.query(Survivor).get(alice.id).deleted_at is not None
+    assert all(item.deleted_at is not None for item in db.query(Inventory).filter(Inventory.survivor_id == alice.id))
+    assert [s["id"] for s in client.get("/survivors/").json()] == [bob.id]
+    assert client.get(f"/survivors/{alice.id}").status_code == 404
+    assert client.get("/survivors/search?prefix=ali").json() == []
+    response = client.put(f"/survivors/{alice.id}/location/ping",
+                          json={"latitude": 45.1, "longitude": 75.6}, headers={"X-User-Id": alice.id})
+    assert response.status_code == 404
+
+
+async def test_async_get_survivors(db, async_db, seed_data):
+    """Test reading survivors through the async session."""
+    add_survivors_around_alice(db, 5)
+
+    page, next_cursor = await async_crud.search_survivors(async_db, "extra", 4)
+    assert len(page) == 4
+    assert next_cursor is not None
+
+    alice = await async_crud.get_survivor_by_name_or_id(async_db, "alice")
+    assert alice["name"] == "Alice"
+
+
+def test_get_survivors_formats_off_the_event_loop(client, seed_data, monkeypatch):
+    """Test that listings are ranked and formatted in the threadpool, where they cannot hold up the event loop."""
+    on_loop = []
+    format_survivor_response = crud.format_survivor_response
+
+    def format_and_check(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return format_survivor_response(*args, **kwargs)
+
+    monkeypatch.setattr(crud, "format_survivor_response", format_and_check)
+    assert len(client.get("/survivors/").json()) == 2
+    assert len(client.get("/survivors/", headers={"Accept": "application/x-ndjson"}).text.splitlines()) == 2
+    assert on_loop == [False] * 4
+
+
 def test_get_survivor_by_id(db, client, seed_data):
     """Test fetching a survivor by ID."""
     # Get pre-seeded survivor
@@ -59,6 +443,209 @@ def test_get_survivor_by_name(db, client, seed_data):
     assert survivor["name"] == "Alice"
 
 
+def test_get_survivor_by_name_ignores_case(db, client, seed_data):
+    """Test fetching a survivor by name in another case, which seeks the name index."""
+    response = client.get("/survivors/aLiCe")
+    assert response.status_code == 200
+    assert response.json()["name"] == "Alice"
+
+    plan = db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM survivors WHERE lower(name) = :name OR id = :name"),
+        {"name": "alice"}).all()
+    assert any("ix_survivors_name_lower" in row[-1] for row in plan)
+
+
+def test_survivor_relationships_seek_indexes(db):
+    """Test that the locations and reports batch-loaded with survivors are looked up by index, not scanned."""
+    for table, column in (("latlong", "survivor_id"), ("infection_reports", "reported_id")):
+        plan = db.execute(text(
+            f"EXPLAIN QUERY PLAN SELECT * FROM {table} WHERE {column} IN (:a, :b)"), {"a": "a", "b": "b"}).all()
+        assert any(f"ix_{table}_{column}" in row[-1] for row in plan)
+        assert not any(row[-1].startswith("SCAN") for row in plan)
+
+
+def test_search_survivors_by_prefix(db, client, seed_data):
+    """Test searching survivors by name prefix, ignoring case, a page at a time."""
+    for name in ("alfred", "ALBERT", "Alina", "Malik", "Ærø"):
+        survivor_id = str(uuid4())
+        db.add(Survivor(id=survivor_id, name=name, age=20, gender="m"))
+        db.add(LatLong(id=str(uuid4()), latitude=55.6,
+               longitude=12.5, survivor_id=survivor_id))
+    db.commit()
+
+    pages = []
+    cursor = None
+    while True:
+        params = {"prefix": "Al", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/survivors/search", params=params)
+        assert response.status_code == 200
+        pages.append([s["name"] for s in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert pages == [["ALBERT", "alfred"], ["Alice", "Alina"], []]
+    assert [s["name"] for s in client.get("/survivors/search?prefix=Æ").json()] == ["Ærø"]
+
+    plan = db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM survivors WHERE lower(name) >= :low AND lower(name) < :high "
+        "ORDER BY lower(name), id"), {"low": "al", "high": "am"}).all()
+    assert any("ix_survivors_name_lower" in row[-1] for row in plan)
+    assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+
+def test_search_survivors_hides_infected(db, client, seed_data):
+    """Test that infected survivors do not show up in searches."""
+    db.query(Survivor).filter(Survivor.name == "Alice").update(
+        {Survivor.infection_count: 3})
+    db.commit()
+
+    assert client.get("/survivors/search?prefix=a").json() == []
+    assert client.get("/survivors/search?prefix=a&cursor=nonsense").status_code == 400
+
+
+def register(client, name):
+    """Registers a survivor with the given name through the API, returning its ID."""
+    return client.post("/survivors/", json={
+        "name": name, "age": 30, "gender": "f", "inventory": {},
+        "lastLocation": {"latitude": 55.6, "longitude": 12.5},
+    }).json()["id"]
+
+
+def test_fuzzy_search_survivors(db, client, seed_data):
+    """Test finding survivors by a misspelled name, most similar first."""
+    for name in ("Katrine", "Catherine", "Kathryn", "Bob Katz"):
+        register(client, name)
+
+    response = client.get("/survivors/fuzzy?name=katrin")
+    assert response.status_code == 200
+    matches = response.json()
+    assert matches[0]["name"] == "Katrine"
+    assert [m["similarity"] for m in matches] == sorted(
+        (m["similarity"] for m in matches), reverse=True)
+    assert all(m["similarity"] >= 0.3 for m in matches)
+    assert "Bob Katz" not in [m["name"] for m in matches]
+
+    assert [m["name"] for m in client.get(
+        "/survivors/fuzzy?name=katrin&limit=1").json()] == ["Katrine"]
+
+
+def test_fuzzy_search_leaves_out_deleted_and_infected(db, client, seed_data):
+    """Test that deleted and infected survivors are not found by fuzzy search."""
+    katrine_id = register(client, "Katrine")
+    kathryn_id = register(client, "Kathryn")
+
+    client.delete(f"/survivors/{katrine_id}/")
+    db.query(Survivor).filter(Survivor.id == kathryn_id).update(
+        {Survivor.infection_count: 3})
+    db.commit()
+
+    assert client.get("/survivors/fuzzy?name=katrin").json() == []
+
+
+def test_get_nearest_survivors(db, client, seed_data):
+    """Test getting the survivors nearest to the logged in survivor, closest first."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    add_survivors_around_alice(db, 10)
+
+    response = client.get("/survivors/nearest?k=3",
+                          headers={"X-User-Id": alice.id})
+    assert response.status_code == 200
+    nearest = response.json()
+    assert [s["name"] for s in nearest] == ["Bob", "Extra 0", "Extra 1"]
+
+    # Great-circle distances, like the survivor list measures them with haversine
+    listed = client.get("/survivors/?limit=3&distance_method=haversine",
+                        headers={"X-User-Id": alice.id}).json()
+    for found, expected in zip(nearest, listed):
+        assert abs(found["lastLocation"]["distance"] - expected["lastLocation"]["distance"]) < 1
+
+
+def test_nearest_survivors_follow_changes(db, client, seed_data):
+    """Test that the nearest survivors reflect moves, registrations, infections and deletions."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    add_survivors_around_alice(db, 3)
+
+    def nearest():
+        return [s["name"] for s in client.get(
+            "/survivors/nearest?k=2", headers={"X-User-Id": alice.id}).json()]
+
+    assert nearest() == ["Bob", "Extra 0"]
+
+    # Bob wanders off
+    client.put(f"/survivors/{bob.id}/location/ping",
+               json={"latitude": 56.162939, "longitude": 10.203921}, headers={"X-User-Id": bob.id})
+    assert nearest() == ["Extra 0", "Extra 1"]
+
+    # Carol registers right next to Alice
+    carol = client.post("/survivors/", json={
+        "name": "Carol", "age": 40, "gender": "f", "inventory": {},
+        "lastLocation": {"latitude": 55.6755, "longitude": 12.5644},
+    }).json()
+    assert nearest() == ["Carol", "Extra 0"]
+
+    # Carol turns out to be infected
+    for reporter in db.query(Survivor).filter(Survivor.name.like("Extra %")):
+        client.post(f"/survivors/{carol['id']}/report/", headers={"X-User-Id": reporter.id})
+    assert nearest() == ["Extra 0", "Extra 1"]
+
+    extra = db.query(Survivor).filter(Survivor.name == "Extra 0").first()
+    client.delete(f"/survivors/{extra.id}/")
+    assert nearest() == ["Extra 1", "Extra 2"]
+
+
+def test_nearest_survivors_see_changes_made_elsewhere(db, client, seed_data):
+    """Test that survivors registered or moved by another process show up among the nearest survivors."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+    def nearest():
+        return [s["name"] for s in client.get(
+            "/survivors/nearest?k=2", headers={"X-User-Id": alice.id}).json()]
+
+    assert nearest() == ["Bob"]
+
+    # Written straight to the database, the way the CLI or another worker would
+    add_survivors_around_alice(db, 2)
+    bob.lastLocation.latitude, bob.lastLocation.longitude = 56.162939, 10.203921
+    data_versions.bump(db, SURVIVORS)
+    db.commit()
+    assert nearest() == ["Extra 0", "Extra 1"]
+
+
+def test_nearest_survivors_catch_up_only_after_writes(db, seed_data, executed_statements):
+    """Test that the spatial index reads nothing but the data version while no writes are committed."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    token, positions, _ = crud.read_position_changes(db, None)
+    assert len(positions[0]) == 2
+
+    executed_statements.clear()
+    assert crud.read_position_changes(db, token) == (token, crud.NO_POSITIONS, [])
+    assert len(executed_statements) == 1 and "data_versions" in executed_statements[0]
+
+    # Rows stamped in the same millisecond as the latest change read are read again along with the new ones
+    crud.update_location(db, alice.id, 56.0, 10.0)
+    token, (survivor_ids, latitudes, _), _ = crud.read_position_changes(db, token)
+    assert dict(zip(survivor_ids.tolist(), latitudes.tolist()))[alice.id] == 56.0
+    assert len(crud.read_position_changes(db, token)[1][0]) == 0
+
+
+def test_nearest_survivors_need_a_location(db, client, seed_data):
+    """Test that only logged in survivors with a known location can look for the nearest survivors."""
+    assert client.get("/survivors/nearest").status_code == 401
+    assert client.get("/survivors/nearest",
+                      headers={"X-User-Id": str(uuid4())}).status_code == 404
+
+    loner_id = str(uuid4())
+    db.add(Survivor(id=loner_id, name="Loner", age=50, gender="m"))
+    db.commit()
+    assert client.get("/survivors/nearest",
+                      headers={"X-User-Id": loner_id}).status_code == 400
+
+
 def test_create_survivor(db, client, seed_data):
     """Test creating a new survivor."""
     # Get pre-seeded items
@@ -112,6 +699,60 @@ def test_create_survivor(db, client, seed_data):
     assert db_survivor.name == "Bob"
 
 
+def test_create_survivor_with_unknown_item(db, client, seed_data):
+    """Test that a survivor carrying an unknown item is not created at all."""
+    survivors_before = db.query(Survivor).count()
+
+    response = client.post("/survivors/", json={
+        "name": "Carol", "age": 40, "gender": "f",
+        "inventory": {str(uuid4()): 1},
+        "lastLocation": {"latitude": 55.676123, "longitude": 12.568432},
+    })
+    assert response.status_code == 404
+    assert db.query(Survivor).count() == survivors_before
+
+
+def test_create_survivors_in_bulk(db, client, seed_data, executed_statements):
+    """Test registering many survivors with one insert per table."""
+    water = db.query(Item).filter(Item.label == "water").first()
+    camp = [{
+        "name": f"Camper {i}", "age": 20 + i, "gender": "f",
+        "inventory": {str(water.id): i},
+        "lastLocation": {"latitude": 55.6 + i / 100, "longitude": 12.5},
+    } for i in range(50)]
+
+    executed_statements.clear()
+    response = client.post("/survivors/bulk/", json={"survivors": camp})
+    assert response.status_code == 201
+    ids = response.json()["ids"]
+    assert len(ids) == 50
+    for table in ("survivors", "latlong", "inventory", "name_trigrams", "trigram_counts"):
+        assert sum(statement.startswith(f"INSERT INTO {table} ")
+                   for statement in executed_statements) == 1
+
+    camper = client.get(f"/survivors/{ids[7]}").json()
+    assert camper["name"] == "Camper 7"
+    assert camper["inventory"] == {str(water.id): 7}
+    assert camper["lastLocation"]["latitude"] == 55.67
+    # Nothing to carry, nothing stored
+    assert client.get(f"/survivors/{ids[0]}").json()["inventory"] == {}
+
+
+def test_create_survivors_in_bulk_is_atomic(db, client, seed_data):
+    """Test that one unknown item keeps the whole camp from being registered."""
+    water = db.query(Item).filter(Item.label == "water").first()
+    survivors_before = db.query(Survivor).count()
+    camp = [{
+        "name": name, "age": 30, "gender": "m",
+        "inventory": {str(item_id): 1},
+        "lastLocation": {"latitude": 55.6, "longitude": 12.5},
+    } for name, item_id in (("Dave", water.id), ("Erin", uuid4()))]
+
+    response = client.post("/survivors/bulk/", json={"survivors": camp})
+    assert response.status_code == 404
+    assert db.query(Survivor).count() == survivors_before
+
+
 # Infection reports
 def test_report_infection(db, client, seed_data):
     """Test reporting another survivor as infected."""
@@ -147,6 +788,48 @@ def test_report_infection(db, client, seed_data):
     assert found_alice_report, "Alice's infection report not found"
 
 
+def test_duplicate_infection_report_rejected(db, client, seed_data):
+    """Test that a survivor cannot report the same survivor twice."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+    response = client.post(
+        f"/survivors/{bob.id}/report/", headers={"X-User-Id": alice.id})
+    assert response.status_code == 201
+
+    response = client.post(
+        f"/survivors/{bob.id}/report/", headers={"X-User-Id": alice.id})
+    assert response.status_code == 400
+    assert "already reported" in response.json().get("detail", "")
+
+    db.refresh(bob)
+    assert bob.infection_count == 1
+
+
+def test_infected_survivor_hidden(db, client, seed_data):
+    """Test that a survivor reported three times is treated as infected."""
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+    reporter_ids = [str(uuid4()) for _ in range(3)]
+    for i, reporter_id in enumerate(reporter_ids):
+        db.add(Survivor(id=reporter_id, name=f"Reporter {i}", age=20, gender="m"))
+        db.add(LatLong(id=str(uuid4()), latitude=55.67,
+                       longitude=12.56, survivor_id=reporter_id))
+    db.commit()
+
+    for reporter_id in reporter_ids:
+        response = client.post(
+            f"/survivors/{bob.id}/report/", headers={"X-User-Id": reporter_id})
+        assert response.status_code == 201
+
+    survivors = client.get("/survivors/").json()
+    assert not any(s["name"] == "Bob" for s in survivors)
+
+    response = client.get(f"/survivors/{bob.id}")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Survivor is infected!"
+
+
 # Locations
 def test_update_survivor_location(db, client, seed_data):
     """Test updating a survivor's location."""
@@ -208,6 +891,97 @@ def test_cannot_update_other_survivor_location(db, client, seed_data):
         "detail", "").lower()
 
 
+def test_location_ping_is_buffered(db, client, seed_data, manual_flush):
+    """Test that pinged locations are visible straight away and stored on the next flush."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+
+    response = client.put(
+        f"/survivors/{alice.id}/location/ping",
+        json={"latitude": 45.123456, "longitude": -75.654321},
+        headers={"X-User-Id": alice.id}
+    )
+    assert response.status_code == 202
+    assert response.json() == {"survivor_id": alice.id,
+                               "latitude": 45.123456, "longitude": -75.654321}
+
+    # Readable before it is stored
+    assert client.get(f"/survivors/{alice.id}").json()["lastLocation"]["latitude"] == 45.123456
+    assert db.query(LatLong.latitude).filter(LatLong.survivor_id == alice.id).scalar() == 55.675419
+
+    assert location_buffer.flush(db) == 1
+    assert db.query(LatLong.latitude).filter(LatLong.survivor_id == alice.id).scalar() == 45.123456
+
+
+def test_location_pings_coalesce(db, client, seed_data, manual_flush, executed_statements):
+    """Test that only the last of many pings between flushes is written, in one statement."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+    for survivor in (alice, bob):
+        for step in range(5):
+            client.put(
+                f"/survivors/{survivor.id}/location/ping",
+                json={"latitude": 50 + step, "longitude": 10},
+                headers={"X-User-Id": survivor.id}
+            )
+
+    executed_statements.clear()
+    assert location_buffer.flush(db) == 2
+    assert sum(statement.startswith("UPDATE latlong")
+               for statement in executed_statements) == 1
+    assert db.query(LatLong.latitude).filter(LatLong.survivor_id == bob.id).scalar() == 54
+
+
+def test_distance_ranking_sees_buffered_locations(db, client, seed_data, manual_flush):
+    """Test that survivors are found where they last pinged from, not where they were stored."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+    def nearby():
+        return [s["name"] for s in client.get(
+            "/survivors/?max_distance=1000", headers={"X-User-Id": alice.id}).json()]
+
+    assert nearby() == ["Bob"]
+
+    # Bob wanders off
+    client.put(f"/survivors/{bob.id}/location/ping",
+               json={"latitude": 56.162939, "longitude": 10.203921}, headers={"X-User-Id": bob.id})
+    assert nearby() == []
+
+    # Alice follows him
+    client.put(f"/survivors/{alice.id}/location/ping",
+               json={"latitude": 56.163, "longitude": 10.204}, headers={"X-User-Id": alice.id})
+    assert nearby() == ["Bob"]
+
+
+def test_distance_ranking_with_many_buffered_locations(db, client, seed_data, manual_flush):
+    """Test that more buffered locations than SQLite takes parameters do not break the distance ranking."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    connection = db.connection().connection.dbapi_connection
+    limit = connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 100)
+    try:
+        for _ in range(200):
+            location_buffer.put(str(uuid4()), 0.0, 0.0)
+
+        response = client.get("/survivors/?max_distance=1000", headers={"X-User-Id": alice.id})
+        assert response.status_code == 200
+        assert [s["name"] for s in response.json()] == ["Bob"]
+    finally:
+        connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, limit)
+
+
+def test_location_ping_for_unknown_survivor(db, client, seed_data):
+    """Test that pings for survivors not in the system are rejected."""
+    survivor_id = str(uuid4())
+    response = client.put(
+        f"/survivors/{survivor_id}/location/ping",
+        json={"latitude": 45.123456, "longitude": -75.654321},
+        headers={"X-User-Id": survivor_id}
+    )
+    assert response.status_code == 404
+    assert location_buffer.get(survivor_id) is None
+
+
 # Trading
 def test_trade_between_survivors(db, client, seed_data):
     """Test trading between two survivors using pre-seeded data."""
@@ -285,14 +1059,58 @@ def test_trade_between_survivors(db, client, seed_data):
     assert str(food.id) in bob_inventory
     assert bob_inventory[str(food.id)] == bob_before["inventory"].get(
         str(food.id), 0)  # No change
-    assert str(medication.id) in bob_inventory
-    assert bob_inventory[str(medication.id)] == bob_before["inventory"].get(
-        str(medication.id), 0) - 4  # Gave 4 to Alice
+    assert str(medication.id) not in bob_inventory  # Gave all 4 to Alice
     assert str(ammunition.id) in bob_inventory
     assert bob_inventory[str(ammunition.id)] == bob_before["inventory"].get(
         str(ammunition.id), 0)  # No change
 
 
+def test_trade_does_not_query_catalogue(db, client, seed_data, executed_statements):
+    """Test that trade validation is served from the cached catalogue."""
+    water = db.query(Item).filter(Item.label == "water").first()
+    medication = db.query(Item).filter(Item.label == "medication").first()
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    client.get("/items/")
+
+    executed_statements.clear()
+    response = client.post(
+        "/survivors/trade/?dry_run=true",
+        json={
+            "survivor_a_items": {"survivor_id": alice.id, "items": {str(water.id): 1}},
+            "survivor_b_items": {"survivor_id": bob.id, "items": {str(medication.id): 2}}
+        },
+        headers={"X-User-Id": alice.id}
+    )
+    assert response.status_code == 201
+    assert not any("FROM items" in statement for statement in executed_statements)
+
+
+def test_trade_writes_only_changed_items(db, client, seed_data, executed_statements):
+    """Test that a trade only writes the inventory rows it changes."""
+    water = db.query(Item).filter(Item.label == "water").first()
+    medication = db.query(Item).filter(Item.label == "medication").first()
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+    executed_statements.clear()
+    response = client.post(
+        "/survivors/trade/",
+        json={
+            "survivor_a_items": {"survivor_id": alice.id, "items": {str(water.id): 2}},
+            "survivor_b_items": {"survivor_id": bob.id, "items": {str(medication.id): 4}}
+        },
+        headers={"X-User-Id": alice.id}
+    )
+    assert response.status_code == 201
+
+    writes = [statement for statement in executed_statements
+              if statement.startswith(("INSERT INTO inventory", "UPDATE inventory", "DELETE FROM inventory"))]
+    assert writes
+    assert not any(statement.startswith("INSERT") for statement in writes)
+    assert all("inventory.item_id = ?" in statement for statement in writes)
+
+
 def test_unfair_trade_rejected(db, client, seed_data):
     """Test that unfair trades are rejected using pre-seeded data."""
     # Get pre-seeded items
@@ -362,3 +1180,296 @@ def test_unfair_trade_rejected(db, client, seed_data):
     assert str(food.id) in bob_inventory
     assert bob_inventory[str(food.id)] == bob_before["inventory"].get(
         str(food.id), 0)
+
+
+def chained_trades(db):
+    """Returns three trades between Alice and Bob: the second only works after the first, the third is unbalanced."""
+    water = db.query(Item).filter(Item.label == "water").first()
+    food = db.query(Item).filter(Item.label == "food").first()
+    medication = db.query(Item).filter(Item.label == "medication").first()
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+
+    def trade(alice_items, bob_items):
+        return {
+            "survivor_a_items": {"survivor_id": alice.id, "items": alice_items},
+            "survivor_b_items": {"survivor_id": bob.id, "items": bob_items},
+        }
+
+    return alice, bob, [
+        # Alice: 1 water for 2 medication, ending up with 4 medication
+        trade({str(water.id): 1}, {str(medication.id): 2}),
+        # Alice: 4 medication for 2 water, which she only has after the first trade
+        trade({str(medication.id): 4}, {str(water.id): 2}),
+        # Unbalanced
+        trade({str(food.id): 1}, {str(water.id): 1}),
+    ], (water, medication)
+
+
+def test_batch_trades_see_earlier_trades(db, client, seed_data):
+    """Test that trades in a batch build on each other and are committed together."""
+    alice, bob, trades, (water, medication) = chained_trades(db)
+
+    response = client.post("/survivors/trades/batch",
+                           json={"trades": trades[:2]}, headers={"X-User-Id": alice.id})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["committed"] is True
+    assert all(trade["success"] for trade in result["results"])
+
+    alice_after = client.get(f"/survivors/{alice.id}").json()["inventory"]
+    bob_after = client.get(f"/survivors/{bob.id}").json()["inventory"]
+    assert alice_after[str(water.id)] == 6
+    assert str(medication.id) not in alice_after
+    assert bob_after[str(water.id)] == 2
+    assert bob_after[str(medication.id)] == 6
+
+
+def test_batch_trades_all_or_nothing(db, client, seed_data):
+    """Test that a failing trade keeps the whole batch from being committed."""
+    alice, bob, trades, _ = chained_trades(db)
+    alice_before = client.get(f"/survivors/{alice.id}").json()["inventory"]
+
+    response = client.post("/survivors/trades/batch",
+                           json={"trades": trades}, headers={"X-User-Id": alice.id})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["committed"] is False
+    assert [trade["success"] for trade in result["results"]] == [False, False, False]
+    assert "not balanced" in result["results"][2]["detail"]
+
+    assert client.get(f"/survivors/{alice.id}").json()["inventory"] == alice_before
+
+
+def test_batch_trades_best_effort(db, client, seed_data):
+    """Test that best-effort batches commit the valid trades and report the others."""
+    alice, _, trades, (water, medication) = chained_trades(db)
+
+    response = client.post("/survivors/trades/batch",
+                           json={"trades": trades, "mode": "best_effort"}, headers={"X-User-Id": alice.id})
+    result = response.json()
+    assert result["committed"] is True
+    assert [trade["success"] for trade in result["results"]] == [True, True, False]
+
+    alice_after = client.get(f"/survivors/{alice.id}").json()["inventory"]
+    assert alice_after[str(water.id)] == 6
+    assert str(medication.id) not in alice_after
+
+
+def test_batch_trades_dry_run(db, client, seed_data):
+    """Test that a dry run validates the batch without trading anything."""
+    alice, _, trades, _ = chained_trades(db)
+    alice_before = client.get(f"/survivors/{alice.id}").json()["inventory"]
+
+    response = client.post("/survivors/trades/batch?dry_run=true",
+                           json={"trades": trades[:2]}, headers={"X-User-Id": alice.id})
+    result = response.json()
+    assert result["committed"] is False
+    assert [trade["detail"] for trade in result["results"]] == ["Trade is valid"] * 2
+    assert client.get(f"/survivors/{alice.id}").json()["inventory"] == alice_before
+
+
+def test_batch_trades_only_from_own_inventory(db, client, seed_data):
+    """Test that a batch cannot trade from the inventory of anyone but the caller."""
+    alice, bob, trades, _ = chained_trades(db)
+    alice_before = client.get(f"/survivors/{alice.id}").json()["inventory"]
+    bob_before = client.get(f"/survivors/{bob.id}").json()["inventory"]
+
+    for user_id in (str(uuid4()), bob.id):
+        response = client.post("/survivors/trades/batch",
+                               json={"trades": trades[:1], "mode": "best_effort"}, headers={"X-User-Id": user_id})
+        result = response.json()
+        assert result["committed"] is False
+        assert result["results"][0]["detail"] == "You can only trade items from your own inventory."
+
+    assert client.get(f"/survivors/{alice.id}").json()["inventory"] == alice_before
+    assert client.get(f"/survivors/{bob.id}").json()["inventory"] == bob_before
+
+
+def test_batch_trades_do_not_overwrite_concurrent_trades(db, client, seed_data, monkeypatch):
+    """Test that a trade made elsewhere after a batch read the inventories waits for the batch, not overwritten by it."""
+    items = items_by_label(db)
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    totals_before = dict(db.execute(text("SELECT item_id, SUM(quantity) FROM inventory GROUP BY item_id")).all())
+
+    # Alice has 5 water, enough for either trade but not for both
+    outcomes = []
+
+    def trade_elsewhere():
+        with TestingSessionLocal() as other:
+            try:
+                crud.trade_items(other,
+                                 SurvivorTradePayload(survivor_id=alice.id, items={items["water"]: 3}),
+                                 SurvivorTradePayload(survivor_id=bob.id,
+                                                      items={items["food"]: 2, items["ammunition"]: 6}))
+                outcomes.append("traded")
+            except ValueError:
+                outcomes.append("refused")
+
+    validate_trade = crud.validate_trade
+    elsewhere = Thread(target=trade_elsewhere)
+
+    def trade_elsewhere_once_validated(*args, **kwargs):
+        result = validate_trade(*args, **kwargs)
+        if elsewhere.ident is None:  # The trade made elsewhere is validated too
+            elsewhere.start()
+            elsewhere.join(1)  # Finishes now unless the batch holds the write lock
+        return result
+
+    monkeypatch.setattr(crud, "validate_trade", trade_elsewhere_once_validated)
+    response = client.post("/survivors/trades/batch", json={"trades": [{
+        "survivor_a_items": {"survivor_id": alice.id, "items": {items["water"]: 3}},
+        "survivor_b_items": {"survivor_id": bob.id, "items": {items["food"]: 4}},
+    }]}, headers={"X-User-Id": alice.id})
+    elsewhere.join()
+
+    assert response.json()["committed"] is True
+    assert outcomes == ["refused"]
+    db.expire_all()
+    assert inventory_of(client, alice.id)[items["water"]] == 2
+    assert dict(db.execute(text("SELECT item_id, SUM(quantity) FROM inventory GROUP BY item_id")).all()) \
+        == totals_before
+
+
+# Offers
+def items_by_label(db):
+    """Returns the IDs of the seeded items by label."""
+    return {item.label: item.id for item in db.query(Item).all()}
+
+
+def inventory_of(client, survivor_id):
+    """Returns a survivor's inventory through the API."""
+    return client.get(f"/survivors/{survivor_id}").json()["inventory"]
+
+
+def test_offer_matched_against_open_offer(db, client, seed_data):
+    """Test that an offer balancing an open one is traded against it straight away."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    items = items_by_label(db)
+
+    # Alice gives 3 food, worth 9, for as much ammunition
+    response = client.post("/offers/", json={
+        "give_item_id": items["food"], "give_quantity": 3, "want_item_id": items["ammunition"]},
+        headers={"X-User-Id": alice.id})
+    assert response.status_code == 201
+    placed = response.json()
+    assert placed["matched_offer"] is None
+    assert placed["offer"]["want_quantity"] == 9
+    assert [offer["id"] for offer in client.get("/offers/").json()] == [placed["offer"]["id"]]
+
+    response = client.post("/offers/", json={
+        "give_item_id": items["ammunition"], "give_quantity": 9, "want_item_id": items["food"]},
+        headers={"X-User-Id": bob.id})
+    assert response.status_code == 201
+    assert response.json() == {"matched_offer": placed["offer"], "offer": None}
+
+    assert inventory_of(client, alice.id)[items["food"]] == 7
+    assert inventory_of(client, alice.id)[items["ammunition"]] == 12
+    assert inventory_of(client, bob.id)[items["food"]] == 10
+    assert inventory_of(client, bob.id)[items["ammunition"]] == 1
+    assert client.get("/offers/").json() == []
+
+
+def test_offers_that_cannot_be_honoured_are_closed(db, client, seed_data):
+    """Test that an open offer whose survivor no longer has the items is closed instead of traded."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    items = items_by_label(db)
+
+    client.post("/offers/", json={
+        "give_item_id": items["food"], "give_quantity": 3, "want_item_id": items["ammunition"]},
+        headers={"X-User-Id": alice.id})
+    db.query(Inventory).filter(Inventory.survivor_id == alice.id, Inventory.item_id == items["food"]).update(
+        {Inventory.quantity: 1})
+    db.commit()
+
+    placed = client.post("/offers/", json={
+        "give_item_id": items["ammunition"], "give_quantity": 9, "want_item_id": items["food"]},
+        headers={"X-User-Id": bob.id}).json()
+    assert placed["matched_offer"] is None
+    assert [offer["id"] for offer in client.get("/offers/").json()] == [placed["offer"]["id"]]
+    assert inventory_of(client, bob.id)[items["ammunition"]] == 10
+
+
+def test_offers_placed_elsewhere_are_matched(db, client, seed_data):
+    """Test that offers placed by another process are matched, and offers filled by one are not filled again."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    items = items_by_label(db)
+
+    def place(survivor, give, quantity, want):
+        return client.post("/offers/", json={"give_item_id": items[give], "give_quantity": quantity,
+                                             "want_item_id": items[want]}, headers={"X-User-Id": survivor.id}).json()
+
+    # Reads the order book, which then only hears of Alice's offer from the database
+    filled_elsewhere = place(alice, "water", 1, "ammunition")["offer"]
+    db.add(Offer(id=str(uuid4()), survivor_id=alice.id, give_item_id=items["food"], give_quantity=3,
+                 want_item_id=items["ammunition"], want_quantity=9))
+    db.query(Offer).filter(Offer.id == filled_elsewhere["id"]).delete()
+    db.commit()
+
+    assert place(bob, "ammunition", 4, "water")["matched_offer"] is None
+    assert inventory_of(client, alice.id)[items["water"]] == 5
+
+    matched = place(bob, "ammunition", 9, "food")["matched_offer"]
+    assert matched is not None and matched["survivor_id"] == alice.id
+    assert inventory_of(client, alice.id)[items["food"]] == 7
+    assert inventory_of(client, bob.id)[items["food"]] == 10
+
+
+def test_offers_matched_oldest_first_after_reload(db, client, seed_data):
+    """Test that offers placed within the same second are still matched oldest first once read from the database."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    items = items_by_label(db)
+
+    placed = [client.post("/offers/", json={
+        "give_item_id": items["water"], "give_quantity": 1, "want_item_id": items["ammunition"]},
+        headers={"X-User-Id": alice.id}).json()["offer"] for _ in range(3)]
+    assert [offer["id"] for offer in client.get("/offers/").json()] == [offer["id"] for offer in placed]
+
+    order_book.invalidate()  # As on a restart
+    matched = client.post("/offers/", json={
+        "give_item_id": items["ammunition"], "give_quantity": 4, "want_item_id": items["water"]},
+        headers={"X-User-Id": bob.id}).json()["matched_offer"]
+    assert matched["id"] == placed[0]["id"]
+
+
+def test_cancel_offer(db, client, seed_data):
+    """Test that survivors can withdraw their own open offers, and only theirs."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    items = items_by_label(db)
+    offer = client.post("/offers/", json={
+        "give_item_id": items["ammunition"], "give_quantity": 4, "want_item_id": items["medication"]},
+        headers={"X-User-Id": bob.id}).json()["offer"]
+
+    assert client.delete(f"/offers/{offer['id']}/", headers={"X-User-Id": alice.id}).status_code == 401
+    assert client.delete(f"/offers/{offer['id']}/", headers={"X-User-Id": bob.id}).status_code == 200
+    assert client.delete(f"/offers/{offer['id']}/", headers={"X-User-Id": bob.id}).status_code == 404
+
+    # A cancelled offer is not matched any more
+    placed = client.post("/offers/", json={
+        "give_item_id": items["medication"], "give_quantity": 2, "want_item_id": items["ammunition"]},
+        headers={"X-User-Id": alice.id}).json()
+    assert placed["matched_offer"] is None
+
+
+def test_invalid_offers_rejected(db, client, seed_data):
+    """Test that offers which could never be traded are rejected."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    items = items_by_label(db)
+
+    def place(give, quantity, want):
+        return client.post("/offers/", json={"give_item_id": give, "give_quantity": quantity, "want_item_id": want},
+                           headers={"X-User-Id": alice.id})
+
+    assert place(items["water"], 2, items["water"]).status_code == 400
+    assert place(items["water"], 2, items["food"]).status_code == 400  # Worth 8, food comes in threes
+    assert place(items["water"], 6, items["food"]).status_code == 422
+    assert place(str(uuid4()), 1, items["food"]).status_code == 404
+    assert client.post("/offers/", json={
+        "give_item_id": items["water"], "give_quantity": 3, "want_item_id": items["food"]}).status_code == 401
+    assert client.get("/offers/").json() == []
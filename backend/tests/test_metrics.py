@@ -0,0 +1,91 @@
+"""Test the request metrics."""
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.alchemy_models import Survivor
+from app.metrics import LATENCY_BUCKETS, MetricsRegistry, metrics
+
+
+@pytest.fixture
+def recorded(client):
+    """Starts the test with no metrics recorded."""
+    metrics.clear()
+    yield metrics
+    metrics.clear()
+
+
+def requests_total(method, route, status):
+    """Returns how many requests to a route were answered with a status."""
+    labels = (("method", method), ("route", route), ("status", str(status)))
+    return metrics.values()[("http_requests_total", labels)]
+
+
+def test_requests_are_counted_by_route_template(db, client, seed_data, recorded):
+    """Test that requests are labelled with the template of their route, not their path."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    bob = db.query(Survivor).filter(Survivor.name == "Bob").first()
+    client.get(f"/survivors/{alice.id}")
+    client.get(f"/survivors/{bob.id}")
+    client.get(f"/survivors/{alice.id}/nowhere")
+
+    assert requests_total("GET", "/survivors/{name_or_id}", 200) == 2
+    assert requests_total("GET", "unmatched", 404) == 1
+    errors = metrics.values()[("http_request_errors_total",
+                               (("method", "GET"), ("route", "unmatched"), ("status", "404")))]
+    assert errors == 1
+    assert metrics.values()[("http_requests_in_progress",
+                             (("method", "GET"), ("route", "/survivors/{name_or_id}")))] == 0
+
+
+def test_database_time_is_recorded(db, client, seed_data, recorded):
+    """Test that the time spent in the database is recorded, for async and sync routes alike."""
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    client.get("/survivors/")
+    client.get("/survivors/nearest", headers={"X-User-Id": alice.id})
+    client.get("/")
+
+    values = metrics.values()
+    for route in ("/survivors/", "/survivors/nearest"):
+        assert values[("http_request_db_seconds", (("method", "GET"), ("route", route)), "sum")] > 0
+    assert values[("http_request_db_seconds", (("method", "GET"), ("route", "/")), "sum")] == 0
+
+
+def test_metrics_endpoint(db, client, seed_data, recorded):
+    """Test that the metrics are exposed in the Prometheus text format."""
+    client.get("/items/")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert 'http_requests_total{method="GET",route="/items/",status="200"} 1' in response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/"} 1' in response.text
+
+
+def test_histogram_buckets_are_cumulative():
+    """Test that every bucket counts the observations up to its bound."""
+    registry = MetricsRegistry()
+    labels = (("route", "/"),)
+    for value in (0.0005, 0.003, 0.003, 20):
+        registry.observe("http_request_duration_seconds", labels, value)
+
+    text = registry.render()
+    assert 'http_request_duration_seconds_bucket{route="/",le="0.001"} 1' in text
+    assert 'http_request_duration_seconds_bucket{route="/",le="0.005"} 3' in text
+    assert f'http_request_duration_seconds_bucket{{route="/",le="{LATENCY_BUCKETS[-1]:g}"}} 3' in text
+    assert 'http_request_duration_seconds_bucket{route="/",le="+Inf"} 4' in text
+    assert 'http_request_duration_seconds_count{route="/"} 4' in text
+
+
+def test_threads_record_without_losing_counts():
+    """Test that threads recording at once each keep their own counts, which add up."""
+    registry = MetricsRegistry()
+    labels = (("route", "/"),)
+
+    def record(_):
+        for _ in range(10_000):
+            registry.increment("http_requests_total", labels)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(record, range(8)))
+
+    assert registry.values()[("http_requests_total", labels)] == 80_000
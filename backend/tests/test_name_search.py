@@ -0,0 +1,52 @@
+"""Test the fuzzy name search."""
+import random
+from uuid import uuid4
+from app.alchemy_models import NameTrigram, Survivor, TrigramCount
+from app.name_search import find_candidates, index_names, reindex_names, similarity, trigrams, unindex_names
+
+
+def test_trigrams():
+    """Test that names are split into padded, lowercased trigrams per word."""
+    assert trigrams("Al") == {"  a", " al", "al "}
+    assert trigrams("Al Bo") == trigrams("al") | trigrams("BO")
+    assert trigrams("--") == set()
+
+
+def test_candidates_include_every_similar_name(db):
+    """Test that the index finds every name as similar as asked for, without reading them all."""
+    rng = random.Random(7)
+    names = ["".join(rng.choice("abcdefgh") for _ in range(rng.randint(4, 9)))
+             for _ in range(300)]
+    survivors = [(str(uuid4()), name) for name in names]
+    db.add_all(Survivor(id=survivor_id, name=name, age=30, gender="f")
+               for survivor_id, name in survivors)
+    index_names(db, survivors)
+    db.commit()
+
+    for query in names[:20]:
+        wanted, candidates = find_candidates(db, query, 0.4)
+        expected = {survivor_id for survivor_id, name in survivors
+                    if similarity(wanted, trigrams(name)) >= 0.4}
+        assert expected <= {survivor_id for survivor_id, _ in candidates}
+
+
+def test_index_stays_in_sync(db):
+    """Test that removing names brings the trigram counts back, and that rebuilding gives the same index."""
+    survivors = [(str(uuid4()), name) for name in ("Anna", "Hannah", "Jonas")]
+    db.add_all(Survivor(id=survivor_id, name=name, age=30, gender="f")
+               for survivor_id, name in survivors)
+    index_names(db, survivors)
+    db.commit()
+
+    counts = dict(db.query(TrigramCount.trigram, TrigramCount.count).all())
+    assert counts[" an"] == 1 and counts["nna"] == 2
+
+    unindex_names(db, survivors[:1])
+    db.commit()
+    assert db.query(TrigramCount.count).filter(TrigramCount.trigram == "nna").scalar() == 1
+    assert db.query(NameTrigram).filter(NameTrigram.survivor_id == survivors[0][0]).count() == 0
+
+    index_names(db, survivors[:1])
+    assert reindex_names(db) == 3
+    db.commit()
+    assert dict(db.query(TrigramCount.trigram, TrigramCount.count).all()) == counts
@@ -0,0 +1,70 @@
+"""Test the order book of the standing offers."""
+from app.order_book import OpenOffer, OrderBook
+
+
+def offer(offer_id, survivor_id, give="water", want="food", worth=12):
+    """Builds an open offer of the given survivor."""
+    return OpenOffer(offer_id, survivor_id, give, 3, want, worth)
+
+
+def reading(*offers):
+    """Returns a reader of the given open offers, none of them placed since the book was read."""
+    return lambda since: ("1", list(offers) if since is None else [])
+
+
+def test_claim_takes_the_oldest_balancing_offer():
+    """Test that the oldest offer of someone else giving what is wanted, worth as much, is claimed."""
+    book = OrderBook()
+    reads = []
+
+    def read_offers(since):
+        reads.append(since)
+        return reading(offer("own", "alice"), offer("other-worth", "bob", worth=8), offer("first", "bob"),
+                       offer("second", "carol"), offer("other-item", "bob", give="ammunition"))(since)
+
+    assert book.claim(("water", "food", 12), "alice", 0, read_offers).id == "first"
+    assert book.claim(("water", "food", 12), "alice", 0, read_offers).id == "second"
+    assert book.claim(("water", "food", 12), "alice", 0, read_offers) is None
+    assert book.claim(("water", "food", 12), "bob", 0, read_offers).id == "own"
+    assert reads == [None, "1", "1", "1"]
+
+
+def test_claimed_offers_can_be_put_back():
+    """Test that an offer put back after a failed fill is claimed again before the offers placed after it."""
+    book = OrderBook()
+    claimed = book.claim(("water", "food", 12), "alice", 0, reading(offer("first", "bob"), offer("second", "bob")))
+    book.add(offer("third", "carol"))
+    book.put_back(claimed)
+
+    assert [book.claim(("water", "food", 12), "alice", 0, reading()).id for _ in range(3)] == \
+        ["first", "second", "third"]
+
+
+def test_book_is_read_again_when_worths_change():
+    """Test that the book is read again once the catalogue has another version, and cancelled offers are gone."""
+    book = OrderBook()
+    filled = book.claim(("water", "food", 12), "alice", 0,
+                        reading(offer("first", "bob"), offer("second", "bob"), offer("third", "bob")))
+    book.release(filled.id)
+    book.remove("second")
+    assert book.claim(("water", "food", 12), "alice", 0, reading()).id == "third"
+
+    assert book.claim(("water", "food", 16), "alice", 1, reading(offer("fourth", "bob", worth=16))).id == "fourth"
+
+
+def test_claims_file_offers_placed_elsewhere():
+    """Test that offers placed by other processes are filed before claiming, unless known or being filled."""
+    book = OrderBook()
+    claimed = book.claim(("water", "food", 12), "alice", 0, reading(offer("first", "bob"), offer("second", "bob")))
+
+    # Read again from the same stamp, along with an offer placed elsewhere
+    placed_elsewhere = [offer("first", "bob"), offer("second", "bob"), offer("third", "carol")]
+    read_offers = lambda since: ("2", placed_elsewhere)
+    assert book.claim(("water", "food", 12), "alice", 0, read_offers).id == "second"
+    assert book.claim(("water", "food", 12), "alice", 0, read_offers).id == "third"
+    assert book.claim(("water", "food", 12), "alice", 0, read_offers) is None
+
+    book.release(claimed.id)
+    book.release("second")
+    book.release("third")
+    assert book.claim(("water", "food", 12), "alice", 0, lambda since: ("2", [offer("fourth", "carol")])).id == "fourth"
@@ -0,0 +1,74 @@
+"""Test attributing SQL statements to requests."""
+import logging
+from uuid import uuid4
+from app.alchemy_models import LatLong, Survivor
+from app.query_tracking import RequestQueries, current_queries
+import app.query_tracking as query_tracking
+
+
+def test_debug_headers(db, client, seed_data, monkeypatch):
+    """Test that responses tell how many statements the request ran, only when asked to."""
+    assert "X-DB-Query-Count" not in client.get("/survivors/").headers
+
+    monkeypatch.setattr(query_tracking, "SQL_DEBUG_HEADERS", True)
+    alice = db.query(Survivor).filter(Survivor.name == "Alice").first()
+    for response in (client.get("/survivors/"),
+                     client.get("/survivors/nearest", headers={"X-User-Id": alice.id})):
+        assert int(response.headers["X-DB-Query-Count"]) > 0
+        assert float(response.headers["X-DB-Time-Ms"]) > 0
+
+    assert client.get("/").headers["X-DB-Query-Count"] == "0"
+
+
+def test_repeated_statements_are_flagged(db, seed_data, monkeypatch, caplog):
+    """Test that loading a relationship row by row is flagged, once per statement."""
+    monkeypatch.setattr(query_tracking, "SQL_INSTRUMENTATION", True)
+    monkeypatch.setattr(query_tracking, "REPEATED_QUERY_LIMIT", 3)
+    for i in range(5):
+        survivor_id = str(uuid4())
+        db.add(Survivor(id=survivor_id, name=f"Extra {i}", age=20, gender="m"))
+        db.add(LatLong(id=str(uuid4()), latitude=55.67, longitude=12.56, survivor_id=survivor_id))
+    db.commit()
+    db.expire_all()
+
+    queries = RequestQueries("GET /test")
+    token = current_queries.set(queries)
+    try:
+        with caplog.at_level(logging.WARNING, logger=query_tracking.__name__):
+            for survivor in db.query(Survivor).all():
+                _ = survivor.lastLocation  # One query per survivor
+    finally:
+        current_queries.reset(token)
+
+    warnings = [record.getMessage() for record in caplog.records if "more than 3 times" in record.getMessage()]
+    assert len(warnings) == 1
+    assert "GET /test" in warnings[0] and "FROM latlong" in warnings[0]
+    assert queries.count == 1 + db.query(Survivor).count()
+
+
+def test_slow_statements_are_logged_with_their_plan(db, seed_data, monkeypatch, caplog):
+    """Test that statements over the threshold are logged along with how SQLite runs them."""
+    monkeypatch.setattr(query_tracking, "SQL_INSTRUMENTATION", True)
+    monkeypatch.setattr(query_tracking, "SLOW_QUERY_MS", 0)
+
+    with caplog.at_level(logging.WARNING, logger=query_tracking.__name__):
+        assert db.query(Survivor).filter(Survivor.name == "Alice").count() == 1
+
+    slow = [record.getMessage() for record in caplog.records if record.getMessage().startswith("Slow statement")]
+    assert any("FROM survivors" in message and "ix_survivors_name" in message for message in slow)
+
+
+def test_statements_are_not_analysed_by_default(db, seed_data, caplog):
+    """Test that the instrumentation stays out of the way unless it is turned on."""
+    queries = RequestQueries("GET /test")
+    token = current_queries.set(queries)
+    try:
+        with caplog.at_level(logging.WARNING, logger=query_tracking.__name__):
+            for _ in range(20):
+                db.query(Survivor).filter(Survivor.name == "Alice").first()
+    finally:
+        current_queries.reset(token)
+
+    assert queries.count == 20
+    assert not queries.statements
+    assert not caplog.records
@@ -0,0 +1,74 @@
+"""Test the synthetic survivor generator."""
+from uuid import UUID
+from sqlalchemy import func, text
+from app.alchemy_models import InfectionReport, Inventory, LatLong, Survivor
+import app.crud as crud
+import app.seeding as seeding
+
+INDEXES = text("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL ORDER BY name")
+ITEMS = {"water": "water-id", "food": "food-id", "medication": "medication-id", "ammunition": "ammunition-id"}
+
+
+def test_generation_is_deterministic():
+    """Test that the same seed generates the same survivors, and another seed others."""
+    first = list(seeding.generate_batches(1000, ITEMS, seed=1, batch_size=300))
+    again = list(seeding.generate_batches(1000, ITEMS, seed=1, batch_size=300))
+    other = list(seeding.generate_batches(1000, ITEMS, seed=2, batch_size=300))
+
+    assert first == again
+    assert first != other
+
+
+def test_generated_ids_are_ordered_uuids():
+    """Test that IDs are version 4 UUIDs, ordered within and across batches."""
+    ids = [row[0] for batch in seeding.generate_batches(1000, ITEMS, seed=1, batch_size=300)
+           for row in batch["survivors"]]
+
+    assert all(UUID(survivor_id).version == 4 for survivor_id in ids)
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_generated_survivors_are_consistent():
+    """Test that infection counts match the reports, and nobody reports themselves or anyone twice."""
+    batch = next(seeding.generate_batches(5000, ITEMS, seed=1))
+    reports = [(reported, reporter) for _, reported, reporter in batch["infection_reports"]]
+    counts = {survivor_id: infection_count for survivor_id, *_, infection_count in batch["survivors"]}
+
+    assert all(reported != reporter for reported, reporter in reports)
+    assert len(set(reports)) == len(reports)
+    assert sum(counts.values()) == len(reports)
+    assert any(count >= crud.INFECTION_THRESHOLD for count in counts.values())
+    assert {item_id for _, item_id, _ in batch["inventory"]} == set(ITEMS.values())
+
+
+def test_seed_survivors(db, seed_data):
+    """Test bulk loading survivors that can be found and traded with."""
+    survivor_count = db.query(Survivor).count()
+
+    assert seeding.seed_survivors(db, 500, seed=3) == 500
+    assert db.query(Survivor).count() == survivor_count + 500
+    assert db.query(LatLong).count() == survivor_count + 500
+    assert db.query(Inventory).count() > 500
+
+    # Infection counts agree with the reports on file
+    reported = dict(db.query(InfectionReport.reported_id, func.count()).group_by(InfectionReport.reported_id).all())
+    survivors = db.query(Survivor).filter(Survivor.infection_count > 0).all()
+    assert {survivor.id: survivor.infection_count for survivor in survivors} == reported
+
+    # Everybody is indexed for fuzzy search
+    survivor = db.query(Survivor).filter(Survivor.infection_count == 0, Survivor.name.like("% %")).first()
+    matches = crud.fuzzy_search_survivors(db, survivor.name, 100, 1.0)
+    assert survivor.id in {match["id"] for match in matches}
+
+
+def test_large_loads_rebuild_the_indexes(db, seed_data, monkeypatch):
+    """Test that the indexes dropped for a large load are back afterwards."""
+    indexes_before = db.execute(INDEXES).all()
+    monkeypatch.setattr(seeding, "REBUILD_INDEXES_FROM", 100)
+
+    seeding.seed_survivors(db, 200, seed=4, with_name_index=False)
+
+    indexes_after = db.execute(INDEXES).all()
+    assert indexes_after == indexes_before
+    assert ("ix_survivors_name_lower",) in indexes_after
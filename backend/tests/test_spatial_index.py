@@ -0,0 +1,77 @@
+"""Test the spatial index of survivor positions."""
+import numpy as np
+from app.geo import HAVERSINE, distances, to_unit_sphere
+from app.spatial_index import KDTree, SurvivorIndex
+
+
+def brute_force_nearest(positions, point, k, exclude_id=None):
+    """Returns the IDs of the k positions nearest to the point by sorting them all."""
+    return [survivor_id for _, survivor_id in sorted(
+        (sum((a - b) ** 2 for a, b in zip(position, point)), survivor_id)
+        for survivor_id, position in positions.items() if survivor_id != exclude_id)[:k]]
+
+
+def random_position(rng):
+    """Returns a random position on the unit sphere."""
+    return to_unit_sphere(rng.uniform(-90, 90), rng.uniform(-180, 180))
+
+
+def test_nearest_matches_brute_force_through_changes():
+    """Test that the tree finds the same survivors as a full sort while survivors come, move and go."""
+    rng = np.random.default_rng(42)
+    positions = {f"s{i}": random_position(rng) for i in range(300)}
+    tree = KDTree(positions)
+
+    for step in range(600):
+        survivor_id = f"s{rng.integers(400)}"
+        if step % 3 == 0:
+            tree.remove(survivor_id)
+            positions.pop(survivor_id, None)
+        else:
+            positions[survivor_id] = random_position(rng)
+            tree.insert(survivor_id, positions[survivor_id])
+
+        if tree.needs_rebuild():
+            tree = tree.rebuilt()
+
+        if step % 50 == 0:
+            point = random_position(rng)
+            found = [survivor_id for _, survivor_id in tree.nearest(point, 7, "s1")]
+            assert found == brute_force_nearest(positions, point, 7, "s1")
+
+    assert len(tree) == len(positions)
+
+
+def test_index_reports_great_circle_distances():
+    """Test that the index measures distances in meters like the haversine formula."""
+    index = SurvivorIndex()
+    latitudes = np.array([56.162939, 55.676123, np.nan])
+    longitudes = np.array([10.203921, 12.568432, np.nan])
+
+    found = index.nearest(55.675419, 12.564300, 5, None,
+                          lambda since: ("", (np.array(["aarhus", "nearby", "unknown"]), latitudes, longitudes), []))
+
+    assert [survivor_id for survivor_id, _ in found] == ["nearby", "aarhus"]
+    expected = distances(55.675419, 12.564300, latitudes[:2], longitudes[:2], HAVERSINE)
+    assert abs(found[0][1] - expected[1]) < 1
+    assert abs(found[1][1] - expected[0]) < 1
+
+
+def test_index_catches_up_with_changes_made_elsewhere():
+    """Test that every query applies the changes read since the previous one, moves and removals alike."""
+    index = SurvivorIndex()
+    reads = []
+    changes = {
+        None: ("1", (np.array(["a", "b"]), np.array([55.0, 55.1]), np.array([12.0, 12.1])), []),
+        "1": ("2", (np.array(["c", "a"]), np.array([55.05, 40.0]), np.array([12.05, 0.0])), ["b"]),
+        "2": ("2", (np.array([], dtype=str), np.array([]), np.array([])), []),
+    }
+
+    def read_changes(since):
+        reads.append(since)
+        return changes[since]
+
+    assert [survivor_id for survivor_id, _ in index.nearest(55.0, 12.0, 3, None, read_changes)] == ["a", "b"]
+    assert [survivor_id for survivor_id, _ in index.nearest(55.0, 12.0, 3, None, read_changes)] == ["c", "a"]
+    assert [survivor_id for survivor_id, _ in index.nearest(55.0, 12.0, 3, None, read_changes)] == ["c", "a"]
+    assert reads == [None, "1", "2"]